@@ -140,6 +140,42 @@ def test(context: Context, test_labels=None):
     return DiscoverRunner(verbosity=context.verbosity, interactive=False, failfast=False).run_tests(test_labels)
 
 
+@tasks.register('setup_django_for_testing')
+def benchmark_api_client(context: Context, calls=2000, results=20):
+    """
+    Micro-benchmarks the lean api client against slumber connections using canned mtp-api responses
+    """
+    from tests.benchmarks import benchmark_api_client as benchmark
+
+    durations = benchmark(calls=calls, results=results)
+    context.info(f'slumber: {durations["slumber"] * 1e6:.1f}µs per call')
+    context.info(f'ApiClient: {durations["api_client"] * 1e6:.1f}µs per call')
+    context.info(f'Speed-up: {durations["slumber"] / durations["api_client"]:.2f}×')
+
+
+@tasks.register('setup_django_for_testing')
+def benchmark_nomis(context: Context, calls=1000, concurrency=10, latency: float = 0.02, error_rate: float = 0,
+                    token_lifetime: float = 0, max_p95: float = 0, min_throughput: float = 0):
+    """
+    Benchmarks the Prison API connector against a local stand-in for HMPPS Auth and Prison API;
+    token lifetime and thresholds are not applied if 0
+    """
+    from tests.benchmarks import benchmark_nomis as benchmark
+
+    results, failures = benchmark(
+        calls=calls, concurrency=concurrency, latency=latency, error_rate=error_rate,
+        token_lifetime=token_lifetime or None, max_p95=max_p95 or None, min_throughput=min_throughput or None,
+    )
+    context.info(
+        'Made {calls} calls on {concurrency} threads in {duration:.2f}s with {errors} errors'.format(**results)
+    )
+    context.info('Throughput: {throughput:.1f} calls/s'.format(**results))
+    context.info('Latency: mean {mean:.4f}s, p50 {p50:.4f}s, p95 {p95:.4f}s, p99 {p99:.4f}s'.format(**results))
+    context.info('Token refreshes: {token_refreshes}'.format(**results))
+    if failures:
+        raise TaskError('Benchmark failed: ' + '; '.join(failures))
+
+
 @tasks.register()
 def bump_version(context: Context, major=False, minor=False, patch=False):
     """
@@ -1,5 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import json
 import logging
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
 
 from django.conf import settings
 from django.contrib import messages
@@ -31,72 +36,318 @@ def api_errors_to_messages(request, error, fallback_text):
         messages.error(request, fallback_text)
 
 
-def retrieve_all_pages(api_endpoint, **kwargs):
+OFFSET_PAGINATION = 'offset'
+CURSOR_PAGINATION = 'cursor'
+KEYSET_PAGINATION = 'keyset'
+
+
+def _first_page_params(page_size, pagination, keyset_field, page_size_param='limit'):
+    if pagination == OFFSET_PAGINATION:
+        return {'limit': page_size, 'offset': 0}
+    if pagination == CURSOR_PAGINATION:
+        # CursorPagination only accepts a page size if its `page_size_query_param` is set
+        return {page_size_param: page_size}
+    if pagination == KEYSET_PAGINATION:
+        return {'limit': page_size, 'ordering': keyset_field}
+    raise ValueError(f'Unknown pagination strategy {pagination}')
+
+
+def _next_page_params(response, page_params, pagination, keyset_field):
+    """
+    :return: pagination params to load the page after `response` or None if it was the last
+    """
+    results = response.get('results', [])
+    if not results:
+        return None
+    if pagination == CURSOR_PAGINATION:
+        next_link = response.get('next')
+        if not next_link:
+            return None
+        return {
+            param: values if len(values) > 1 else values[0]
+            for param, values in parse_qs(urlsplit(next_link).query).items()
+        }
+    if pagination == KEYSET_PAGINATION:
+        if 'next' in response and not response['next']:
+            return None
+        return {**page_params, f'{keyset_field}__gt': results[-1][keyset_field]}
+    # the api may cap the page size so step by the number of results received
+    offset = page_params['offset'] + len(results)
+    if offset >= response.get('count', 0):
+        return None
+    return {**page_params, 'offset': offset}
+
+
+def _iterate_all_pages(load_page, page_size=None, prefetch=False, pagination=OFFSET_PAGINATION, keyset_field='id',
+                       page_size_param='limit'):
+    """
+    Yields results of all pages loaded using `load_page(params)` which returns the decoded response
+    given pagination params for the chosen strategy:
+    - `offset`: limit and offset as used by LimitOffsetPagination; slows down as offset grows
+    - `cursor`: follows `next` links, e.g. as returned by CursorPagination;
+      the page size is sent as `page_size_param` which must match the paginator's `page_size_query_param`
+    - `keyset`: filters by `keyset_field` greater than the last result's, ordering by it
+    If `prefetch` is set, the next page is loaded in a background thread while the current one is consumed.
+    """
+    page_size = page_size or getattr(settings, 'REQUEST_PAGE_SIZE', 20)
+    page_params = _first_page_params(page_size, pagination, keyset_field, page_size_param)
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        response = load_page(page_params)
+        while True:
+            page_params = _next_page_params(response, page_params, pagination, keyset_field)
+            next_page = None
+            if executor and page_params:
+                next_page = executor.submit(contextvars.copy_context().run, load_page, page_params)
+            yield from response.get('results', [])
+            if not page_params:
+                break
+            response = next_page.result() if next_page else load_page(page_params)
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _retrieve_all_pages(load_page, page_size=None, max_workers=None, pagination=OFFSET_PAGINATION,
+                        keyset_field='id', page_size_param='limit'):
+    """
+    Loads all pages using `load_page(params)` which returns the decoded response.
+    With offset pagination, the first response provides the total count so, if `max_workers` is more than 1,
+    the remaining pages are then loaded concurrently and reassembled in order.
+    """
+    page_size = page_size or getattr(settings, 'REQUEST_PAGE_SIZE', 20)
+    max_workers = max_workers or getattr(settings, 'REQUEST_PAGE_CONCURRENCY', 1)
+    if max_workers <= 1 or pagination != OFFSET_PAGINATION:
+        return list(_iterate_all_pages(
+            load_page, page_size=page_size, pagination=pagination, keyset_field=keyset_field,
+            page_size_param=page_size_param,
+        ))
+
+    response = load_page({'limit': page_size, 'offset': 0})
+    count = response.get('count', 0)
+    loaded_results = list(response.get('results', []))
+    if not loaded_results or len(loaded_results) >= count:
+        return loaded_results
+
+    # the api may cap the page size so use the size of the first page to find remaining offsets
+    page_size = len(loaded_results)
+    offsets = range(page_size, count, page_size)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(offsets))) as executor:
+        # pages are loaded in copies of the current context so that tracing spans have the right parent
+        futures = [
+            executor.submit(contextvars.copy_context().run, load_page, {'limit': page_size, 'offset': offset})
+            for offset in offsets
+        ]
+        for future in futures:
+            loaded_results += future.result().get('results', [])
+    return loaded_results
+
+
+def _check_params(params, pagination, keyset_field):
+    if pagination == KEYSET_PAGINATION and params.get('ordering', keyset_field) != keyset_field:
+        raise ValueError(f'Keyset pagination orders by {keyset_field} so cannot order by {params["ordering"]}')
+
+
+def retrieve_all_pages(api_endpoint, *, _page_size=None, _max_workers=None, _pagination=OFFSET_PAGINATION,
+                       _keyset_field='id', _page_size_param='limit', **kwargs):
     """
     Some MTP apis are paginated using Django Rest Framework's LimitOffsetPagination paginator,
-    this method loads all pages into a single results list
+    this method loads all pages into a single results list.
+    Options are prefixed with an underscore so as not to clash with api filters.
     :param api_endpoint: slumber callable, e.g. `[api_client].cashbook.transactions.locked.get`
+    :param _page_size: number of results per page, defaults to `REQUEST_PAGE_SIZE` setting
+    :param _max_workers: number of pages to load at once with offset pagination,
+        defaults to `REQUEST_PAGE_CONCURRENCY` setting
+    :param _pagination: `OFFSET_PAGINATION`, `CURSOR_PAGINATION` or `KEYSET_PAGINATION` on `_keyset_field`
+    :param _page_size_param: URL param for the page size with cursor pagination, i.e. the paginator's
+        `page_size_query_param`, which DRF's CursorPagination does not set by default so `_page_size` is ignored
     :param kwargs: additional arguments to pass into api callable
     """
-    page_size = getattr(settings, 'REQUEST_PAGE_SIZE', 20)
-    loaded_results = []
+    _check_params(kwargs, _pagination, _keyset_field)
+    return _retrieve_all_pages(
+        lambda params: api_endpoint(**{**kwargs, **params}),
+        page_size=_page_size,
+        max_workers=_max_workers,
+        pagination=_pagination,
+        keyset_field=_keyset_field,
+        page_size_param=_page_size_param,
+    )
 
-    offset = 0
-    while True:
-        response = api_endpoint(limit=page_size, offset=offset,
-                                **kwargs)
-        count = response.get('count', 0)
-        loaded_results += response.get('results', [])
-        if len(loaded_results) >= count:
-            break
-        offset += page_size
 
-    return loaded_results
+def retrieve_all_pages_for_path(session, path, *, _page_size=None, _max_workers=None, _pagination=OFFSET_PAGINATION,
+                                _keyset_field='id', _page_size_param='limit', **params):
+    """
+    Some MTP apis are paginated using Django Rest Framework's LimitOffsetPagination paginator,
+    this method loads all pages into a single results list.
+    Options are prefixed with an underscore so as not to clash with URL params.
+    :param session: Requests Session object, shared by all threads if pages are loaded concurrently
+    :param path: URL path
+    :param _page_size: number of results per page, defaults to `REQUEST_PAGE_SIZE` setting
+    :param _max_workers: number of pages to load at once with offset pagination,
+        defaults to `REQUEST_PAGE_CONCURRENCY` setting
+    :param _pagination: `OFFSET_PAGINATION`, `CURSOR_PAGINATION` or `KEYSET_PAGINATION` on `_keyset_field`
+    :param _page_size_param: URL param for the page size with cursor pagination, i.e. the paginator's
+        `page_size_query_param`, which DRF's CursorPagination does not set by default so `_page_size` is ignored
+    :param params: additional URL params
+    """
+    _check_params(params, _pagination, _keyset_field)
+    return _retrieve_all_pages(
+        lambda page_params: session.get(path, params={**params, **page_params}).json(),
+        page_size=_page_size,
+        max_workers=_max_workers,
+        pagination=_pagination,
+        keyset_field=_keyset_field,
+        page_size_param=_page_size_param,
+    )
 
 
-def retrieve_all_pages_for_path(session, path, **params):
+def iterate_all_pages(api_endpoint, *, _page_size=None, _prefetch=False, _pagination=OFFSET_PAGINATION,
+                      _keyset_field='id', _page_size_param='limit', **kwargs):
     """
-    Some MTP apis are paginated using Django Rest Framework's LimitOffsetPagination paginator,
-    this method loads all pages into a single results list
+    Like `retrieve_all_pages` but yields results page by page so that large collections can be streamed,
+    e.g. into CSV exports, without holding them all in memory
+    :param api_endpoint: slumber callable, e.g. `[api_client].cashbook.transactions.locked.get`
+    :param _page_size: number of results per page, defaults to `REQUEST_PAGE_SIZE` setting
+    :param _prefetch: load the next page in the background while the current one is consumed
+    :param _pagination: `OFFSET_PAGINATION`, `CURSOR_PAGINATION` or `KEYSET_PAGINATION` on `_keyset_field`
+    :param _page_size_param: URL param for the page size with cursor pagination, i.e. the paginator's
+        `page_size_query_param`, which DRF's CursorPagination does not set by default so `_page_size` is ignored
+    :param kwargs: additional arguments to pass into api callable
+    """
+    _check_params(kwargs, _pagination, _keyset_field)
+    return _iterate_all_pages(
+        lambda params: api_endpoint(**{**kwargs, **params}),
+        page_size=_page_size,
+        prefetch=_prefetch,
+        pagination=_pagination,
+        keyset_field=_keyset_field,
+        page_size_param=_page_size_param,
+    )
+
+
+def iterate_all_pages_for_path(session, path, *, _page_size=None, _prefetch=False, _pagination=OFFSET_PAGINATION,
+                               _keyset_field='id', _page_size_param='limit', **params):
+    """
+    Like `retrieve_all_pages_for_path` but yields results page by page so that large collections can be streamed,
+    e.g. into CSV exports, without holding them all in memory
     :param session: Requests Session object
     :param path: URL path
+    :param _page_size: number of results per page, defaults to `REQUEST_PAGE_SIZE` setting
+    :param _prefetch: load the next page in the background while the current one is consumed
+    :param _pagination: `OFFSET_PAGINATION`, `CURSOR_PAGINATION` or `KEYSET_PAGINATION` on `_keyset_field`
+    :param _page_size_param: URL param for the page size with cursor pagination, i.e. the paginator's
+        `page_size_query_param`, which DRF's CursorPagination does not set by default so `_page_size` is ignored
     :param params: additional URL params
     """
-    page_size = getattr(settings, 'REQUEST_PAGE_SIZE', 20)
-    loaded_results = []
-
-    offset = 0
-    while True:
-        response = session.get(
-            path,
-            params=dict(limit=page_size, offset=offset, **params)
-        )
-        content = response.json()
-        count = content.get('count', 0)
-        loaded_results += content.get('results', [])
-        if len(loaded_results) >= count:
-            break
-        offset += page_size
+    _check_params(params, _pagination, _keyset_field)
+    return _iterate_all_pages(
+        lambda page_params: session.get(path, params={**params, **page_params}).json(),
+        page_size=_page_size,
+        prefetch=_prefetch,
+        pagination=_pagination,
+        keyset_field=_keyset_field,
+        page_size_param=_page_size_param,
+    )
 
-    return loaded_results
 
+# formatted with the audience so that anonymous pages never show notifications loaded by authenticated sessions
+NOTIFICATIONS_CACHE_KEY = 'notifications-%s'
+NOTIFICATIONS_REFRESH_LOCK_KEY = 'notifications-refresh-%s'
 
-def notifications_for_request(request, target=None, use_cache=True):
-    # NB: caching can only be used since notifications are not currently set up to be user/request specific
-    cache_key = 'notifications-%s' % target
-    if use_cache:
-        results = cache.get(cache_key)
-        if results:
-            return results
+
+def _notifications_audience(request):
+    return 'authenticated' if request.user.is_authenticated else 'public'
+
+
+def _notifications_session(request):
+    if request.user.is_authenticated:
+        return api_client.get_api_session(request)
+    return api_client.get_unauthenticated_session()
+
+
+def _load_notifications(session, audience):
+    """
+    Loads all current notifications and caches them with the time they stay fresh until.
+    The cache entry itself lives much longer so that it can be served, albeit stale, during api outages.
+    """
+    notifications = retrieve_all_pages_for_path(session, 'notifications/')
+    cache.set(
+        NOTIFICATIONS_CACHE_KEY % audience,
+        {
+            'notifications': notifications,
+            'fresh_until': time.time() + getattr(settings, 'NOTIFICATIONS_CACHE_TIMEOUT', 60 * 5),
+        },
+        timeout=getattr(settings, 'NOTIFICATIONS_CACHE_FALLBACK_TIMEOUT', 60 * 60 * 24),
+    )
+    return notifications
+
+
+def _notifications_refresh_session(request):
+    """
+    Session for refreshing notifications in a background thread which must not share the request's session:
+    for authenticated users, it uses a copy of the current token and never refreshes it
+    since the result could not be saved into a django session that has already been persisted
+    """
+    if request.user.is_authenticated:
+        return api_client.MoJOAuth2Session(settings.API_CLIENT_ID, token=dict(request.user.token))
+    return api_client.get_unauthenticated_session()
+
+
+def _refresh_notifications(session, audience):
     try:
-        if request.user.is_authenticated:
-            session = api_client.get_api_session(request)
-        else:
-            session = api_client.get_unauthenticated_session()
-        response = session.get('notifications/', params={'target__startswith': target} if target else None)
-        results = response.json()['results']
-        if use_cache:
-            cache.set(cache_key, results, timeout=60 * 5)
-        return results
+        _load_notifications(session, audience)
     except (RequestException, ValueError, KeyError):
-        logger.exception('Could not load notifications')
+        logger.exception('Could not refresh notifications')
+    finally:
+        session.close()
+        cache.delete(NOTIFICATIONS_REFRESH_LOCK_KEY % audience)
+
+
+def all_notifications_for_request(request, use_cache=True):
+    """
+    Loads all pages of current notifications, memoised on the request so that
+    showing notifications for several targets on one page needs at most one cache lookup and one api load.
+    Notifications are loaded and cached separately for anonymous and authenticated users.
+    Once cached notifications are no longer fresh, they continue to be served while one thread refreshes them
+    in the background; they are kept for much longer to be used as a fallback while the api is unavailable.
+    """
+    audience = _notifications_audience(request)
+    memoised = getattr(request, '_mtp_notifications', None)
+    if isinstance(memoised, tuple) and memoised[0] == audience:
+        return memoised[1]
+
+    # NB: caching can only be used since notifications are not currently set up to be user/request specific
+    cache_key = NOTIFICATIONS_CACHE_KEY % audience
+    cached = cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        notifications = cached['notifications']
+        stale = cached['fresh_until'] <= time.time()
+        if stale and cache.add(NOTIFICATIONS_REFRESH_LOCK_KEY % audience, True, timeout=30):
+            threading.Thread(
+                target=_refresh_notifications, args=(_notifications_refresh_session(request), audience), daemon=True,
+            ).start()
+    else:
+        try:
+            notifications = _load_notifications(_notifications_session(request), audience)
+        except (RequestException, ValueError, KeyError):
+            logger.exception('Could not load notifications')
+            notifications = []
+            if use_cache:
+                # subsequent requests should not wait on the api but try refreshing in the background
+                cache.set(cache_key, {'notifications': notifications, 'fresh_until': 0}, timeout=60)
+    request._mtp_notifications = (audience, notifications)
+    return notifications
+
+
+def notifications_for_request(request, target=None, use_cache=True):
+    """
+    Returns current notifications whose target starts with `target`, or all if not specified
+    """
+    notifications = all_notifications_for_request(request, use_cache=use_cache)
+    if not target:
+        return notifications
+    return [
+        notification
+        for notification in notifications
+        if (notification.get('target') or '').startswith(target)
+    ]
@@ -1,12 +1,29 @@
-from functools import partial
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import lru_cache, partial
+import hashlib
+import hmac
+import json
+import logging
 import os
-from urllib.parse import urlsplit
+import string
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+import weakref
 
+from cryptography.fernet import Fernet, InvalidToken
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import get_language
-from oauthlib.oauth2 import LegacyApplicationClient
+from oauthlib.oauth2 import LegacyApplicationClient, OAuth2Error, TokenExpiredError
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from requests.structures import CaseInsensitiveDict
 from requests_oauthlib import OAuth2Session
 import slumber
 
@@ -15,6 +32,18 @@ from .exceptions import (
     Unauthorized, Forbidden, HttpNotFoundError, HttpClientError, HttpServerError
 )
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('mtp')
+
 
 # set insecure transport depending on settings val
 if getattr(settings, 'OAUTHLIB_INSECURE_TRANSPORT', False):
@@ -29,6 +58,153 @@ def get_revoke_token_url():
     return urljoin(settings.API_URL, '/oauth2/revoke_token/')
 
 
+_shared_adapter = None
+_shared_adapter_pid = None
+_shared_adapter_lock = threading.Lock()
+
+
+def get_shared_api_adapter():
+    """
+    Returns the connection-pooling adapter shared by all api sessions in this process
+    so that they reuse keep-alive connections to mtp-api while carrying their own tokens.
+    A new one is built after forking (e.g. in each uWSGI worker) so that sockets are never shared between processes.
+    """
+    global _shared_adapter, _shared_adapter_pid
+
+    pid = os.getpid()
+    if _shared_adapter is None or _shared_adapter_pid != pid:
+        with _shared_adapter_lock:
+            if _shared_adapter is None or _shared_adapter_pid != pid:
+                _shared_adapter = HTTPAdapter(
+                    pool_connections=getattr(settings, 'API_POOL_CONNECTIONS', 1),
+                    pool_maxsize=getattr(settings, 'API_POOL_MAXSIZE', 10),
+                )
+                _shared_adapter_pid = pid
+    return _shared_adapter
+
+
+def parse_cache_control(value):
+    """
+    :return: dict of lower-case `Cache-Control` directive names to their arguments, if any
+    """
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+class ApiResponseCache:
+    """
+    Opt-in HTTP cache for GET requests made with `MoJOAuth2Session`, storing responses in the Django cache:
+    - responses are reused without making requests for as long as `Cache-Control: max-age` allows
+    - otherwise, responses with an `ETag` or `Last-Modified` header are revalidated with conditional requests
+      and reused if the api responds with 304 Not Modified
+    - `no-store` responses are never cached and `no-cache` ones are always revalidated
+    - responses that `Vary` on request headers other than `Accept-Language` and `Accept-Encoding` are never cached
+      since only the language is part of the cache key and content is stored decoded
+    Entries are separated by `partition`, e.g. the user's pk, for endpoints whose responses depend on the user.
+    Without a partition, responses to authenticated requests are only cached if marked `public`.
+    Revalidation entries are kept for `API_RESPONSE_CACHE_TIMEOUT` seconds.
+    """
+
+    varying_headers_allowed = {'accept-language', 'accept-encoding'}
+    # stored content is already decoded and complete so these no longer describe it
+    excluded_headers = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+    def __init__(self, partition=None, timeout=None):
+        self.partition = partition
+        self.timeout = timeout or getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60 * 60)
+
+    def cache_key(self, url, params, language):
+        if isinstance(params, (dict, list, tuple)):
+            params = urlencode(params, doseq=True)
+        request_hash = hashlib.sha256(f'{url}?{params or ""}#{language or ""}'.encode()).hexdigest()
+        return f'api-response-{self.partition or "shared"}-{request_hash}'
+
+    def fetch(self, send, url, params=None, headers=None, language=None, authenticated=False):
+        """
+        Returns a cached response or the response from calling `send(headers=...)`, caching it if allowed.
+        """
+        key = self.cache_key(url, params, language)
+        entry = cache.get(key)
+        if entry and entry['fresh_until'] > time.time():
+            return self.build_response(entry)
+
+        headers = dict(headers or {})
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = send(headers=headers)
+
+        if entry and response.status_code == 304:
+            cache_control = parse_cache_control(response.headers.get('Cache-Control'))
+            entry['fresh_until'] = time.time() + self.max_age(cache_control)
+            entry['etag'] = response.headers.get('ETag') or entry['etag']
+            entry['last_modified'] = response.headers.get('Last-Modified') or entry['last_modified']
+            self.store(key, entry, cache_control)
+            return self.build_response(entry)
+
+        if response.status_code == 200:
+            self.store_response(key, response, authenticated)
+        return response
+
+    def max_age(self, cache_control):
+        if 'no-cache' in cache_control:
+            return 0
+        try:
+            return max(0, int(cache_control.get('max-age') or 0))
+        except ValueError:
+            return 0
+
+    def store_response(self, key, response, authenticated):
+        cache_control = parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in cache_control:
+            return
+        vary = {header.strip().lower() for header in response.headers.get('Vary', '').split(',') if header.strip()}
+        if vary - self.varying_headers_allowed:
+            return
+        if self.partition is None and ('private' in cache_control or (
+            authenticated and 'public' not in cache_control
+        )):
+            return
+        max_age = self.max_age(cache_control)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (max_age or etag or last_modified):
+            return
+        self.store(key, {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': {
+                header: value
+                for header, value in response.headers.items()
+                if header.lower() not in self.excluded_headers
+            },
+            'encoding': response.encoding,
+            'content': response.content,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh_until': time.time() + max_age,
+        }, cache_control)
+
+    def store(self, key, entry, cache_control):
+        cache.set(key, entry, timeout=max(self.max_age(cache_control), self.timeout))
+
+    def build_response(self, entry):
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = entry['content']
+        response.url = entry['url']
+        response.from_cache = True
+        return response
+
+
 class LocalisedOAuth2Session(OAuth2Session):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -67,16 +243,145 @@ def error_status_response_hook(response, *args, **kwargs):
 
 
 class MoJOAuth2Session(LocalisedOAuth2Session):
-
-    def __init__(self, *args, **kwargs):
+    """
+    Session for calling mtp-api with an OAuth2 token that is refreshed automatically
+    shortly before it expires (`API_TOKEN_REFRESH_MARGIN` seconds).
+    Only one thread or process refreshes a given token at a time, coordinated through a lock in the Django cache.
+    The new token is then handed off to other processes holding the same refresh token, e.g. serving concurrent
+    requests with the same signed-cookie session, by keeping it in the cache for `token_handoff_timeout` seconds.
+    It is stored under a hash of the old refresh token and encrypted with a key derived from it and `SECRET_KEY`,
+    so only holders of the old refresh token can find and read it; the trade-off is that, for those few seconds,
+    anyone with both the cache contents and the old refresh token could obtain the new one.
+    A process that finds another one refreshing the same token carries on with its current token while it is
+    still valid, otherwise it waits for the new token to be handed off.
+    """
+    token_lock_timeout = 30
+    token_wait_timeout = 10
+    token_poll_interval = 0.1
+    token_handoff_timeout = 10
+
+    def __init__(self, *args, response_cache=None, **kwargs):
+        """
+        :param response_cache: optional `ApiResponseCache` for GET requests
+        """
         super().__init__(*args, **kwargs)
         self.hooks['response'] = [error_status_response_hook]
         self.base_url = settings.API_URL
+        self.mount(settings.API_URL, get_shared_api_adapter())
+        self.response_cache = response_cache
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def token_expires_soon(self):
+        expires_at = (self.token or {}).get('expires_at')
+        if expires_at is None:
+            return False
+        return float(expires_at) - getattr(settings, 'API_TOKEN_REFRESH_MARGIN', 60) < time.time()
+
+    @property
+    def token_expired(self):
+        expires_at = (self.token or {}).get('expires_at')
+        if expires_at is None:
+            return False
+        return float(expires_at) <= time.time()
+
+    def refresh_token(self, token_url, refresh_token=None, **kwargs):
+        refresh_token = refresh_token or (self.token or {}).get('refresh_token')
+        # threads sharing this session wait for one of them to refresh the token
+        with self._refresh_lock:
+            if (self.token or {}).get('refresh_token') != refresh_token:
+                return self.token
+
+            key_prefix = 'api-token-refresh-%s' % hashlib.sha256(str(refresh_token).encode()).hexdigest()
+            lock_key, handoff_key = f'{key_prefix}-lock', f'{key_prefix}-token'
+            token = self._handed_off_token(handoff_key, refresh_token)
+            locked = False
+            if not token:
+                locked = cache.add(lock_key, os.getpid(), timeout=self.token_lock_timeout)
+                if not locked:
+                    token = self._await_refresh_elsewhere(lock_key, handoff_key, refresh_token)
+            if token:
+                self.token = token
+                return token
+
+            try:
+                token = super().refresh_token(token_url, refresh_token=refresh_token, **kwargs)
+                cache.set(
+                    handoff_key, self._token_cipher(refresh_token).encrypt(json.dumps(token).encode()),
+                    timeout=self.token_handoff_timeout,
+                )
+                return token
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+
+    @staticmethod
+    def _token_cipher(refresh_token):
+        key = hmac.new(settings.SECRET_KEY.encode(), f'api-token-handoff-{refresh_token}'.encode(), hashlib.sha256)
+        return Fernet(base64.urlsafe_b64encode(key.digest()))
+
+    def _handed_off_token(self, handoff_key, refresh_token):
+        encrypted_token = cache.get(handoff_key)
+        if not encrypted_token:
+            return None
+        try:
+            return json.loads(self._token_cipher(refresh_token).decrypt(encrypted_token))
+        except (InvalidToken, ValueError):
+            return None
+
+    def _await_refresh_elsewhere(self, lock_key, handoff_key, refresh_token):
+        """
+        Called when another process is refreshing the same token
+        :return: the token to continue with or None if this session needs to refresh it after all
+        """
+        if not self.token_expired:
+            return self.token
+        deadline = time.monotonic() + self.token_wait_timeout
+        while cache.get(lock_key) is not None:
+            if time.monotonic() >= deadline:
+                logger.warning('Gave up waiting for another process to refresh api token')
+                break
+            time.sleep(self.token_poll_interval)
+            token = self._handed_off_token(handoff_key, refresh_token)
+            if token:
+                return token
+        return self._handed_off_token(handoff_key, refresh_token)
+
+    def close(self):
+        # the shared adapter's connections outlive any one session
+        shared_adapter = get_shared_api_adapter()
+        for adapter in self.adapters.values():
+            if adapter is not shared_adapter:
+                adapter.close()
+
+    def _refresh_token_early(self, timeout):
+        # failing to refresh a token that is still valid should not fail the request
+        token = self.token
+        try:
+            refreshed_token = self.refresh_token(self.auto_refresh_url, timeout=timeout)
+        except (requests.RequestException, OAuth2Error):
+            if self.token_expired:
+                raise
+            logger.warning('Could not refresh api token before it expires', exc_info=True)
+            return
+        if self.token_updater and refreshed_token is not token:
+            self.token_updater(refreshed_token)
 
     def request(self, method, url, data=None, headers=None, **kwargs):
         if self.base_url and not urlsplit(url).scheme:
             url = urljoin(self.base_url, url)
         kwargs.setdefault('timeout', 30)
+        if self.auto_refresh_url and not kwargs.get('withhold_token') and self.token_expires_soon:
+            self._refresh_token_early(timeout=kwargs['timeout'])
+        if self.response_cache is not None and method.upper() == 'GET' and not kwargs.get('stream'):
+            return self.response_cache.fetch(
+                partial(super().request, method, url, data=data, **kwargs),
+                url,
+                params=kwargs.get('params'),
+                headers=headers,
+                language=self.headers.get('Accept-Language'),
+                authenticated=bool(self.token),
+            )
         return super().request(method, url, data=data, headers=headers, **kwargs)
 
 
@@ -133,17 +438,27 @@ def revoke_token(access_token):
 
 
 def get_api_session(request):
-    return get_api_session_with_session(request.user, request.session)
+    """
+    Returns an api session with the token of the logged-in user,
+    reusing the same one for the rest of the request.
+    """
+    cached = getattr(request, '_mtp_api_session', None)
+    if isinstance(cached, tuple) and cached[0] is request.user:
+        return cached[1]
+    session = get_api_session_with_session(request.user, request.session)
+    request._mtp_api_session = (request.user, session)
+    return session
+
+
+def _token_saver(token, session, user):
+    user.token = token
+    update_token_in_session(session, token)
 
 
 def get_api_session_with_session(user, session):
     if not user:
         raise Unauthorized('no such user')
 
-    def token_saver(token, session, user):
-        user.token = token
-        update_token_in_session(session, token)
-
     session = MoJOAuth2Session(
         settings.API_CLIENT_ID,
         token=user.token,
@@ -152,12 +467,57 @@ def get_api_session_with_session(user, session):
             'client_id': settings.API_CLIENT_ID,
             'client_secret': settings.API_CLIENT_SECRET
         },
-        token_updater=partial(token_saver, session=session, user=user)
+        token_updater=partial(_token_saver, session=session, user=user)
     )
 
     return session
 
 
+def get_concurrently(session, paths, max_workers=None):
+    """
+    Makes independent GET requests concurrently on a bounded thread pool sharing one api session,
+    and hence its token (refreshed at most once) and pooled connections.
+    ```
+    responses = get_concurrently(get_api_session(request), {
+        'credits': ('credits/', {'status': 'credit_pending'}),
+        'prisons': 'prisons/',
+    })
+    ```
+    :param session: api session, e.g. from `get_api_session`
+    :param paths: dict of any hashable key to a path or a tuple of path and query params
+    :param max_workers: maximum concurrent requests, defaults to `API_MAX_CONCURRENCY` setting
+    :return: dict of the same keys to the decoded response or the exception raised
+    """
+    if not paths:
+        return {}
+
+    def get(path):
+        path, params = (path, None) if isinstance(path, str) else path
+        return session.get(path, params=params).json()
+
+    max_workers = max_workers or getattr(settings, 'API_MAX_CONCURRENCY', 4)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        futures = {
+            key: executor.submit(contextvars.copy_context().run, get, path)
+            for key, path in paths.items()
+        }
+        return {
+            key: future.exception() or future.result()
+            for key, future in futures.items()
+        }
+
+
+def get_cached_api_session(request, shared=False):
+    """
+    Returns a new api session with the token of the logged-in user which caches GET responses
+    as allowed by their `Cache-Control`, `ETag` and `Last-Modified` headers, e.g. for reference data.
+    :param shared: share cached responses between users, in which case only `public` responses are cached
+    """
+    session = get_api_session_with_session(request.user, request.session)
+    session.response_cache = ApiResponseCache(partition=None if shared else request.user.pk)
+    return session
+
+
 def get_authenticated_api_session(username, password):
     """
     :return: an authenticated api session
@@ -183,6 +543,184 @@ def get_unauthenticated_session():
     return MoJOAuth2Session()
 
 
+# asyncio session methods
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_shared_async_api_client():
+    """
+    Returns the keep-alive httpx client shared by all async api sessions on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        if httpx is None:
+            raise ImproperlyConfigured('httpx must be installed to use AsyncMoJOAuth2Session')
+        pool_maxsize = getattr(settings, 'API_POOL_MAXSIZE', 10)
+        client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=pool_maxsize,
+            max_keepalive_connections=pool_maxsize,
+        ))
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose_shared_async_api_client():
+    """
+    Closes the pooled client of the running event loop, e.g. in an ASGI lifespan shutdown handler.
+    NB: async views served by WSGI run on a new event loop each time so should either use `run_async`,
+    close the pooled client before returning or pass their own `client` to the api session.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def run_async(coroutine):
+    """
+    Runs a coroutine in a new event loop, e.g. from a WSGI view, closing the pooled client afterwards.
+    ```
+    credits, disbursements = run_async(asyncio.gather(session.get('credits/'), session.get('disbursements/')))
+    ```
+    """
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await aclose_shared_async_api_client()
+
+    return asyncio.run(run_and_close())
+
+
+class AsyncMoJOAuth2Session:
+    """
+    Asyncio equivalent of `MoJOAuth2Session` so that many api calls can be made concurrently,
+    e.g. using `asyncio.gather`. Requires the optional `httpx` package.
+    - paths are joined to `settings.API_URL`
+    - requests are localised using the `Accept-Language` header
+    - error responses raise the same exceptions as `error_status_response_hook`
+    - a token about to expire is refreshed once however many requests are waiting and passed to `token_updater`
+    Unless a `client` is provided, the session uses a pooled client shared on the running event loop
+    which must be closed before the loop shuts down using `aclose_shared_async_api_client` or `run_async`.
+    """
+
+    def __init__(self, token=None, auto_refresh_url=None, auto_refresh_kwargs=None, token_updater=None,
+                 client=None):
+        self.token = token
+        self.auto_refresh_url = auto_refresh_url
+        self.auto_refresh_kwargs = auto_refresh_kwargs or {}
+        self.token_updater = token_updater
+        self.headers = {'Accept-Language': get_language() or settings.LANGUAGE_CODE}
+        self.base_url = settings.API_URL
+        self.response_hook = error_status_response_hook
+        self._client = client
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_shared_async_api_client()
+
+    @property
+    def token_expires_soon(self):
+        expires_at = (self.token or {}).get('expires_at')
+        if expires_at is None:
+            return False
+        return float(expires_at) - getattr(settings, 'API_TOKEN_REFRESH_MARGIN', 60) < time.time()
+
+    async def refresh_token(self):
+        """
+        Fetches a new token using the refresh token and passes it to `token_updater`.
+        """
+        if not self.auto_refresh_url:
+            raise TokenExpiredError()
+        response = await self.client.post(
+            self.auto_refresh_url,
+            data={
+                'grant_type': 'refresh_token',
+                'refresh_token': self.token.get('refresh_token'),
+                **self.auto_refresh_kwargs,
+            },
+            headers={**self.headers, 'Accept': 'application/json'},
+            timeout=30,
+        )
+        self.response_hook(response)
+        token = response.json()
+        token.setdefault('refresh_token', self.token.get('refresh_token'))
+        if 'expires_in' in token:
+            token['expires_at'] = time.time() + int(token['expires_in'])
+        self.token = token
+        if self.token_updater:
+            self.token_updater(token)
+        return token
+
+    async def ensure_fresh_token(self):
+        if not self.token_expires_soon:
+            return
+        async with self._refresh_lock:
+            # another task may have refreshed the token while this one waited
+            if self.token_expires_soon:
+                await self.refresh_token()
+
+    async def request(self, method, url, headers=None, **kwargs):
+        if self.base_url and not urlsplit(url).scheme:
+            url = urljoin(self.base_url, url)
+        kwargs.setdefault('timeout', 30)
+        headers = {**self.headers, **(headers or {})}
+        if self.token:
+            await self.ensure_fresh_token()
+            headers['Authorization'] = f'Bearer {self.token["access_token"]}'
+        response = await self.client.request(method.upper(), url, headers=headers, **kwargs)
+        return self.response_hook(response)
+
+    async def get(self, url, **kwargs):
+        return await self.request('get', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('post', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request('put', url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request('patch', url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request('delete', url, **kwargs)
+
+
+def get_async_api_session(request, client=None):
+    """
+    Returns an asyncio api session with the token of the logged-in user.
+    ```
+    session = get_async_api_session(request)
+    credits, disbursements = await asyncio.gather(session.get('credits/'), session.get('disbursements/'))
+    ```
+    :param client: optional `httpx.AsyncClient` managed by the caller instead of the pooled one
+    """
+    return get_async_api_session_with_session(request.user, request.session, client=client)
+
+
+def get_async_api_session_with_session(user, session, client=None):
+    if not user:
+        raise Unauthorized('no such user')
+
+    return AsyncMoJOAuth2Session(
+        token=user.token,
+        auto_refresh_url=get_request_token_url(),
+        auto_refresh_kwargs={
+            'client_id': settings.API_CLIENT_ID,
+            'client_secret': settings.API_CLIENT_SECRET
+        },
+        token_updater=partial(_token_saver, session=session, user=user),
+        client=client,
+    )
+
+
+def get_async_unauthenticated_session(client=None):
+    return AsyncMoJOAuth2Session(client=client)
+
+
 # slumber connection methods
 
 
@@ -235,3 +773,132 @@ def _get_slumber_connection(session):
     return slumber.API(
         base_url=settings.API_URL, session=session
     )
+
+
+# lean endpoint client methods
+
+
+def decode_json(content):
+    """
+    Decodes a JSON response body using `orjson` if installed
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def encode_json(data):
+    """
+    Encodes a JSON request body using `orjson` if installed
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+class ApiEndpoint:
+    """
+    An mtp-api endpoint whose URL template is joined to `settings.API_URL` and parsed once,
+    e.g. `ApiEndpoint('credits/{pk}/')`; use `compile_endpoint` to reuse instances
+    """
+
+    def __init__(self, template, base_url=None):
+        self.template = template
+        self.url_template = urljoin(base_url or settings.API_URL, template)
+        self.path_params = frozenset(
+            field_name
+            for _, field_name, _, _ in string.Formatter().parse(self.url_template)
+            if field_name
+        )
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.template}>'
+
+    def url(self, path_params):
+        """
+        :param path_params: values for every placeholder in the template
+        :raises TypeError: if a placeholder is missing or an unknown path param is given
+        """
+        unknown = path_params.keys() - self.path_params
+        if unknown:
+            raise TypeError(f'{self!r} got unexpected path params: {", ".join(sorted(unknown))}')
+        missing = self.path_params - path_params.keys()
+        if missing:
+            raise TypeError(f'{self!r} is missing path params: {", ".join(sorted(missing))}')
+        if not self.path_params:
+            return self.url_template
+        return self.url_template.format(**{
+            name: quote(str(path_params[name]), safe='')
+            for name in self.path_params
+        })
+
+
+@lru_cache(maxsize=256)
+def _compile_endpoint(template, base_url):
+    return ApiEndpoint(template, base_url=base_url)
+
+
+def compile_endpoint(template):
+    """
+    :return: the cached `ApiEndpoint` for a URL template
+    """
+    return _compile_endpoint(template, settings.API_URL)
+
+
+class ApiClient:
+    """
+    Lean alternative to slumber connections: requests are made through one reused api session
+    to endpoints compiled from URL templates, and JSON is decoded directly (using `orjson` if installed).
+    Error responses raise the session's exceptions, e.g. `HttpNotFoundError`.
+    ```
+    client = get_api_client(request)
+    credit = client.get('credits/{pk}/', pk=1)
+    credits = client.get('credits/', params={'status': 'credit_pending'})
+    ```
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def request(self, method, template, params=None, data=None, **path_params):
+        """
+        :return: decoded JSON response or None if the response has no content
+        :raises TypeError: if `path_params` do not match the template's placeholders
+        """
+        url = compile_endpoint(template).url(path_params)
+        headers = {'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = encode_json(data)
+        response = self.session.request(method, url, params=params, data=body, headers=headers)
+        if not response.content:
+            return None
+        return decode_json(response.content)
+
+    def get(self, template, params=None, **path_params):
+        return self.request('GET', template, params=params, **path_params)
+
+    def post(self, template, data=None, params=None, **path_params):
+        return self.request('POST', template, params=params, data=data, **path_params)
+
+    def put(self, template, data=None, params=None, **path_params):
+        return self.request('PUT', template, params=params, data=data, **path_params)
+
+    def patch(self, template, data=None, params=None, **path_params):
+        return self.request('PATCH', template, params=params, data=data, **path_params)
+
+    def delete(self, template, params=None, **path_params):
+        return self.request('DELETE', template, params=params, **path_params)
+
+
+def get_api_client(request):
+    """
+    Returns a lean api client using the request's api session with the token of the logged-in user.
+    It raises `Unauthorized` if the user is not authenticated.
+    """
+    return ApiClient(get_api_session(request))
+
+
+def get_unauthenticated_api_client():
+    return ApiClient(get_unauthenticated_session())
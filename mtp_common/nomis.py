@@ -12,25 +12,140 @@ Prisoner money apps are currently only interested in NOMIS data hence this modul
 If in future we need to consume other HMPPS apis, it may make sense to split this module into separate components.
 """
 
+import asyncio
 import base64
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextlib
+import contextvars
+import copy
 import datetime
+import email.utils
+from functools import partial
+import itertools
 import logging
+import os
+import random
+import re
+import threading
+import time
 from urllib.parse import quote_plus
+import weakref
 
+from asgiref.sync import sync_to_async
+from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponseNotFound, StreamingHttpResponse
+from opencensus.trace import execution_context
+from opencensus.trace.span import Span, SpanKind
+from opencensus.trace.status import Status
+from opencensus.trace.tracers.base import NullContextManager
+from opencensus.trace.tracers.context_tracer import ContextTracer
+from prometheus_client import Counter, Histogram
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
 
 from mtp_common.auth import urljoin
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 logger = logging.getLogger('mtp')
 
+request_duration = Histogram(
+    'mtp_nomis_request_duration', 'HMPPS Prison API request durations including retries',
+    labelnames=('endpoint', 'method', 'status', 'retries', 'pid'),
+    buckets=(0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 25.0, 50.0, float('inf'))
+)
+coalesced_requests = Counter(
+    'mtp_nomis_coalesced_requests', 'HMPPS Prison API requests saved by sharing identical in-flight requests',
+    labelnames=('endpoint', 'pid'),
+)
+token_refreshes = Counter(
+    'mtp_nomis_token_refreshes', 'New tokens fetched from HMPPS Auth',
+    labelnames=('pid',),
+)
+rate_limit_wait = Histogram(
+    'mtp_nomis_rate_limit_wait', 'Time HMPPS Prison API requests waited for the client-side rate limiter',
+    labelnames=('endpoint', 'pid'),
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+)
+
+
+class Backoff:
+    """
+    Policy deciding how long `request_retry` waits before retrying so that struggling APIs are not hammered.
+    This base class does not wait at all; subclasses override `delay`.
+    """
+
+    def __init__(self, base=0.1, cap=2):
+        self.base = base
+        self.cap = cap
+
+    def delay(self, retry_count, previous_delay):
+        """
+        :param retry_count: number of retries already made
+        :param previous_delay: seconds waited before the previous retry (0 before the first one)
+        :return: seconds to wait before retrying again
+        """
+        return 0
+
+
+class ExponentialBackoff(Backoff):
+    """
+    Doubles the wait before each retry, optionally picking a random wait up to that ("full jitter").
+    """
+
+    def __init__(self, base=0.1, cap=2, jitter=True):
+        super().__init__(base=base, cap=cap)
+        self.jitter = jitter
+
+    def delay(self, retry_count, previous_delay):
+        delay = min(self.cap, self.base * 2 ** retry_count)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class DecorrelatedJitterBackoff(Backoff):
+    """
+    Picks a random wait between `base` and three times the previous wait,
+    spreading out retries from many workers that failed at the same time.
+    """
+
+    def delay(self, retry_count, previous_delay):
+        return min(self.cap, random.uniform(self.base, max(previous_delay, self.base) * 3))
+
+
+def parse_retry_after(response):
+    """
+    :return: seconds to wait as requested by the `Retry-After` response header, if present and valid.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if not retry_after:
+        return None
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (retry_at - datetime.datetime.now(tz=datetime.timezone.utc)).total_seconds())
+
 
 class Retry:
     """
     Object to be used with `request_retry`.
     It configures some retry options and can be subclassed to customise related logic.
+    Durations of all attempts are collected in `attempt_durations`.
     """
     def __init__(
         self,
@@ -42,11 +157,45 @@ class Retry:
             503,  # Service Unavailable
             504,  # Gateway Timeout
         ),
+        backoff=None,
+        deadline=None,
+        max_delay=10,
     ):
-
+        """
+        :param max_retries: number of retries after the first attempt
+        :param retry_on_status: response status codes that can be retried
+        :param backoff: `Backoff` policy, waits with decorrelated jitter by default
+        :param deadline: optional total seconds allowed across all attempts and waits
+        :param max_delay: stop retrying if the backoff or `Retry-After` header requires a longer wait
+        """
         self.max_retries = max_retries
         self.retry_on_status = retry_on_status
+        self.backoff = DecorrelatedJitterBackoff() if backoff is None else backoff
+        self.deadline = deadline
+        self.max_delay = max_delay
         self.retry_count = 0
+        self.started_at = None
+        self.attempt_durations = []
+        self.delays = []
+        self.pending_delay = 0
+
+    def record_attempt(self, attempt_started_at):
+        """
+        Called after each attempt with the `time.monotonic` value from when it started.
+        """
+        if self.started_at is None:
+            self.started_at = attempt_started_at
+        self.attempt_durations.append(time.monotonic() - attempt_started_at)
+
+    @property
+    def remaining_time(self):
+        """
+        :return: seconds left before the deadline or None if there isn't one
+        """
+        if self.deadline is None:
+            return None
+        elapsed = time.monotonic() - self.started_at if self.started_at is not None else 0
+        return self.deadline - elapsed
 
     def should_retry(self, exception=None, response=None):
         """
@@ -56,13 +205,58 @@ class Retry:
         """
         if response is not None and response.status_code not in self.retry_on_status:
             return False
-        return (self.max_retries - self.retry_count) > 0
+        if (self.max_retries - self.retry_count) <= 0:
+            return False
+
+        retry_after = parse_retry_after(response)
+        if retry_after is None:
+            delay = self.backoff.delay(self.retry_count, self.delays[-1] if self.delays else 0)
+        else:
+            delay = retry_after
+        if delay > self.max_delay:
+            return False
+        remaining_time = self.remaining_time
+        if remaining_time is not None and delay >= remaining_time:
+            return False
+        self.pending_delay = delay
+        return True
 
     def before_retrying(self, request_kwargs):
         """
         Callback called before retrying.
         """
         self.retry_count += 1
+        remaining_time = self.remaining_time
+        if remaining_time is not None and request_kwargs.get('timeout'):
+            # do not let the next attempt run past the deadline
+            request_kwargs['timeout'] = max(0.1, min(request_kwargs['timeout'], remaining_time - self.pending_delay))
+
+    async def abefore_retrying(self, request_kwargs):
+        """
+        Callback called before retrying by `arequest_retry`.
+        """
+        self.before_retrying(request_kwargs)
+
+    def _pop_pending_delay(self):
+        delay, self.pending_delay = self.pending_delay, 0
+        self.delays.append(delay)
+        return delay
+
+    def sleep(self):
+        """
+        Waits before retrying as decided in `should_retry`.
+        """
+        delay = self._pop_pending_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def asleep(self):
+        """
+        Waits before retrying as decided in `should_retry` without blocking the event loop.
+        """
+        delay = self._pop_pending_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 
 def request_retry(
@@ -70,11 +264,14 @@ def request_retry(
     *args,
     retries=0,
     session=None,
+    rate_limiter=None,
+    endpoint=None,
     **kwargs,
 ):
     """
     Like requests but with the ability to retry a request.
     `retries` can be a number or an instance of `mtp_common.nomis.Retry`.
+    An optional `RateLimiter` paces every attempt at calling `endpoint`.
 
     The logic doesn't use the session.mount + urllib3 Retry because we want to configure the retry count per-call
     instead of per-session and because we want to customise the retry logic.
@@ -85,27 +282,67 @@ def request_retry(
     session_or_module = session or requests
 
     method = getattr(session_or_module, verb)
-    should_retry = False
-    try:
-        response = method(*args, **kwargs)
-    except ConnectionError as e:
-        should_retry = retries.should_retry(exception=e)
-        if not should_retry:
-            raise e
-    else:
-        should_retry = retries.should_retry(response=response)
-
-    if should_retry:
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire(endpoint, max_wait=retries.remaining_time)
+        attempt_started_at = time.monotonic()
+        try:
+            response = method(*args, **kwargs)
+        except ConnectionError as e:
+            retries.record_attempt(attempt_started_at)
+            if not retries.should_retry(exception=e):
+                raise e
+        else:
+            retries.record_attempt(attempt_started_at)
+            if rate_limiter:
+                rate_limiter.record(response.status_code)
+            if not retries.should_retry(response=response):
+                return response
+
         retries.before_retrying(kwargs)
-        return request_retry(
-            verb,
-            *args,
-            retries=retries,
-            session=session,
-            **kwargs,
-        )
+        retries.sleep()
 
-    return response
+
+def require_httpx():
+    if httpx is None:
+        raise ImproperlyConfigured('httpx must be installed to use AsyncConnector')
+
+
+async def arequest_retry(
+    verb,
+    *args,
+    retries=0,
+    client,
+    rate_limiter=None,
+    endpoint=None,
+    **kwargs,
+):
+    """
+    Like `request_retry` but for asyncio using an `httpx.AsyncClient`.
+    """
+    require_httpx()
+    if not isinstance(retries, Retry):
+        retries = Retry(retries)
+
+    while True:
+        if rate_limiter:
+            await rate_limiter.aacquire(endpoint, max_wait=retries.remaining_time)
+        attempt_started_at = time.monotonic()
+        try:
+            response = await client.request(verb.upper(), *args, **kwargs)
+        except httpx.TransportError as e:
+            retries.record_attempt(attempt_started_at)
+            if not retries.should_retry(exception=e):
+                raise e
+        else:
+            retries.record_attempt(attempt_started_at)
+            if rate_limiter:
+                await rate_limiter.arecord(response.status_code)
+            if not retries.should_retry(response=response):
+                return response
+
+        await retries.abefore_retrying(kwargs)
+        await retries.asleep()
 
 
 class AuthenticatedRetry(Retry):
@@ -117,6 +354,7 @@ class AuthenticatedRetry(Retry):
     """
     def __init__(self, connector, *args, **kwargs):
         self.connector = connector
+        self.token_rejected = False
         super().__init__(*args, **kwargs)
 
     def should_retry(self, exception=None, response=None):
@@ -126,25 +364,648 @@ class AuthenticatedRetry(Retry):
         if self.retry_count == 0:
             if response is not None and response.status_code == 401:
                 logger.warning('Deleting the cached HMPPS Auth token because of a 401 response')
-                cache.delete(self.connector.TOKEN_CACHE_KEY)
+                self.connector.forget_token(rejected_token=self.get_rejected_token(response))
+                self.token_rejected = True
                 return True
         return super().should_retry(exception=exception, response=response)
 
+    def get_rejected_token(self, response):
+        """
+        :return: bearer token sent in the request that received `response`, if known
+        """
+        try:
+            authorisation = response.request.headers.get('Authorization') or ''
+        except (AttributeError, RuntimeError):
+            return None
+        return authorisation.removeprefix('Bearer ') or None
+
     def before_retrying(self, request_kwargs):
         """
-        Re-builds the headers if the token can't be find in the cache.
+        Re-builds the headers if the token was rejected or can't be find in the cache.
+        """
+        if self.token_rejected or not cache.get(self.connector.TOKEN_CACHE_KEY):
+            request_kwargs['headers'] = {
+                **request_kwargs.get('headers', {}),
+                **self.connector.build_request_api_headers(),
+            }
+
+        super().before_retrying(request_kwargs)
+
+    async def abefore_retrying(self, request_kwargs):
+        """
+        Re-builds the headers if the token was rejected or can't be find in the cache, without blocking the event loop.
         """
-        if not cache.get(self.connector.TOKEN_CACHE_KEY):
-            request_kwargs['headers'] = self.connector.build_request_api_headers()
+        if self.token_rejected or not await cache.aget(self.connector.TOKEN_CACHE_KEY):
+            request_kwargs['headers'] = {
+                **request_kwargs.get('headers', {}),
+                **await self.connector.abuild_request_api_headers(),
+            }
 
         super().before_retrying(request_kwargs)
 
 
-class Connector:
+class CircuitOpenError(ConnectionError):
     """
-    Connector for HMPPS Prison API (using HMPPS Auth)
+    Raised instead of calling an API while its circuit breaker is open.
+    NB: it is a `requests` exception even when raised by `AsyncConnector`
+    so asyncio callers should catch it as well as `httpx.TransportError`.
+    """
+
+
+class RateLimitWaitError(ConnectionError):
+    """
+    Raised instead of calling an API when its rate limits would not allow the call
+    within `RateLimiter.max_wait` seconds or before the retry deadline.
+    NB: like `CircuitOpenError`, it is a `requests` exception even when raised by `AsyncConnector`.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling an API that keeps failing so that workers are not tied up waiting for timeouts.
+    State is shared between processes through the Django cache:
+    - closed: calls are made and their outcomes are counted in windows of `window` seconds
+    - open: once `min_calls` were made in a window and at least `failure_rate` of them failed,
+      calls fail immediately with `CircuitOpenError` for `open_timeout` seconds
+    - half-open: then one probe call at a time is let through; success closes the circuit, failure opens it again
+    Failures are connection problems, timeouts and 5xx responses.
+    To keep the cache off the path of successful calls, each process assumes a closed circuit stays closed
+    for `state_memo_timeout` seconds and adds up its successful calls, sending them to the shared counts
+    at most every `flush_interval` seconds or along with the next failure.
+    """
+    CLOSED = 'closed'
+    HALF_OPEN = 'half-open'
+    OPEN = 'open'
+
+    def __init__(self, name, failure_rate=None, min_calls=None, window=None, open_timeout=None, probe_timeout=60,
+                 state_memo_timeout=1, flush_interval=1):
+        self.name = name
+        self._failure_rate = failure_rate
+        self._min_calls = min_calls
+        self._window = window
+        self._open_timeout = open_timeout
+        self.probe_timeout = probe_timeout
+        self.state_memo_timeout = state_memo_timeout
+        self.flush_interval = flush_interval
+        self.rejected_calls = 0
+        self._lock = threading.Lock()
+        # `time.monotonic` value until which the circuit is assumed to be closed without checking the cache
+        self._closed_until = 0
+        # calls counted in this process but not yet added to the shared window counts
+        self._pending_window = None
+        self._pending_calls = 0
+        self._flushed_at = 0
+
+    @property
+    def failure_rate(self):
+        return self._failure_rate or getattr(settings, 'HMPPS_PRISON_API_CIRCUIT_FAILURE_RATE', 0.5)
+
+    @property
+    def min_calls(self):
+        return self._min_calls or getattr(settings, 'HMPPS_PRISON_API_CIRCUIT_MIN_CALLS', 10)
+
+    @property
+    def window(self):
+        return self._window or getattr(settings, 'HMPPS_PRISON_API_CIRCUIT_WINDOW', 60)
+
+    @property
+    def open_timeout(self):
+        return self._open_timeout or getattr(settings, 'HMPPS_PRISON_API_CIRCUIT_OPEN_TIMEOUT', 30)
+
+    @property
+    def open_key(self):
+        return f'circuit-{self.name}-open-until'
+
+    @property
+    def probe_key(self):
+        return f'circuit-{self.name}-probe'
+
+    def window_keys(self):
+        bucket = int(time.time() // self.window)
+        return f'circuit-{self.name}-calls-{bucket}', f'circuit-{self.name}-failures-{bucket}'
+
+    def _state_from(self, open_until):
+        if open_until is None:
+            state = self.CLOSED
+        elif time.time() < open_until:
+            state = self.OPEN
+        else:
+            state = self.HALF_OPEN
+        self._closed_until = time.monotonic() + self.state_memo_timeout if state == self.CLOSED else 0
+        return state
+
+    @property
+    def state(self):
+        return self._state_from(cache.get(self.open_key))
+
+    def _reject(self):
+        self.rejected_calls += 1
+        raise CircuitOpenError(f'{self.name} circuit is open')
+
+    def before_call(self):
+        """
+        Raises `CircuitOpenError` if the call should not be made.
+        :return: True if the call is a probe of a half-open circuit
+        """
+        if time.monotonic() < self._closed_until:
+            return False
+        state = self.state
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and cache.add(self.probe_key, os.getpid(), timeout=self.probe_timeout):
+            logger.info('Probing %s circuit', self.name)
+            return True
+        self._reject()
+
+    async def abefore_call(self):
+        """
+        Like `before_call` but without blocking the event loop.
+        """
+        if time.monotonic() < self._closed_until:
+            return False
+        state = self._state_from(await cache.aget(self.open_key))
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and await cache.aadd(self.probe_key, os.getpid(), timeout=self.probe_timeout):
+            logger.info('Probing %s circuit', self.name)
+            return True
+        self._reject()
+
+    def _count_call(self, success):
+        """
+        Counts a call in this process.
+        :return: number of calls to add to the shared count now, 0 if successful calls are still being batched up
+        """
+        bucket = int(time.time() // self.window)
+        now = time.monotonic()
+        with self._lock:
+            if bucket != self._pending_window:
+                self._pending_window, self._pending_calls = bucket, 0
+            self._pending_calls += 1
+            if success and now - self._flushed_at < self.flush_interval:
+                return 0
+            calls, self._pending_calls = self._pending_calls, 0
+            self._flushed_at = now
+        return calls
+
+    def _should_open(self, calls, failures):
+        return calls >= self.min_calls and failures / calls >= self.failure_rate
+
+    def _incr(self, key, delta):
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            if cache.add(key, delta, timeout=self.window * 2):
+                return delta
+            return cache.incr(key, delta)
+
+    async def _aincr(self, key, delta):
+        try:
+            return await cache.aincr(key, delta)
+        except ValueError:
+            if await cache.aadd(key, delta, timeout=self.window * 2):
+                return delta
+            return await cache.aincr(key, delta)
+
+    def release(self, probe):
+        """
+        Lets another call probe a half-open circuit when a probe call was not made after all.
+        """
+        if probe:
+            cache.delete(self.probe_key)
+
+    async def arelease(self, probe):
+        if probe:
+            await cache.adelete(self.probe_key)
+
+    def record(self, success, probe=False):
+        """
+        Records the outcome of a call, opening or closing the circuit if necessary.
+        """
+        if probe:
+            if success:
+                logger.info('Closing %s circuit', self.name)
+                cache.delete_many([self.open_key, self.probe_key])
+            else:
+                self.open()
+            return
+
+        calls = self._count_call(success)
+        if not calls:
+            return
+        calls_key, failures_key = self.window_keys()
+        calls = self._incr(calls_key, calls)
+        if not success and self._should_open(calls, self._incr(failures_key, 1)):
+            self.open()
+
+    async def arecord(self, success, probe=False):
+        """
+        Like `record` but without blocking the event loop.
+        """
+        if probe:
+            if success:
+                logger.info('Closing %s circuit', self.name)
+                await cache.adelete_many([self.open_key, self.probe_key])
+            else:
+                await self.aopen()
+            return
+
+        calls = self._count_call(success)
+        if not calls:
+            return
+        calls_key, failures_key = self.window_keys()
+        calls = await self._aincr(calls_key, calls)
+        if not success and self._should_open(calls, await self._aincr(failures_key, 1)):
+            await self.aopen()
+
+    def open(self):
+        logger.warning('Opening %s circuit for %d seconds', self.name, self.open_timeout)
+        self._closed_until = 0
+        cache.set(self.open_key, time.time() + self.open_timeout, timeout=None)
+        cache.delete_many([self.probe_key, *self.window_keys()])
+
+    async def aopen(self):
+        logger.warning('Opening %s circuit for %d seconds', self.name, self.open_timeout)
+        self._closed_until = 0
+        await cache.aset(self.open_key, time.time() + self.open_timeout, timeout=None)
+        await cache.adelete_many([self.probe_key, *self.window_keys()])
+
+    def reset(self):
+        """
+        Closes the circuit and forgets outcomes counted in the current window.
+        """
+        with self._lock:
+            self._closed_until = 0
+            self._pending_window, self._pending_calls = None, 0
+        cache.delete_many([self.open_key, self.probe_key, *self.window_keys()])
+
+
+class RateLimiter:
+    """
+    Paces calls to an API so that all threads and processes together stay within its rate limits.
+    Budgets are tracked through the Django cache as counts of calls made in each one-second window
+    (or longer for rates below one call per second), i.e. a token bucket refilled every window,
+    using atomic increments; calls over budget wait for the next window.
+    A call is counted against the global and endpoint budgets in the same windows.
+    Nothing is read from the cache unless some budget is configured.
+    - `rate`: calls per second allowed across all endpoints, None for no limit
+    - `endpoint_rates`: dict of calls per second allowed for particular endpoint templates, e.g. `PHOTOGRAPH_PATH`
+    When the API responds with 429 or 503, all budgets are halved (down to `min_slowdown` of their rate)
+    and recover once there have been no more such responses for `slowdown_timeout` seconds.
+    Calls that would wait for longer than `max_wait` seconds raise `RateLimitWaitError` instead.
+    """
+    throttled_status_codes = (429, 503)
+
+    def __init__(self, name, rate=None, endpoint_rates=None, slowdown_timeout=None, min_slowdown=0.1,
+                 max_wait=None):
+        self.name = name
+        self._rate = rate
+        self._endpoint_rates = endpoint_rates
+        self._slowdown_timeout = slowdown_timeout
+        self.min_slowdown = min_slowdown
+        self._max_wait = max_wait
+
+    @property
+    def rate(self):
+        return self._rate or getattr(settings, 'HMPPS_PRISON_API_RATE_LIMIT', None)
+
+    @property
+    def endpoint_rates(self):
+        return self._endpoint_rates or getattr(settings, 'HMPPS_PRISON_API_ENDPOINT_RATE_LIMITS', {})
+
+    @property
+    def slowdown_timeout(self):
+        return self._slowdown_timeout or getattr(settings, 'HMPPS_PRISON_API_RATE_LIMIT_SLOWDOWN_TIMEOUT', 60)
+
+    @property
+    def max_wait(self):
+        return self._max_wait or getattr(settings, 'HMPPS_PRISON_API_RATE_LIMIT_MAX_WAIT', 10)
+
+    @property
+    def limited(self):
+        return bool(self.rate or self.endpoint_rates)
+
+    @property
+    def slowdown_key(self):
+        return f'rate-limit-{self.name}-slowdown'
+
+    def window_key(self, scope, window, now):
+        return f'rate-limit-{self.name}-{scope}-{window:g}s-{int(now // window)}'
+
+    def budgets(self, endpoint, slowdown):
+        """
+        :return: list of (scope, calls allowed per window, window seconds) that apply to calling `endpoint`;
+            windows last one second unless fewer than one call per second is allowed
+        """
+        rates = []
+        if self.rate:
+            rates.append(('all', self.rate))
+        endpoint_rate = self.endpoint_rates.get(endpoint)
+        if endpoint_rate:
+            rates.append((endpoint, endpoint_rate))
+        budgets = []
+        for scope, rate in rates:
+            rate *= slowdown
+            if rate >= 1:
+                budgets.append((scope, int(rate), 1))
+            else:
+                budgets.append((scope, 1, 1 / rate))
+        return budgets
+
+    def _delay_until_next_window(self, now, window):
+        # wait until the next window with a little jitter so that waiting threads do not all wake at once
+        return window - now % window + random.uniform(0, 0.05)
+
+    def _count_call(self, key, window):
+        try:
+            return cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, timeout=int(window) + 5):
+                return 1
+            return cache.incr(key)
+
+    async def _acount_call(self, key, window):
+        try:
+            return await cache.aincr(key)
+        except ValueError:
+            if await cache.aadd(key, 1, timeout=int(window) + 5):
+                return 1
+            return await cache.aincr(key)
+
+    def _uncount_calls(self, keys):
+        for key in keys:
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+
+    async def _auncount_calls(self, keys):
+        for key in keys:
+            try:
+                await cache.adecr(key)
+            except ValueError:
+                pass
+
+    def _take_slots(self, budgets):
+        """
+        Counts a call in the current window of every budget at the same time,
+        giving the slots back if any budget is used up so that the call is retried in the next window of all of them.
+        :return: None if the call can be made now or seconds to wait before trying again
+        """
+        now = time.time()
+        keys = []
+        for scope, calls, window in budgets:
+            keys.append(self.window_key(scope, window, now))
+            if self._count_call(keys[-1], window) > calls:
+                self._uncount_calls(keys)
+                return self._delay_until_next_window(now, window)
+        return None
+
+    async def _atake_slots(self, budgets):
+        now = time.time()
+        keys = []
+        for scope, calls, window in budgets:
+            keys.append(self.window_key(scope, window, now))
+            if await self._acount_call(keys[-1], window) > calls:
+                await self._auncount_calls(keys)
+                return self._delay_until_next_window(now, window)
+        return None
+
+    def _observe_wait(self, endpoint, started_at):
+        waited = time.monotonic() - started_at
+        rate_limit_wait.labels(
+            endpoint=endpoint,
+            pid=str(os.getpid()),  # pid is needed as uwsgi runs with multiple workers
+        ).observe(waited)
+        return waited
+
+    def _check_wait(self, endpoint, started_at, delay, max_wait):
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if time.monotonic() - started_at + delay > max_wait:
+            self._observe_wait(endpoint, started_at)
+            raise RateLimitWaitError(f'Rate limits do not allow calling {endpoint} within {max_wait:.1f}s')
+
+    def acquire(self, endpoint, max_wait=None):
+        """
+        Waits until a call to `endpoint` is within all budgets.
+        :param max_wait: seconds the caller can wait, if less than `self.max_wait`, e.g. until its retry deadline
+        :return: seconds waited
+        """
+        if not self.limited:
+            return 0
+        budgets = self.budgets(endpoint, cache.get(self.slowdown_key, 1))
+        if not budgets:
+            return 0
+        started_at = time.monotonic()
+        while (delay := self._take_slots(budgets)) is not None:
+            self._check_wait(endpoint, started_at, delay, max_wait)
+            time.sleep(delay)
+        return self._observe_wait(endpoint, started_at)
+
+    async def aacquire(self, endpoint, max_wait=None):
+        """
+        Waits until a call to `endpoint` is within all budgets without blocking the event loop.
+        :param max_wait: seconds the caller can wait, if less than `self.max_wait`, e.g. until its retry deadline
+        :return: seconds waited
+        """
+        if not self.limited:
+            return 0
+        budgets = self.budgets(endpoint, await cache.aget(self.slowdown_key, 1))
+        if not budgets:
+            return 0
+        started_at = time.monotonic()
+        while (delay := await self._atake_slots(budgets)) is not None:
+            self._check_wait(endpoint, started_at, delay, max_wait)
+            await asyncio.sleep(delay)
+        return self._observe_wait(endpoint, started_at)
+
+    def _next_slowdown(self, status_code, slowdown):
+        slowdown = max(self.min_slowdown, slowdown / 2)
+        logger.warning(
+            'Slowing %s calls to %d%% of rate limits after %d response', self.name, slowdown * 100, status_code,
+        )
+        return slowdown
+
+    def record(self, status_code):
+        """
+        Slows down all calls if a response indicates that the API is throttling.
+        """
+        if status_code not in self.throttled_status_codes or not self.limited:
+            return
+        slowdown = self._next_slowdown(status_code, cache.get(self.slowdown_key, 1))
+        cache.set(self.slowdown_key, slowdown, timeout=self.slowdown_timeout)
+
+    async def arecord(self, status_code):
+        """
+        Slows down all calls if a response indicates that the API is throttling, without blocking the event loop.
+        """
+        if status_code not in self.throttled_status_codes or not self.limited:
+            return
+        slowdown = self._next_slowdown(status_code, await cache.aget(self.slowdown_key, 1))
+        await cache.aset(self.slowdown_key, slowdown, timeout=self.slowdown_timeout)
+
+
+class RequestCoalescer:
+    """
+    Lets threads making identical calls at the same time share one call and its result (or exception).
+    Threads that joined another's call receive a deep copy of the result, or a copy of the exception,
+    so they can modify it safely.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.saved_calls = 0
+
+    def call(self, key, func):
+        """
+        :return: tuple of the result of `func` and whether it was shared from another thread's call
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = {'future': Future(), 'followers': 0}
+                self._in_flight[key] = in_flight
+                leader = True
+            else:
+                in_flight['followers'] += 1
+                self.saved_calls += 1
+                leader = False
+
+        future = in_flight['future']
+        if not leader:
+            exception = future.exception()
+            if exception is not None:
+                raise self.copy_exception(exception)
+            return copy.deepcopy(future.result()), True
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            # no more threads can join once removed so only copy if some already did
+            followers = in_flight['followers']
+        future.set_result(copy.deepcopy(result) if followers else result)
+        return result, False
+
+    @classmethod
+    def copy_exception(cls, exception):
+        """
+        :return: a shallow copy of an exception raised in another thread with the same traceback and cause
+        """
+        try:
+            exception_copy = copy.copy(exception)
+        except Exception:
+            # exceptions that cannot be copied are shared as they are
+            return exception
+        exception_copy.__cause__ = exception.__cause__
+        exception_copy.__suppress_context__ = exception.__suppress_context__
+        return exception_copy.with_traceback(exception.__traceback__)
+
+
+@contextlib.contextmanager
+def detached_span(name):
+    """
+    Yields an opencensus span (if tracing is enabled) whose parent is the current span but which does not become
+    the current span itself, so that spans of concurrent asyncio tasks do not nest under or end each other.
+    It is exported once finished.
+    """
+    tracer = execution_context.get_opencensus_tracer()
+    context_tracer = getattr(tracer, 'tracer', tracer)
+    if not isinstance(context_tracer, ContextTracer):
+        # tracing is not enabled or this trace is not sampled
+        with tracer.span(name=name) as span:
+            yield span
+        return
+
+    parent_span = context_tracer.current_span() or NullContextManager(span_id=context_tracer.span_context.span_id)
+    span = Span(name, parent_span=parent_span)
+    span.start()
+    try:
+        yield span
+    except Exception as e:
+        span.status = Status.from_exception(e)
+        raise
+    finally:
+        span.finish()
+        context_tracer.exporter.export(context_tracer.get_span_datas(span))
+
+
+class BaseConnector:
+    """
+    Shared by `Connector` and `AsyncConnector`: HMPPS Auth tokens, the circuit breaker, rate limiter
+    and instrumentation of HMPPS Prison API calls
     """
     TOKEN_CACHE_KEY = 'NOMIS_TOKEN'
+    TOKEN_EXPIRY_CACHE_KEY = 'NOMIS_TOKEN_EXPIRY'
+    TOKEN_LOCK_CACHE_KEY = 'NOMIS_TOKEN_LOCK'
+    token_lock_timeout = 30
+    token_lock_poll_interval = 0.1
+
+    def __init__(self):
+        self.circuit_breaker = CircuitBreaker('prison-api')
+        self.rate_limiter = RateLimiter('prison-api')
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        # in-process memo of the cached token: (token, memo expiry time, proactive renewal time)
+        self._token_memo = (None, 0, None)
+        self._token_renewal_lock = threading.Lock()
+        self._token_renewal_thread = None
+
+    @property
+    def session(self):
+        """
+        Pooled keep-alive session shared by all threads in this process, used unless a caller passes in its own.
+        A new one is built after forking (e.g. in each uWSGI worker) so that sockets are never shared between processes.
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._session_lock:
+                if self._session is None or self._session_pid != pid:
+                    self._session = self.build_session()
+                    self._session_pid = pid
+        return self._session
+
+    def build_session(self):
+        """
+        :return: a new requests session with connection pools sized by settings.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            # number of hosts to keep pools for: HMPPS Auth and Prison API
+            pool_connections=getattr(settings, 'HMPPS_API_POOL_CONNECTIONS', 2),
+            # maximum number of keep-alive connections kept for each host
+            pool_maxsize=getattr(settings, 'HMPPS_API_POOL_MAXSIZE', 10),
+            # whether threads should wait for a free connection instead of opening a throwaway one
+            pool_block=getattr(settings, 'HMPPS_API_POOL_BLOCK', False),
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def pool_stats(self):
+        """
+        :return: dict of host to number of requests made and new connections opened by the pooled session.
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            return {}
+        stats = {}
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = stats.setdefault(pool.host, {'requests': 0, 'connections': 0})
+                host_stats['requests'] += pool.num_requests
+                host_stats['connections'] += pool.num_connections
+        return stats
 
     @property
     def hmpps_auth_token_url(self):
@@ -165,51 +1026,37 @@ class Connector:
             'Authorization': f'Bearer {bearer_token}',
         }
 
-    def request(self, verb, path, params=None, json=None, timeout=30, retries=0, session=None):
-        """
-        Makes a request call to Prison API (i.e. NOMIS).
-        You probably want to use the `get` or the `post` methods instead.
-        """
-        if not isinstance(retries, Retry):
-            retries = AuthenticatedRetry(self, retries)
-
-        response = request_retry(
-            verb,
-            urljoin(self.prison_api_v1_base_url, path, trailing_slash=False),
-            retries=retries,
-            session=session,
-            headers=self.build_request_api_headers(),
-            timeout=timeout,
-            params=params,
-            json=json,
-        )
-
-        response.raise_for_status()
-
-        if response.status_code != requests.codes.no_content:
-            return response.json()
-
-        return {
-            'status_code': response.status_code,
-        }
-
-    def get(self, path, params=None, timeout=30, retries=0, session=None):
-        """
-        Makes a GET request to Prison API (i.e. NOMIS).
-        """
-        if params:
-            params = {
-                param: params[param]
-                for param in params
-                if params[param] is not None
-            }
-        return self.request('get', path, params=params, timeout=timeout, retries=retries, session=session)
-
-    def post(self, path, data=None, timeout=30, retries=0, session=None):
+    @contextlib.contextmanager
+    def instrument(self, verb, endpoint, retries, detached=False):
         """
-        Makes a POST request to Prison API (i.e. NOMIS).
+        Records the duration of a request in prometheus metrics and an opencensus span (if tracing is enabled).
+        The caller sets `status` in the yielded dict.
+        :param detached: create the span with `detached_span`, as needed when awaiting the request
         """
-        return self.request('post', path, json=data, timeout=timeout, retries=retries, session=session)
+        method = verb.upper()
+        outcome = {'status': 'unknown'}
+        started_at = time.monotonic()
+        span_name = f'Prison API {method} {endpoint}'
+        if detached:
+            span_context_manager = detached_span(span_name)
+        else:
+            span_context_manager = execution_context.get_opencensus_tracer().span(span_name)
+        with span_context_manager as span:
+            span.span_kind = SpanKind.CLIENT
+            span.add_attribute('http.method', method)
+            span.add_attribute('http.route', endpoint)
+            try:
+                yield outcome
+            finally:
+                span.add_attribute('http.status_code', outcome['status'])
+                span.add_attribute('retries', retries.retry_count)
+                request_duration.labels(
+                    endpoint=endpoint,
+                    method=method,
+                    status=outcome['status'],
+                    retries=str(retries.retry_count),
+                    pid=str(os.getpid()),  # pid is needed as uwsgi runs with multiple workers
+                ).observe(time.monotonic() - started_at)
 
     def _get_new_token_data(self):
         """
@@ -225,6 +1072,7 @@ class Connector:
             'post',
             self.hmpps_auth_token_url,
             retries=3,
+            session=self.session,
             params={
                 'grant_type': 'client_credentials',
             },
@@ -242,20 +1090,118 @@ class Connector:
 
     def get_bearer_token(self):
         """
-        Gets the bearer token from cache if it exists, or from HMPPS Auth otherwise.
+        Gets the bearer token from memory, from cache if it exists, or from HMPPS Auth otherwise.
+        A new token is fetched in the background shortly before the cached one expires.
 
         :return: bearer token to be used in API calls.
         """
-        token = cache.get(self.TOKEN_CACHE_KEY)
-        if not token:
-            token_data = self._get_new_token_data()
-            token = token_data['access_token']
+        token = self._get_memoised_token()
+        if token:
+            return token
 
-            cache_expire_in = token_data['expires_in'] - (60 * 5)  # -5 mins just to avoid disalignment
-            cache.set(self.TOKEN_CACHE_KEY, token, timeout=cache_expire_in)
-        return token
+        token = self._get_cached_token()
+        if token:
+            # triggers proactive renewal if due
+            return self._get_memoised_token() or token
 
-    def can_access_nomis(self):
+        return self._get_new_token_single_flight()
+
+    def forget_token(self, rejected_token=None):
+        """
+        Deletes the token from memory and cache so that the next call fetches a new one from HMPPS Auth.
+        :param rejected_token: only delete the cached token if it is still this one;
+            another process may have already replaced it, in which case the replacement is used next
+        """
+        self._token_memo = (None, 0, None)
+        if rejected_token is not None and cache.get(self.TOKEN_CACHE_KEY) != rejected_token:
+            return
+        cache.delete_many([self.TOKEN_CACHE_KEY, self.TOKEN_EXPIRY_CACHE_KEY])
+
+    def _get_memoised_token(self):
+        now = time.time()
+        token, memo_expiry, renew_at = self._token_memo
+        if not token or now >= memo_expiry:
+            return None
+        if renew_at is not None and now >= renew_at:
+            self._renew_token_in_background()
+        return token
+
+    def _get_cached_token(self):
+        cached = cache.get_many([self.TOKEN_CACHE_KEY, self.TOKEN_EXPIRY_CACHE_KEY])
+        token = cached.get(self.TOKEN_CACHE_KEY)
+        if token:
+            self._memoise_token(token, cached.get(self.TOKEN_EXPIRY_CACHE_KEY))
+        return token
+
+    def _memoise_token(self, token, cache_expiry=None):
+        now = time.time()
+        memo_expiry = now + getattr(settings, 'HMPPS_AUTH_TOKEN_MEMO_TIMEOUT', 60)
+        renew_at = None
+        if cache_expiry:
+            memo_expiry = min(memo_expiry, cache_expiry)
+            renew_at = cache_expiry - getattr(settings, 'HMPPS_AUTH_TOKEN_RENEWAL_WINDOW', 60 * 5)
+        self._token_memo = (token, memo_expiry, renew_at)
+
+    def _store_new_token(self):
+        token_data = self._get_new_token_data()
+        token_refreshes.labels(pid=str(os.getpid())).inc()
+        token = token_data['access_token']
+
+        cache_expire_in = token_data['expires_in'] - (60 * 5)  # -5 mins just to avoid disalignment
+        cache_expiry = time.time() + cache_expire_in
+        cache.set_many({
+            self.TOKEN_CACHE_KEY: token,
+            self.TOKEN_EXPIRY_CACHE_KEY: cache_expiry,
+        }, timeout=cache_expire_in)
+        self._memoise_token(token, cache_expiry)
+        return token
+
+    def _get_new_token_single_flight(self):
+        """
+        Uses a cache-backed lock so that only one process fetches a new token from HMPPS Auth
+        while others wait for it to appear in the cache.
+        If the lock is not released in time (e.g. the holder died), the token is fetched regardless.
+        """
+        deadline = time.monotonic() + self.token_lock_timeout
+        while True:
+            if cache.add(self.TOKEN_LOCK_CACHE_KEY, os.getpid(), timeout=self.token_lock_timeout):
+                try:
+                    # another process may have stored a token between the cache miss and acquiring the lock
+                    return self._get_cached_token() or self._store_new_token()
+                finally:
+                    cache.delete(self.TOKEN_LOCK_CACHE_KEY)
+
+            time.sleep(self.token_lock_poll_interval)
+            token = self._get_cached_token()
+            if token:
+                return token
+            if time.monotonic() > deadline:
+                logger.warning('Fetching HMPPS Auth token without holding the lock')
+                return self._store_new_token()
+
+    def _renew_token_in_background(self):
+        if not self._token_renewal_lock.acquire(blocking=False):
+            return
+        # avoid repeatedly starting renewals while one (possibly in another process) is underway
+        token, memo_expiry, _ = self._token_memo
+        self._token_memo = (token, memo_expiry, time.time() + self.token_lock_timeout)
+
+        def renew():
+            try:
+                if cache.add(self.TOKEN_LOCK_CACHE_KEY, os.getpid(), timeout=self.token_lock_timeout):
+                    try:
+                        self._store_new_token()
+                    finally:
+                        cache.delete(self.TOKEN_LOCK_CACHE_KEY)
+            except (requests.RequestException, ValueError, KeyError):
+                logger.exception('Could not renew HMPPS Auth token')
+            finally:
+                self._token_renewal_lock.release()
+
+        self._token_renewal_thread = threading.Thread(target=renew, daemon=True)
+        self._token_renewal_thread.start()
+
+    def can_access_nomis(self):
         """
         :return: True if this connector has all keys in place to connect to Prison API (i.e. NOMIS).
         """
@@ -270,13 +1216,362 @@ class Connector:
         )
 
 
+class Connector(BaseConnector):
+    """
+    Connector for HMPPS Prison API (using HMPPS Auth)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.coalescer = RequestCoalescer()
+
+    def request(self, verb, path, params=None, json=None, timeout=30, retries=0, session=None, endpoint=None):
+        """
+        Makes a request call to Prison API (i.e. NOMIS).
+        You probably want to use the `get` or the `post` methods instead.
+        :param endpoint: path template used to label metrics, e.g. `ACCOUNT_BALANCES_PATH`
+        """
+        response = self.request_response(
+            verb, path, params=params, json=json, timeout=timeout, retries=retries, session=session,
+            endpoint=endpoint,
+        )
+
+        if response.status_code != requests.codes.no_content:
+            return response.json()
+
+        return {
+            'status_code': response.status_code,
+        }
+
+    def request_response(self, verb, path, params=None, json=None, headers=None, timeout=30, retries=0,
+                         session=None, endpoint=None):
+        """
+        Makes a request call to Prison API (i.e. NOMIS) returning the response itself, e.g. to read its headers.
+        :param headers: additional request headers
+        """
+        if not isinstance(retries, Retry):
+            retries = AuthenticatedRetry(self, retries)
+
+        endpoint = endpoint or template_endpoint(path)
+        probe = self.circuit_breaker.before_call()
+        with self.instrument(verb, endpoint, retries) as outcome:
+            try:
+                response = request_retry(
+                    verb,
+                    urljoin(self.prison_api_v1_base_url, path, trailing_slash=False),
+                    retries=retries,
+                    session=session or self.session,
+                    rate_limiter=self.rate_limiter,
+                    endpoint=endpoint,
+                    headers={**(headers or {}), **self.build_request_api_headers()},
+                    timeout=timeout,
+                    params=params,
+                    json=json,
+                )
+            except RateLimitWaitError as e:
+                # the api was not called so this says nothing about its health
+                outcome['status'] = type(e).__name__
+                self.circuit_breaker.release(probe)
+                raise
+            except requests.RequestException as e:
+                outcome['status'] = type(e).__name__
+                self.circuit_breaker.record(success=False, probe=probe)
+                raise
+            outcome['status'] = str(response.status_code)
+            self.circuit_breaker.record(success=response.status_code < 500, probe=probe)
+
+        response.raise_for_status()
+        return response
+
+    def get(self, path, params=None, timeout=30, retries=0, session=None, endpoint=None, coalesce=False):
+        """
+        Makes a GET request to Prison API (i.e. NOMIS).
+        :param coalesce: share the response of an identical request already being made by another thread;
+            requests are only identical if they also have the same `retries` count, `timeout` and `session`
+        """
+        if params:
+            params = {
+                param: params[param]
+                for param in params
+                if params[param] is not None
+            }
+
+        def get():
+            return self.request(
+                'get', path, params=params, timeout=timeout, retries=retries, session=session, endpoint=endpoint,
+            )
+
+        if not coalesce or isinstance(retries, Retry):
+            # Retry instances hold the state of one call so cannot be shared
+            return get()
+        key = (path, tuple(sorted((params or {}).items())), retries, timeout, session)
+        result, shared = self.coalescer.call(key, get)
+        if shared:
+            coalesced_requests.labels(
+                endpoint=endpoint or template_endpoint(path),
+                pid=str(os.getpid()),  # pid is needed as uwsgi runs with multiple workers
+            ).inc()
+        return result
+
+    def post(self, path, data=None, timeout=30, retries=0, session=None, endpoint=None):
+        """
+        Makes a POST request to Prison API (i.e. NOMIS).
+        """
+        return self.request(
+            'post', path, json=data, timeout=timeout, retries=retries, session=session, endpoint=endpoint,
+        )
+
+
+class AsyncConnector(BaseConnector):
+    """
+    Asyncio connector for HMPPS Prison API (using HMPPS Auth) so that many calls can share one event loop.
+    It mirrors `Connector` but its methods are coroutines so it is a sibling rather than a subclass;
+    bearer tokens are cached in the same way.
+    Requires the optional `httpx` package; HTTP errors are raised as `httpx.HTTPStatusError`
+    and `CircuitOpenError` is raised while the circuit breaker is open.
+    Pooled clients must be closed before their event loop shuts down, using `aclose` or by running code with `run`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        """
+        Pooled keep-alive client shared by all tasks on the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self.build_client()
+            self._clients[loop] = client
+        return client
+
+    def build_client(self):
+        """
+        :return: a new httpx client with connection pool sized by settings.
+        """
+        require_httpx()
+        pool_maxsize = getattr(settings, 'HMPPS_API_POOL_MAXSIZE', 10)
+        return httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=pool_maxsize,
+            max_keepalive_connections=pool_maxsize,
+        ))
+
+    async def aclose(self):
+        """
+        Closes the pooled client of the running event loop, e.g. in an ASGI lifespan shutdown handler.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine in a new event loop, e.g. from a management command, closing the pooled client afterwards.
+        ```
+        balances = async_connector.run(aget_account_balances_many(prisoners))
+        ```
+        """
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run_and_close())
+
+    async def abuild_request_api_headers(self):
+        """
+        :return: dict with headers to used in calls to the Prison API (i.e. NOMIS).
+        """
+        bearer_token = await self.aget_bearer_token()
+        return {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {bearer_token}',
+        }
+
+    async def aget_bearer_token(self):
+        """
+        Gets the bearer token from memory or otherwise in a thread as new tokens are fetched rarely.
+        """
+        token = self._get_memoised_token()
+        if token:
+            return token
+        return await sync_to_async(self.get_bearer_token, thread_sensitive=False)()
+
+    async def request(self, verb, path, params=None, json=None, timeout=30, retries=0, client=None, endpoint=None):
+        """
+        Makes a request call to Prison API (i.e. NOMIS).
+        You probably want to use the `get` or the `post` methods instead.
+        :param endpoint: path template used to label metrics, e.g. `ACCOUNT_BALANCES_PATH`
+        """
+        # checked first as the exceptions caught below are only defined if httpx is installed
+        require_httpx()
+        if not isinstance(retries, Retry):
+            retries = AuthenticatedRetry(self, retries)
+
+        endpoint = endpoint or template_endpoint(path)
+        probe = await self.circuit_breaker.abefore_call()
+        with self.instrument(verb, endpoint, retries, detached=True) as outcome:
+            try:
+                response = await arequest_retry(
+                    verb,
+                    urljoin(self.prison_api_v1_base_url, path, trailing_slash=False),
+                    retries=retries,
+                    client=client or self.client,
+                    rate_limiter=self.rate_limiter,
+                    endpoint=endpoint,
+                    headers=await self.abuild_request_api_headers(),
+                    timeout=timeout,
+                    params=params,
+                    json=json,
+                )
+            except RateLimitWaitError as e:
+                # the api was not called so this says nothing about its health
+                outcome['status'] = type(e).__name__
+                await self.circuit_breaker.arelease(probe)
+                raise
+            except (httpx.TransportError, requests.RequestException) as e:
+                outcome['status'] = type(e).__name__
+                await self.circuit_breaker.arecord(success=False, probe=probe)
+                raise
+            outcome['status'] = str(response.status_code)
+            await self.circuit_breaker.arecord(success=response.status_code < 500, probe=probe)
+
+        response.raise_for_status()
+
+        if response.status_code != requests.codes.no_content:
+            return response.json()
+
+        return {
+            'status_code': response.status_code,
+        }
+
+    async def get(self, path, params=None, timeout=30, retries=0, client=None, endpoint=None):
+        """
+        Makes a GET request to Prison API (i.e. NOMIS).
+        """
+        if params:
+            params = {
+                param: params[param]
+                for param in params
+                if params[param] is not None
+            }
+        return await self.request(
+            'get', path, params=params, timeout=timeout, retries=retries, client=client, endpoint=endpoint,
+        )
+
+    async def post(self, path, data=None, timeout=30, retries=0, client=None, endpoint=None):
+        """
+        Makes a POST request to Prison API (i.e. NOMIS).
+        """
+        return await self.request(
+            'post', path, json=data, timeout=timeout, retries=retries, client=client, endpoint=endpoint,
+        )
+
+
+class ConnectionPoolMetricCollector:
+    """
+    Exposes connection reuse of a connector's pooled session:
+    the fewer new connections per request, the fewer TCP and TLS handshakes are made.
+    """
+
+    def __init__(self, connector):
+        self.connector = connector
+
+    def collect(self):
+        pid = str(os.getpid())  # pid is needed as uwsgi runs with multiple workers
+        requests_metric = CounterMetricFamily(
+            'mtp_nomis_pool_requests', 'Requests made through pooled HMPPS API connections',
+            labels=('host', 'pid'),
+        )
+        connections_metric = CounterMetricFamily(
+            'mtp_nomis_pool_connections', 'New connections opened to HMPPS APIs',
+            labels=('host', 'pid'),
+        )
+        for host, host_stats in self.connector.pool_stats().items():
+            requests_metric.add_metric((host, pid), host_stats['requests'])
+            connections_metric.add_metric((host, pid), host_stats['connections'])
+        return [requests_metric, connections_metric]
+
+
+class CircuitBreakerMetricCollector:
+    """
+    Exposes the shared state of circuit breakers and how many calls this process was stopped from making.
+    """
+    states = {
+        CircuitBreaker.CLOSED: 0,
+        CircuitBreaker.HALF_OPEN: 1,
+        CircuitBreaker.OPEN: 2,
+    }
+
+    def __init__(self, *circuit_breakers):
+        self.circuit_breakers = circuit_breakers
+
+    def collect(self):
+        pid = str(os.getpid())  # pid is needed as uwsgi runs with multiple workers
+        state_metric = GaugeMetricFamily(
+            'mtp_nomis_circuit_state', 'State of circuit breaker: 0 closed, 1 half-open, 2 open',
+            labels=('circuit',),
+        )
+        rejected_metric = CounterMetricFamily(
+            'mtp_nomis_circuit_rejected_calls', 'Calls not made because circuit breaker was open',
+            labels=('circuit', 'pid'),
+        )
+        for circuit_breaker in self.circuit_breakers:
+            state_metric.add_metric((circuit_breaker.name,), self.states[circuit_breaker.state])
+            rejected_metric.add_metric((circuit_breaker.name, pid), circuit_breaker.rejected_calls)
+        return [state_metric, rejected_metric]
+
+
 connector = Connector()
+async_connector = AsyncConnector()
+# both connectors share circuit and rate limiting state through the cache
+async_connector.circuit_breaker = connector.circuit_breaker
+async_connector.rate_limiter = connector.rate_limiter
+
+try:
+    app = apps.get_app_config('metrics')
+    app.register_collector(request_duration)
+    app.register_collector(coalesced_requests)
+    app.register_collector(token_refreshes)
+    app.register_collector(rate_limit_wait)
+    app.register_collector(ConnectionPoolMetricCollector(connector))
+    app.register_collector(CircuitBreakerMetricCollector(connector.circuit_breaker))
+except LookupError:
+    pass
 
 
 def can_access_nomis():
     return connector.can_access_nomis()
 
 
+def call_concurrently(func, calls, max_workers=None):
+    """
+    Calls `func` for each set of arguments on a bounded thread pool.
+    Each call runs in a copy of the caller's context so that, for instance, tracing spans have the right parent.
+    :param func: function to call, e.g. `get_account_balances`
+    :param calls: dict of any hashable key to a tuple of positional arguments
+    :param max_workers: maximum concurrent calls, defaults to `HMPPS_PRISON_API_MAX_CONCURRENCY` setting
+    :return: dict of the same keys to the function's return value or the exception it raised
+    """
+    if not calls:
+        return {}
+    max_workers = max_workers or getattr(settings, 'HMPPS_PRISON_API_MAX_CONCURRENCY', 5)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+        futures = {
+            key: executor.submit(contextvars.copy_context().run, func, *args)
+            for key, args in calls.items()
+        }
+        return {
+            key: future.exception() or future.result()
+            for key, future in futures.items()
+        }
+
+
 def convert_date_param(param):
     if isinstance(param, datetime.date):
         return param.isoformat()
@@ -285,76 +1580,501 @@ def convert_date_param(param):
     return None
 
 
-def get_account_balances(prison_id, prisoner_number, retries=2, session=None):
+ACCOUNT_BALANCES_PATH = '/prison/{prison_id}/offenders/{prisoner_number}/accounts'
+TRANSACTION_HISTORY_PATH = '/prison/{prison_id}/offenders/{prisoner_number}/accounts/{account_code}/transactions'
+CREATE_TRANSACTION_PATH = '/prison/{prison_id}/offenders/{prisoner_number}/transactions'
+PHOTOGRAPH_PATH = '/offenders/{prisoner_number}/image'
+LOCATION_PATH = '/offenders/{prisoner_number}/location'
+
+
+ENDPOINT_SEGMENT_PATTERNS = (
+    (re.compile(r'^[A-Z]\d{4}[A-Z]{2}$'), '{prisoner_number}'),
+    (re.compile(r'^\d+$'), '{id}'),
+)
+
+
+def template_endpoint(path):
+    """
+    Replaces identifiers in a path with placeholders so that it can be used as a metric label.
+    """
+    segments = []
+    for segment in path.split('/'):
+        for pattern, placeholder in ENDPOINT_SEGMENT_PATTERNS:
+            if pattern.match(segment):
+                segment = placeholder
+                break
+        segments.append(segment)
+    return '/'.join(segments)
+
+
+def build_path(path_template, **path_params):
+    """
+    Fills in a Prison API path template, quoting all parameters.
+    """
+    return path_template.format(**{
+        param: quote_plus(value)
+        for param, value in path_params.items()
+    })
+
+
+def get_account_balances(prison_id, prisoner_number, retries=2, session=None, coalesce=True):
     return connector.get(
-        '/prison/{prison_id}/offenders/{prisoner_number}/accounts'.format(
-            prison_id=quote_plus(prison_id),
-            prisoner_number=quote_plus(prisoner_number)
-        ),
+        build_path(ACCOUNT_BALANCES_PATH, prison_id=prison_id, prisoner_number=prisoner_number),
         retries=retries,
         session=session,
+        endpoint=ACCOUNT_BALANCES_PATH,
+        coalesce=coalesce,
     )
 
 
-def get_transaction_history(prison_id, prisoner_number, account_code,
-                            from_date, to_date=None, retries=2, session=None):
-    params = {
+def get_account_balances_many(prisoners, retries=2, max_workers=None):
+    """
+    Gets account balances for many prisoners concurrently using the shared pooled session and bearer token.
+    :param prisoners: iterable of (prison_id, prisoner_number) pairs
+    :param max_workers: maximum concurrent Prison API calls
+    :return: dict of (prison_id, prisoner_number) pairs to balances or the exception raised when loading them
+    """
+    calls = {
+        (prison_id, prisoner_number): (prison_id, prisoner_number, retries)
+        for prison_id, prisoner_number in prisoners
+    }
+    if calls:
+        # ensure a token is available before fanning out
+        connector.get_bearer_token()
+    return call_concurrently(get_account_balances, calls, max_workers=max_workers)
+
+
+def build_transaction_history_params(from_date, to_date=None):
+    return {
         'from_date': convert_date_param(from_date),
         'to_date': convert_date_param(to_date),
     }
+
+
+def get_transaction_history(prison_id, prisoner_number, account_code,
+                            from_date, to_date=None, retries=2, session=None, coalesce=False):
     return connector.get(
-        '/prison/{prison_id}/offenders/{prisoner_number}/accounts/{account_code}/transactions'.format(
-            prison_id=quote_plus(prison_id),
-            prisoner_number=quote_plus(prisoner_number),
-            account_code=quote_plus(account_code)
+        build_path(
+            TRANSACTION_HISTORY_PATH,
+            prison_id=prison_id, prisoner_number=prisoner_number, account_code=account_code,
         ),
-        params=params,
+        params=build_transaction_history_params(from_date, to_date),
         retries=retries,
         session=session,
+        endpoint=TRANSACTION_HISTORY_PATH,
+        coalesce=coalesce,
     )
 
 
-def create_transaction(prison_id, prisoner_number, amount, record_id,
-                       description, transaction_type, retries=0, session=None):
+def iterate_transaction_history(prison_id, prisoner_number, account_code,
+                                from_date, to_date=None, chunk_days=None, max_workers=None, retries=2):
+    """
+    Yields transactions like `get_transaction_history` but splits the date range into chunks of `chunk_days`
+    which are loaded concurrently and yielded in order, so only `max_workers` chunks are held in memory at a time.
+    :param from_date: date or ISO-formatted string
+    :param to_date: date or ISO-formatted string, defaults to today
+    :param chunk_days: number of days in each chunk, at least 1
+    """
+    chunk_days = chunk_days or getattr(settings, 'HMPPS_PRISON_API_TRANSACTION_CHUNK_DAYS', 30)
+    max_workers = max_workers or getattr(settings, 'HMPPS_PRISON_API_MAX_CONCURRENCY', 5)
+    # validated before iteration starts so that mistakes are raised where the generator is created
+    if chunk_days < 1:
+        raise ValueError('Transaction history must be loaded in chunks of at least 1 day')
+    if not from_date:
+        raise ValueError('Transaction history can only be loaded in chunks from a given date')
+    if isinstance(from_date, str):
+        from_date = datetime.date.fromisoformat(from_date)
+    if isinstance(to_date, str):
+        to_date = datetime.date.fromisoformat(to_date)
+    to_date = to_date or datetime.date.today()
+
+    def date_chunks():
+        chunk_start = from_date
+        while chunk_start <= to_date:
+            chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), to_date)
+            yield chunk_start, chunk_end
+            chunk_start = chunk_end + datetime.timedelta(days=1)
 
-    data = {
+    def load_chunk(chunk):
+        return get_transaction_history(
+            prison_id, prisoner_number, account_code,
+            chunk[0], chunk[1], retries=retries,
+        ).get('transactions', [])
+
+    def iterate_chunks():
+        chunks = date_chunks()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            pending = collections.deque(
+                executor.submit(contextvars.copy_context().run, load_chunk, chunk)
+                for chunk in itertools.islice(chunks, max_workers)
+            )
+            while pending:
+                transactions = pending.popleft().result()
+                next_chunk = next(chunks, None)
+                if next_chunk:
+                    pending.append(executor.submit(contextvars.copy_context().run, load_chunk, next_chunk))
+                yield from transactions
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return iterate_chunks()
+
+
+def build_transaction_data(amount, record_id, description, transaction_type):
+    return {
         'type': transaction_type,
         'description': description,
         'amount': amount,
         'client_transaction_id': str(record_id),
         'client_unique_ref': str(record_id)
     }
+
+
+def create_transaction(prison_id, prisoner_number, amount, record_id,
+                       description, transaction_type, retries=0, session=None):
     return connector.post(
-        '/prison/{prison_id}/offenders/{prisoner_number}/transactions'.format(
-            prison_id=quote_plus(prison_id),
-            prisoner_number=quote_plus(prisoner_number)
-        ),
-        data,
+        build_path(CREATE_TRANSACTION_PATH, prison_id=prison_id, prisoner_number=prisoner_number),
+        build_transaction_data(amount, record_id, description, transaction_type),
         retries=retries,
         session=session,
+        endpoint=CREATE_TRANSACTION_PATH,
     )
 
 
-def get_photograph_data(prisoner_number, retries=0, session=None):
+class TransactionPostingReport:
+    """
+    Outcome of posting each transaction in `create_transactions`, keyed by record id.
+    Outcomes are dicts with a `status` of:
+    - `created`, with the Prison API `response`
+    - `duplicate` if Prison API already had a transaction with the same `client_unique_ref`
+    - `failed`, with the `error` raised
+    """
+    CREATED = 'created'
+    DUPLICATE = 'duplicate'
+    FAILED = 'failed'
+
+    def __init__(self, outcomes, duration):
+        self.outcomes = outcomes
+        self.duration = duration
+
+    def record_ids_with_status(self, *statuses):
+        return [
+            record_id
+            for record_id, outcome in self.outcomes.items()
+            if outcome['status'] in statuses
+        ]
+
+    @property
+    def succeeded(self):
+        """
+        Record ids of transactions that are now in NOMIS, including ones posted previously
+        """
+        return self.record_ids_with_status(self.CREATED, self.DUPLICATE)
+
+    @property
+    def failed(self):
+        return self.record_ids_with_status(self.FAILED)
+
+    @property
+    def throughput(self):
+        """
+        Transactions processed per second
+        """
+        return len(self.outcomes) / self.duration if self.duration else 0
+
+
+def post_transaction_idempotently(transaction, retries=2):
+    """
+    Posts a transaction retrying failures, which is safe because Prison API rejects transactions
+    with a repeated `client_unique_ref` (i.e. record id) with a 409 response.
+    :param transaction: dict of `create_transaction` arguments
+    :return: outcome as described in `TransactionPostingReport`
+    """
+    try:
+        response = create_transaction(**transaction, retries=retries)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == requests.codes.conflict:
+            return {'status': TransactionPostingReport.DUPLICATE}
+        return {'status': TransactionPostingReport.FAILED, 'error': e}
+    except requests.RequestException as e:
+        return {'status': TransactionPostingReport.FAILED, 'error': e}
+    return {'status': TransactionPostingReport.CREATED, 'response': response}
+
+
+def create_transactions(transactions, retries=2, max_workers=None):
+    """
+    Posts many transactions concurrently, e.g. for the daily credit batch.
+    Raises ValueError without posting any transactions if a `record_id` is repeated.
+    :param transactions: iterable of dicts of `create_transaction` arguments, each with a unique `record_id`
+    :return: TransactionPostingReport
+    """
+    calls = {}
+    for transaction in transactions:
+        record_id = str(transaction['record_id'])
+        if record_id in calls:
+            raise ValueError(f'Transaction record id {record_id} is repeated')
+        calls[record_id] = (transaction, retries)
+    started_at = time.monotonic()
+    if calls:
+        # ensure a token is available before fanning out
+        connector.get_bearer_token()
+    outcomes = call_concurrently(post_transaction_idempotently, calls, max_workers=max_workers)
+    for record_id, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            outcomes[record_id] = {'status': TransactionPostingReport.FAILED, 'error': outcome}
+    report = TransactionPostingReport(outcomes, time.monotonic() - started_at)
+    logger.info(
+        'Posted %d transactions to NOMIS in %0.1fs (%0.1f/s), %d failed',
+        len(outcomes), report.duration, report.throughput, len(report.failed),
+    )
+    return report
+
+
+def get_photograph_data(prisoner_number, retries=0, session=None, coalesce=True):
     result = connector.get(
-        '/offenders/{prisoner_number}/image'.format(
-            prisoner_number=quote_plus(prisoner_number)
-        ),
+        build_path(PHOTOGRAPH_PATH, prisoner_number=prisoner_number),
         retries=retries,
         session=session,
+        endpoint=PHOTOGRAPH_PATH,
+        coalesce=coalesce,
     )
 
     return result.get('image', None)
 
 
-def get_location(prisoner_number, retries=2, session=None):
-    result = connector.get(
-        '/offenders/{prisoner_number}/location'.format(
-            prisoner_number=quote_plus(prisoner_number)
-        ),
-        retries=retries,
-        session=session,
+class PhotographCache:
+    """
+    In-process cache of decoded prisoner photographs holding at most `max_bytes`,
+    evicting the least recently used ones first.
+    Photographs older than `refresh_after` seconds are revalidated using `If-None-Match`
+    if Prison API provided an `ETag`, or loaded again otherwise.
+    NB: it is not shared through the Django cache so each process (e.g. uWSGI worker) loads photographs itself
+    and can use up to `max_bytes` of memory.
+    """
+
+    def __init__(self, max_bytes=None, refresh_after=None):
+        self._max_bytes = max_bytes
+        self._refresh_after = refresh_after
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'HMPPS_PRISON_API_PHOTOGRAPH_CACHE_SIZE', 20 * 1024 * 1024)
+
+    @property
+    def refresh_after(self):
+        return self._refresh_after or getattr(settings, 'HMPPS_PRISON_API_PHOTOGRAPH_CACHE_TIMEOUT', 60 * 60)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, prisoner_number, retries=0, session=None):
+        """
+        :return: photograph bytes or None if the prisoner has none
+        """
+        with self._lock:
+            entry = self._entries.get(prisoner_number)
+            if entry is not None:
+                self._entries.move_to_end(prisoner_number)
+        if entry is not None and time.monotonic() - entry['loaded_at'] < self.refresh_after:
+            return entry['data'] or None
+
+        headers = {'If-None-Match': entry['etag']} if entry is not None and entry['etag'] else None
+        response = connector.request_response(
+            'get',
+            build_path(PHOTOGRAPH_PATH, prisoner_number=prisoner_number),
+            headers=headers,
+            retries=retries,
+            session=session,
+            endpoint=PHOTOGRAPH_PATH,
+        )
+        if response.status_code == requests.codes.not_modified:
+            data = entry['data']
+            # Prison API need not repeat the ETag in a 304 response
+            etag = response.headers.get('ETag') or entry['etag']
+        else:
+            image = response.json().get('image', None)
+            data = base64.b64decode(image) if image else b''
+            etag = response.headers.get('ETag')
+        self._store(prisoner_number, data, etag)
+        return data or None
+
+    def _store(self, prisoner_number, data, etag):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous_entry = self._entries.pop(prisoner_number, None)
+            if previous_entry is not None:
+                self._size -= len(previous_entry['data'])
+            self._entries[prisoner_number] = {'data': data, 'etag': etag, 'loaded_at': time.monotonic()}
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted_entry = self._entries.popitem(last=False)
+                self._size -= len(evicted_entry['data'])
+
+    def invalidate(self, prisoner_number):
+        with self._lock:
+            entry = self._entries.pop(prisoner_number, None)
+            if entry is not None:
+                self._size -= len(entry['data'])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+photograph_cache = PhotographCache()
+
+
+def get_photograph_bytes(prisoner_number, retries=0, session=None, use_cache=True):
+    """
+    :param use_cache: use this process's `photograph_cache`
+    :return: decoded photograph of a prisoner or None if they have none
+    """
+    if use_cache:
+        return photograph_cache.get(prisoner_number, retries=retries, session=session)
+    image = get_photograph_data(prisoner_number, retries=retries, session=session)
+    return base64.b64decode(image) if image else None
+
+
+def guess_image_content_type(data):
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+
+def photograph_response(prisoner_number, chunk_size=64 * 1024, cache_control='private, max-age=3600'):
+    """
+    :param cache_control: `Cache-Control` header of the response, if any
+    :return: streaming HTTP response of a prisoner's photograph for use in views,
+        or a 404 response if they have none or Prison API does not know them
+    """
+    try:
+        data = get_photograph_bytes(prisoner_number)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == requests.codes.not_found:
+            return HttpResponseNotFound()
+        raise
+    if not data:
+        return HttpResponseNotFound()
+
+    view = memoryview(data)
+    response = StreamingHttpResponse(
+        (view[start:start + chunk_size] for start in range(0, len(data), chunk_size)),
+        content_type=guess_image_content_type(data),
     )
+    response['Content-Length'] = str(len(data))
+    if cache_control:
+        response['Cache-Control'] = cache_control
+    return response
+
+
+def get_location(prisoner_number, retries=2, session=None, use_cache=False, coalesce=True):
+    """
+    :param use_cache: read through a cache of locations shared between processes, also remembering 404 responses;
+        `invalidate_location` should be called when a prisoner is known to have moved
+    :param coalesce: share the response of an identical request already being made by another thread
+    """
+    cache_key = location_cache_key(prisoner_number) if use_cache else None
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return location_from_cache(prisoner_number, cached)
+
+    try:
+        result = connector.get(
+            build_path(LOCATION_PATH, prisoner_number=prisoner_number),
+            retries=retries,
+            session=session,
+            endpoint=LOCATION_PATH,
+            coalesce=coalesce,
+        )
+    except requests.HTTPError as e:
+        if use_cache and e.response is not None and e.response.status_code == 404:
+            cache.set(cache_key, {'not_found': True}, timeout=location_not_found_cache_timeout())
+        raise
+    location = parse_location(result)
+    if use_cache:
+        cache.set(cache_key, {'location': location}, timeout=location_cache_timeout())
+    return location
+
+
+def location_cache_key(prisoner_number):
+    return f'nomis-location-{prisoner_number}'
+
+
+def location_cache_timeout():
+    return getattr(settings, 'HMPPS_PRISON_API_LOCATION_CACHE_TIMEOUT', 60 * 5)
+
+
+def location_not_found_cache_timeout():
+    return getattr(settings, 'HMPPS_PRISON_API_LOCATION_NOT_FOUND_CACHE_TIMEOUT', 60)
+
+
+def location_from_cache(prisoner_number, cached):
+    """
+    :return: location stored in cache or raises HTTPError if Prison API previously responded with 404
+    """
+    if cached.get('not_found'):
+        response = requests.Response()
+        response.status_code = 404
+        response.reason = 'Not Found'
+        response.url = urljoin(
+            connector.prison_api_v1_base_url,
+            build_path(LOCATION_PATH, prisoner_number=prisoner_number),
+            trailing_slash=False,
+        )
+        raise requests.HTTPError(f'404 Client Error: Not Found (cached) for url: {response.url}', response=response)
+    return cached['location']
+
+
+def invalidate_location(prisoner_number):
+    """
+    Removes a prisoner's location from the cache used by `get_location`.
+    """
+    cache.delete(location_cache_key(prisoner_number))
+
+
+def prefetch_locations(prisoner_numbers, retries=2, max_workers=None):
+    """
+    Warms the location cache used by `get_location` for many prisoners concurrently.
+    :return: dict of prisoner number to location or the exception raised when loading it
+    """
+    prisoner_numbers = set(prisoner_numbers)
+    cached = cache.get_many([location_cache_key(prisoner_number) for prisoner_number in prisoner_numbers])
+    locations = {}
+    calls = {}
+    for prisoner_number in prisoner_numbers:
+        cache_key = location_cache_key(prisoner_number)
+        if cache_key in cached:
+            try:
+                locations[prisoner_number] = location_from_cache(prisoner_number, cached[cache_key])
+            except requests.HTTPError as e:
+                locations[prisoner_number] = e
+        else:
+            calls[prisoner_number] = (prisoner_number,)
+    if calls:
+        # ensure a token is available before fanning out
+        connector.get_bearer_token()
+    load_location = partial(get_location, retries=retries, use_cache=True)
+    locations.update(call_concurrently(load_location, calls, max_workers=max_workers))
+    return locations
+
+
+def parse_location(result):
+    """
+    Converts a Prison API location response into the shape used by prisoner money apps.
+    :return: dict with prison's `nomis_id`, `name` and, if known, `housing_location`; None if not in a prison
+    """
     if 'establishment' in result:
         location = {
             'nomis_id': result['establishment']['code'],
@@ -376,3 +2096,110 @@ def get_location(prisoner_number, retries=2, session=None):
             location['housing_location'] = housing
         return location
     return None
+
+
+# asyncio versions of the above
+
+
+async def acall_concurrently(func, calls, max_workers=None):
+    """
+    Like `call_concurrently` but awaits coroutine function `func` on the running event loop.
+    """
+    max_workers = max_workers or getattr(settings, 'HMPPS_PRISON_API_MAX_CONCURRENCY', 5)
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def call(args):
+        async with semaphore:
+            return await func(*args)
+
+    keys = list(calls.keys())
+    results = await asyncio.gather(*(call(calls[key]) for key in keys), return_exceptions=True)
+    return dict(zip(keys, results))
+
+
+async def aget_account_balances(prison_id, prisoner_number, retries=2, client=None):
+    return await async_connector.get(
+        build_path(ACCOUNT_BALANCES_PATH, prison_id=prison_id, prisoner_number=prisoner_number),
+        retries=retries,
+        client=client,
+        endpoint=ACCOUNT_BALANCES_PATH,
+    )
+
+
+async def aget_account_balances_many(prisoners, retries=2, max_workers=None):
+    calls = {
+        (prison_id, prisoner_number): (prison_id, prisoner_number, retries)
+        for prison_id, prisoner_number in prisoners
+    }
+    if calls:
+        # ensure a token is available before fanning out
+        await async_connector.aget_bearer_token()
+    return await acall_concurrently(aget_account_balances, calls, max_workers=max_workers)
+
+
+async def aget_transaction_history(prison_id, prisoner_number, account_code,
+                                   from_date, to_date=None, retries=2, client=None):
+    return await async_connector.get(
+        build_path(
+            TRANSACTION_HISTORY_PATH,
+            prison_id=prison_id, prisoner_number=prisoner_number, account_code=account_code,
+        ),
+        params=build_transaction_history_params(from_date, to_date),
+        retries=retries,
+        client=client,
+        endpoint=TRANSACTION_HISTORY_PATH,
+    )
+
+
+async def acreate_transaction(prison_id, prisoner_number, amount, record_id,
+                              description, transaction_type, retries=0, client=None):
+    return await async_connector.post(
+        build_path(CREATE_TRANSACTION_PATH, prison_id=prison_id, prisoner_number=prisoner_number),
+        build_transaction_data(amount, record_id, description, transaction_type),
+        retries=retries,
+        client=client,
+        endpoint=CREATE_TRANSACTION_PATH,
+    )
+
+
+async def aget_photograph_data(prisoner_number, retries=0, client=None):
+    result = await async_connector.get(
+        build_path(PHOTOGRAPH_PATH, prisoner_number=prisoner_number),
+        retries=retries,
+        client=client,
+        endpoint=PHOTOGRAPH_PATH,
+    )
+
+    return result.get('image', None)
+
+
+async def aget_location(prisoner_number, retries=2, client=None, use_cache=False):
+    require_httpx()
+    cache_key = location_cache_key(prisoner_number) if use_cache else None
+    if use_cache:
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            try:
+                return location_from_cache(prisoner_number, cached)
+            except requests.HTTPError as e:
+                # match errors raised by AsyncConnector
+                request = httpx.Request('GET', e.response.url)
+                raise httpx.HTTPStatusError(
+                    str(e), request=request, response=httpx.Response(404, request=request),
+                ) from e
+
+    try:
+        result = await async_connector.get(
+            build_path(LOCATION_PATH, prisoner_number=prisoner_number),
+            retries=retries,
+            client=client,
+            endpoint=LOCATION_PATH,
+        )
+    except httpx.HTTPStatusError as e:
+        if use_cache and e.response.status_code == 404:
+            await cache.aset(cache_key, {'not_found': True}, timeout=location_not_found_cache_timeout())
+        raise
+    location = parse_location(result)
+    if use_cache:
+        await cache.aset(cache_key, {'location': location}, timeout=location_cache_timeout())
+    return location
@@ -0,0 +1,300 @@
+"""
+Offline stand-in for HMPPS Auth and Prison API with a harness for benchmarking `mtp_common.nomis`
+"""
+import base64
+import contextlib
+import datetime
+import http.server
+import json
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from django.test import override_settings
+import requests
+
+from mtp_common import nomis
+
+# smallest valid jpeg-like payload; only the magic bytes matter to clients
+STAND_IN_PHOTOGRAPH = b'\xff\xd8\xff\xe0' + b'\x00' * 252 + b'\xff\xd9'
+
+
+class PrisonApiStandIn:
+    """
+    Local HTTP server imitating HMPPS Auth token endpoint and Prison API v1 endpoints used by `mtp_common.nomis`.
+    ```
+    with PrisonApiStandIn(latency=0.05, error_rate=0.01) as stand_in, stand_in.settings():
+        nomis.get_account_balances('BXI', 'A1409AE')
+    ```
+    :param latency: seconds to wait before responding, or (min, max) tuple to wait a random time
+    :param error_rate: proportion of Prison API requests that respond with 503
+    :param token_lifetime: seconds after which issued tokens are rejected with 401;
+        clients are told tokens last `expires_in` seconds so a shorter lifetime simulates tokens expiring early
+    :param expires_in: token lifetime reported to clients
+    """
+
+    def __init__(self, latency=0, error_rate=0, token_lifetime=None, expires_in=3600):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.expires_in = expires_in
+        self.token_requests = 0
+        self.api_requests = 0
+        self._tokens = {}
+        self._transaction_refs = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        handler_class = type('PrisonApiStandInRequestHandler', (PrisonApiStandInRequestHandler,), {'stand_in': self})
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @contextlib.contextmanager
+    def settings(self):
+        """
+        Points `mtp_common.nomis` at this stand-in, starting with no cached token or open circuit.
+        """
+        with override_settings(
+            HMPPS_CLIENT_ID='stand-in',
+            HMPPS_CLIENT_SECRET='stand-in',
+            HMPPS_AUTH_BASE_URL=f'{self.url}/auth',
+            HMPPS_PRISON_API_BASE_URL=self.url,
+        ):
+            nomis.connector.forget_token()
+            nomis.connector.circuit_breaker.reset()
+            try:
+                yield
+            finally:
+                nomis.connector.forget_token()
+                nomis.connector.circuit_breaker.reset()
+
+    def expire_tokens(self):
+        """
+        Rejects all issued tokens from now on, as if HMPPS Auth revoked them.
+        """
+        with self._lock:
+            self._tokens.clear()
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.token_requests += 1
+            self._tokens[token] = time.monotonic()
+        return token
+
+    def is_token_valid(self, token):
+        with self._lock:
+            issued_at = self._tokens.get(token)
+        if issued_at is None:
+            return False
+        return self.token_lifetime is None or time.monotonic() - issued_at < self.token_lifetime
+
+    def count_api_request(self):
+        with self._lock:
+            self.api_requests += 1
+
+    def record_transaction(self, client_unique_ref):
+        """
+        :return: False if a transaction with this reference was already posted
+        """
+        with self._lock:
+            if client_unique_ref in self._transaction_refs:
+                return False
+            self._transaction_refs.add(client_unique_ref)
+            return True
+
+    def wait(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+
+class PrisonApiStandInRequestHandler(http.server.BaseHTTPRequestHandler):
+    stand_in = None
+    protocol_version = 'HTTP/1.1'
+    routes = (
+        ('GET', re.compile(r'^/api/v1/prison/(?P<prison_id>[^/]+)/offenders/(?P<prisoner_number>[^/]+)/accounts$'),
+         'account_balances'),
+        ('GET', re.compile(r'^/api/v1/prison/(?P<prison_id>[^/]+)/offenders/(?P<prisoner_number>[^/]+)/accounts/'
+                           r'(?P<account_code>[^/]+)/transactions$'),
+         'transaction_history'),
+        ('POST', re.compile(r'^/api/v1/prison/(?P<prison_id>[^/]+)/offenders/(?P<prisoner_number>[^/]+)/transactions$'),
+         'create_transaction'),
+        ('GET', re.compile(r'^/api/v1/offenders/(?P<prisoner_number>[^/]+)/location$'), 'location'),
+        ('GET', re.compile(r'^/api/v1/offenders/(?P<prisoner_number>[^/]+)/image$'), 'photograph'),
+    )
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_GET(self):  # noqa: N802
+        self.handle_api_request('GET')
+
+    def do_POST(self):  # noqa: N802
+        if urlsplit(self.path).path == '/auth/oauth/token':
+            self.read_body()
+            self.stand_in.wait()
+            self.respond(200, {
+                'access_token': self.stand_in.issue_token(),
+                'token_type': 'bearer',
+                'expires_in': self.stand_in.expires_in,
+            })
+            return
+        self.handle_api_request('POST')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else None
+
+    def respond(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_api_request(self, method):
+        url = urlsplit(self.path)
+        data = self.read_body()
+        self.stand_in.count_api_request()
+        self.stand_in.wait()
+
+        authorisation = self.headers.get('Authorization') or ''
+        if not self.stand_in.is_token_valid(authorisation.removeprefix('Bearer ')):
+            self.respond(401, {'error': 'invalid_token'})
+            return
+        if self.stand_in.error_rate and random.random() < self.stand_in.error_rate:
+            self.respond(503, {'message': 'Service unavailable'})
+            return
+
+        for route_method, pattern, handler_name in self.routes:
+            if route_method != method:
+                continue
+            matches = pattern.match(url.path)
+            if matches:
+                handler = getattr(self, f'handle_{handler_name}')
+                status, response_data = handler(params=parse_qs(url.query), data=data, **matches.groupdict())
+                self.respond(status, response_data)
+                return
+        self.respond(404, {'message': 'Not found'})
+
+    def handle_account_balances(self, **_):
+        return 200, {'cash': 1000, 'savings': 500, 'spends': 250}
+
+    def handle_transaction_history(self, params, **_):
+        from_date = datetime.date.fromisoformat(params['from_date'][0])
+        to_date = datetime.date.fromisoformat(params['to_date'][0]) if 'to_date' in params else from_date
+        transactions = []
+        date = from_date
+        while date <= to_date:
+            transactions.append({
+                'id': f'{date:%Y%m%d}-1',
+                'type': {'code': 'CANT', 'desc': 'Canteen Purchase'},
+                'description': 'Canteen Purchase',
+                'amount': 100,
+                'date': date.isoformat(),
+            })
+            date += datetime.timedelta(days=7)
+        return 200, {'transactions': transactions}
+
+    def handle_create_transaction(self, data, **_):
+        if not data or not data.get('client_unique_ref'):
+            return 400, {'message': 'Missing client_unique_ref'}
+        if not self.stand_in.record_transaction(data['client_unique_ref']):
+            return 409, {'message': 'Duplicate post'}
+        return 200, {'id': f'{uuid.uuid4().int % 10 ** 8}-1', 'description': data.get('description')}
+
+    def handle_location(self, prisoner_number, **_):
+        return 200, {
+            'establishment': {'code': 'BXI', 'desc': 'BRIXTON (HMP)'},
+            'housing_location': {
+                'levels': [
+                    {'type': 'Wing', 'value': prisoner_number[1]},
+                    {'type': 'Landing', 'value': prisoner_number[2]},
+                    {'type': 'Cell', 'value': prisoner_number[3:5]},
+                ],
+            },
+        }
+
+    def handle_photograph(self, **_):
+        return 200, {'image': base64.b64encode(STAND_IN_PHOTOGRAPH).decode()}
+
+
+def benchmark(func, calls, concurrency):
+    """
+    Calls `func` with each call number from 0 to `calls` - 1 on `concurrency` threads.
+    :return: dict with latency percentiles and mean (in seconds), throughput (calls per second) and error count
+    """
+
+    def timed_call(call_number):
+        started_at = time.perf_counter()
+        try:
+            func(call_number)
+        except requests.RequestException:
+            return time.perf_counter() - started_at, False
+        return time.perf_counter() - started_at, True
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(calls)))
+    duration = time.perf_counter() - started_at
+
+    latencies = [latency for latency, _ in results]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'calls': calls,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, succeeded in results if not succeeded),
+        'duration': duration,
+        'throughput': calls / duration if duration else 0,
+        'mean': statistics.fmean(latencies) if latencies else 0,
+        'p50': percentiles[49] if percentiles else 0,
+        'p95': percentiles[94] if percentiles else 0,
+        'p99': percentiles[98] if percentiles else 0,
+    }
+
+
+def benchmark_connector(stand_in, calls=1000, concurrency=10):
+    """
+    Benchmarks loading account balances of distinct prisoners from a running `PrisonApiStandIn`.
+    :return: dict as returned by `benchmark` with the number of tokens fetched from HMPPS Auth
+    """
+
+    def get_balances(call_number):
+        nomis.get_account_balances('BXI', f'A{call_number % 10000:04d}AA')
+
+    token_requests = stand_in.token_requests
+    with stand_in.settings():
+        results = benchmark(get_balances, calls=calls, concurrency=concurrency)
+    results['token_refreshes'] = stand_in.token_requests - token_requests
+    return results
@@ -49,11 +49,16 @@ extras_require = {
         'flake8-debugger~=4.1',
         # 'flake8-logging~=1.8',
         'flake8-quotes~=3.4',
+        'httpx~=0.28',
         'pep8-naming~=0.15',
         'responses~=0.25',
         'twine~=6.2',
         'watchdog~=6.0',
     ],
+    'async': [
+        # third-party dependencies (versions should be flexible to allow for bug fixes)
+        'httpx~=0.28',
+    ],
 }
 
 setup(
@@ -0,0 +1,84 @@
+"""
+Benchmarks for development, run using `./run.py benchmark_api_client` and `./run.py benchmark_nomis`;
+they are kept with the tests so that they are not installed into apps using this package
+"""
+import json
+import timeit
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+from mtp_common.auth.api_client import ApiClient, MoJOAuth2Session, _get_slumber_connection
+from mtp_common.test_utils.nomis import PrisonApiStandIn, benchmark_connector
+
+
+class CannedResponseAdapter(HTTPAdapter):
+    """
+    Responds to every request with the same JSON body without touching the network
+    """
+
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response._content = self.content
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def benchmark_api_client(calls=2000, results=20):
+    """
+    Micro-benchmarks the lean api client against slumber connections using canned mtp-api responses
+    :return: dict of seconds per call for `slumber` and `api_client`
+    """
+    content = json.dumps({
+        'count': results,
+        'results': [
+            {
+                'id': number, 'prisoner_number': 'A1409AE', 'amount': 1000,
+                'sender_name': 'JOHN SMITH', 'resolution': 'credited', 'received_at': '2024-01-01T12:00:00Z',
+            }
+            for number in range(results)
+        ],
+    }).encode()
+
+    slumber_session = MoJOAuth2Session()
+    slumber_session.mount(settings.API_URL, CannedResponseAdapter(content))
+    client_session = MoJOAuth2Session()
+    client_session.mount(settings.API_URL, CannedResponseAdapter(content))
+    client = ApiClient(client_session)
+
+    def call_slumber():
+        _get_slumber_connection(slumber_session).prisoners('A1409AE').credits.get(status='credited')
+
+    def call_client():
+        client.get('prisoners/{prisoner_number}/credits/', prisoner_number='A1409AE', params={'status': 'credited'})
+
+    return {
+        'slumber': timeit.timeit(call_slumber, number=calls) / calls,
+        'api_client': timeit.timeit(call_client, number=calls) / calls,
+    }
+
+
+def benchmark_nomis(calls=1000, concurrency=10, latency=0.02, error_rate=0, token_lifetime=None,
+                    max_p95=None, min_throughput=None):
+    """
+    Benchmarks the Prison API connector against a local stand-in for HMPPS Auth and Prison API
+    :return: tuple of results from `benchmark_connector` and list of failed thresholds
+    """
+    with PrisonApiStandIn(latency=latency, error_rate=error_rate, token_lifetime=token_lifetime) as stand_in:
+        results = benchmark_connector(stand_in, calls=calls, concurrency=concurrency)
+
+    failures = []
+    if max_p95 is not None and results['p95'] > max_p95:
+        failures.append(f'95th percentile latency {results["p95"]:.4f}s exceeds {max_p95}s')
+    if min_throughput is not None and results['throughput'] < min_throughput:
+        failures.append(f'throughput {results["throughput"]:.1f} calls/s is below {min_throughput}')
+    return results, failures
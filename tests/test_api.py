@@ -0,0 +1,227 @@
+import contextvars
+import json
+
+from django.conf import settings
+from django.test import SimpleTestCase
+import requests
+import responses
+
+from mtp_common.api import (
+    CURSOR_PAGINATION, KEYSET_PAGINATION,
+    iterate_all_pages, iterate_all_pages_for_path, retrieve_all_pages, retrieve_all_pages_for_path,
+)
+from mtp_common.auth import urljoin
+
+
+request_context = contextvars.ContextVar('request_context', default=None)
+
+
+class FakePaginatedEndpoint:
+    """
+    Imitates a slumber callable for an api paginated with LimitOffsetPagination
+    """
+
+    def __init__(self, count, max_limit=None):
+        self.records = [{'id': number} for number in range(count)]
+        self.max_limit = max_limit
+        self.calls = []
+        self.contexts = []
+
+    def __call__(self, limit, offset, **kwargs):
+        self.calls.append((limit, offset, kwargs))
+        self.contexts.append(request_context.get())
+        if self.max_limit:
+            limit = min(limit, self.max_limit)
+        return {
+            'count': len(self.records),
+            'results': self.records[offset:offset + limit],
+        }
+
+
+class FakeCursorPaginatedEndpoint(FakePaginatedEndpoint):
+    """
+    Imitates a slumber callable for an api paginated with CursorPagination
+    or, if filtered by `id__gt`, LimitOffsetPagination
+    """
+
+    def __call__(self, limit, cursor=None, id__gt=None, **kwargs):
+        self.calls.append((limit, cursor, id__gt, kwargs))
+        limit = int(limit)
+        if id__gt is not None:
+            records = [record for record in self.records if record['id'] > id__gt]
+        else:
+            records = self.records[int(cursor or 0):]
+        results = records[:limit]
+        next_link = None
+        if len(records) > limit:
+            next_cursor = results[-1]['id'] + 1
+            next_link = f'https://api.local/credits/?cursor={next_cursor}&limit={limit}&prison=BXI&prison=LEI'
+        return {'next': next_link, 'results': results}
+
+
+class RetrieveAllPagesTestCase(SimpleTestCase):
+    def test_sequential(self):
+        endpoint = FakePaginatedEndpoint(45)
+        results = retrieve_all_pages(endpoint, status='pending')
+        self.assertListEqual(results, endpoint.records)
+        self.assertListEqual(
+            endpoint.calls,
+            [(20, 0, {'status': 'pending'}), (20, 20, {'status': 'pending'}), (20, 40, {'status': 'pending'})],
+        )
+
+    def test_filters_named_like_options_passed_through(self):
+        endpoint = FakePaginatedEndpoint(5)
+        results = retrieve_all_pages(endpoint, page_size='large', pagination='none', _max_workers=4)
+        self.assertListEqual(results, endpoint.records)
+        self.assertListEqual(endpoint.calls, [(20, 0, {'page_size': 'large', 'pagination': 'none'})])
+
+    def test_single_page(self):
+        endpoint = FakePaginatedEndpoint(5)
+        self.assertListEqual(retrieve_all_pages(endpoint, _max_workers=4), endpoint.records)
+        self.assertEqual(len(endpoint.calls), 1)
+
+    def test_empty(self):
+        endpoint = FakePaginatedEndpoint(0)
+        self.assertListEqual(retrieve_all_pages(endpoint, _max_workers=4), [])
+
+    def test_concurrent(self):
+        endpoint = FakePaginatedEndpoint(1001)
+        results = retrieve_all_pages(endpoint, _page_size=100, _max_workers=4)
+        self.assertListEqual(results, endpoint.records)
+        self.assertEqual(len(endpoint.calls), 11)
+        self.assertSetEqual({offset for _, offset, _ in endpoint.calls}, set(range(0, 1001, 100)))
+
+    def test_concurrent_in_callers_context(self):
+        endpoint = FakePaginatedEndpoint(95)
+        token = request_context.set('request-1')
+        try:
+            retrieve_all_pages(endpoint, _page_size=10, _max_workers=4)
+        finally:
+            request_context.reset(token)
+        self.assertEqual(endpoint.contexts, ['request-1'] * 10)
+
+    def test_concurrent_with_capped_page_size(self):
+        endpoint = FakePaginatedEndpoint(95, max_limit=30)
+        results = retrieve_all_pages(endpoint, _page_size=100, _max_workers=4)
+        self.assertListEqual(results, endpoint.records)
+        self.assertEqual(len(endpoint.calls), 4)
+
+    def test_concurrent_for_path(self):
+        records = [{'id': number} for number in range(25)]
+        url = urljoin(settings.API_URL, 'requests/')
+
+        def callback(request):
+            limit, offset = int(request.params['limit']), int(request.params['offset'])
+            self.assertEqual(request.params['role'], 'cashbook')
+            return 200, {}, json.dumps({'count': len(records), 'results': records[offset:offset + limit]})
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(responses.GET, url, callback=callback)
+            with requests.Session() as session:
+                results = retrieve_all_pages_for_path(session, url, _page_size=10, _max_workers=3, role='cashbook')
+            self.assertEqual(len(rsps.calls), 3)
+        self.assertListEqual(results, records)
+
+
+class IterateAllPagesTestCase(SimpleTestCase):
+    def test_pages_loaded_lazily(self):
+        endpoint = FakePaginatedEndpoint(45)
+        results = iterate_all_pages(endpoint, status='pending')
+        self.assertEqual(endpoint.calls, [])
+        self.assertEqual(next(results), {'id': 0})
+        self.assertEqual(len(endpoint.calls), 1)
+        self.assertListEqual(list(results), endpoint.records[1:])
+        self.assertListEqual([offset for _, offset, _ in endpoint.calls], [0, 20, 40])
+
+    def test_prefetch(self):
+        endpoint = FakePaginatedEndpoint(45, max_limit=10)
+        results = iterate_all_pages(endpoint, _page_size=20, _prefetch=True)
+        self.assertEqual(next(results), {'id': 0})
+        self.assertListEqual(list(results), endpoint.records[1:])
+        self.assertListEqual([offset for _, offset, _ in endpoint.calls], [0, 10, 20, 30, 40])
+
+    def test_prefetch_in_callers_context(self):
+        endpoint = FakePaginatedEndpoint(45)
+        token = request_context.set('request-1')
+        try:
+            list(iterate_all_pages(endpoint, _prefetch=True))
+        finally:
+            request_context.reset(token)
+        self.assertEqual(endpoint.contexts, ['request-1'] * 3)
+
+    def test_empty(self):
+        endpoint = FakePaginatedEndpoint(0)
+        self.assertListEqual(list(iterate_all_pages(endpoint, _prefetch=True)), [])
+        self.assertEqual(len(endpoint.calls), 1)
+
+    def test_for_path(self):
+        records = [{'id': number} for number in range(25)]
+        url = urljoin(settings.API_URL, 'requests/')
+
+        def callback(request):
+            limit, offset = int(request.params['limit']), int(request.params['offset'])
+            return 200, {}, json.dumps({'count': len(records), 'results': records[offset:offset + limit]})
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(responses.GET, url, callback=callback)
+            with requests.Session() as session:
+                results = list(iterate_all_pages_for_path(session, url, _page_size=10, _prefetch=True))
+            self.assertEqual(len(rsps.calls), 3)
+        self.assertListEqual(results, records)
+
+
+class CursorPaginationTestCase(SimpleTestCase):
+    def test_follows_next_links(self):
+        endpoint = FakeCursorPaginatedEndpoint(25)
+        results = retrieve_all_pages(endpoint, _page_size=10, _pagination=CURSOR_PAGINATION, prison=['BXI', 'LEI'])
+        self.assertListEqual(results, endpoint.records)
+        self.assertListEqual(endpoint.calls, [
+            (10, None, None, {'prison': ['BXI', 'LEI']}),
+            ('10', '10', None, {'prison': ['BXI', 'LEI']}),
+            ('10', '20', None, {'prison': ['BXI', 'LEI']}),
+        ])
+
+    def test_page_size_param(self):
+        records = [{'id': number} for number in range(15)]
+        url = urljoin(settings.API_URL, 'requests/')
+
+        def callback(request):
+            self.assertNotIn('limit', request.params)
+            page_size, cursor = int(request.params['page_size']), int(request.params.get('cursor', 0))
+            next_link = None
+            if cursor + page_size < len(records):
+                next_link = f'{url}?cursor={cursor + page_size}&page_size={page_size}'
+            return 200, {}, json.dumps({'next': next_link, 'results': records[cursor:cursor + page_size]})
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(responses.GET, url, callback=callback)
+            with requests.Session() as session:
+                results = retrieve_all_pages_for_path(
+                    session, url, _page_size=10, _pagination=CURSOR_PAGINATION, _page_size_param='page_size',
+                )
+            self.assertEqual(len(rsps.calls), 2)
+        self.assertListEqual(results, records)
+
+    def test_keyset(self):
+        endpoint = FakeCursorPaginatedEndpoint(25)
+        results = list(iterate_all_pages(endpoint, _page_size=10, _prefetch=True, _pagination=KEYSET_PAGINATION))
+        self.assertListEqual(results, endpoint.records)
+        self.assertListEqual(endpoint.calls, [
+            (10, None, None, {'ordering': 'id'}),
+            (10, None, 9, {'ordering': 'id'}),
+            (10, None, 19, {'ordering': 'id'}),
+        ])
+
+    def test_keyset_ordering(self):
+        endpoint = FakeCursorPaginatedEndpoint(5)
+        results = retrieve_all_pages(endpoint, ordering='id', _pagination=KEYSET_PAGINATION)
+        self.assertListEqual(results, endpoint.records)
+        with self.assertRaises(ValueError):
+            retrieve_all_pages(endpoint, ordering='-id', _pagination=KEYSET_PAGINATION)
+        with self.assertRaises(ValueError):
+            iterate_all_pages(endpoint, ordering='id', _pagination=KEYSET_PAGINATION, _keyset_field='created')
+        self.assertEqual(len(endpoint.calls), 1)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            retrieve_all_pages(FakePaginatedEndpoint(1), _pagination='page-number')
@@ -1,14 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import datetime
+import gzip
+import hashlib
 from importlib import reload
 import json
+import time
 from unittest import mock
+from urllib.parse import parse_qs
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test.testcases import SimpleTestCase
+import httpx
 import responses
 
 from mtp_common.auth import api_client, urljoin
-from mtp_common.auth.exceptions import Unauthorized
+from mtp_common.auth.exceptions import HttpNotFoundError, HttpServerError, Unauthorized
+from mtp_common.test_utils import silence_logger
+from tests.benchmarks import benchmark_api_client
 from mtp_common.auth.test_utils import generate_tokens
 
 
@@ -296,3 +307,497 @@ class GetApiSessionTestCase(GetConnectionTestCase):
         self.assertRaises(
             Unauthorized, api_client.get_api_session, self.request
         )
+
+
+class SharedConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = mock.MagicMock(
+            user=mock.MagicMock(
+                token=generate_tokens()
+            )
+        )
+
+    def test_sessions_share_adapter_for_api(self):
+        adapter = api_client.get_shared_api_adapter()
+        sessions = [
+            api_client.get_api_session_with_session(self.request.user, self.request.session),
+            api_client.get_unauthenticated_session(),
+        ]
+        for session in sessions:
+            self.assertIs(session.get_adapter(urljoin(settings.API_URL, 'test')), adapter)
+            self.assertIsNot(session.get_adapter('https://example.com/'), adapter)
+            session.close()
+        self.assertIs(api_client.get_shared_api_adapter(), adapter)
+
+    def test_new_adapter_after_fork(self):
+        adapter = api_client.get_shared_api_adapter()
+        with mock.patch('mtp_common.auth.api_client.os.getpid', return_value=-1):
+            self.assertIsNot(api_client.get_shared_api_adapter(), adapter)
+
+    @responses.activate
+    def test_session_reused_within_request(self):
+        responses.add(
+            responses.GET,
+            urljoin(settings.API_URL, 'test'),
+            json={'success': True},
+        )
+        session = api_client.get_api_session(self.request)
+        self.assertIs(api_client.get_api_session(self.request), session)
+        self.assertDictEqual(session.get('test/').json(), {'success': True})
+
+        self.request.user = mock.MagicMock(token=generate_tokens())
+        self.assertIsNot(api_client.get_api_session(self.request), session)
+
+
+class GetConcurrentlyTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = mock.MagicMock(
+            user=mock.MagicMock(
+                token=generate_tokens(expires_at=time.time() - 60)
+            ),
+            session={},
+        )
+
+    @responses.activate
+    def test_expired_token_refreshed_once(self):
+        new_token = generate_tokens(expires_in=3600)
+        responses.add(
+            responses.POST,
+            api_client.get_request_token_url(),
+            json=new_token,
+        )
+        for number in range(4):
+            responses.add(
+                responses.GET,
+                urljoin(settings.API_URL, f'test/{number}'),
+                json={'number': number},
+            )
+        responses.add(
+            responses.GET,
+            urljoin(settings.API_URL, 'missing'),
+            status=404,
+        )
+
+        session = api_client.get_api_session(self.request)
+        results = api_client.get_concurrently(session, {
+            **{number: f'test/{number}/' for number in range(3)},
+            3: ('test/3/', {'page': 2}),
+            'missing': 'missing/',
+        }, max_workers=5)
+
+        self.assertDictEqual(
+            {key: value for key, value in results.items() if key != 'missing'},
+            {number: {'number': number} for number in range(4)},
+        )
+        self.assertIsInstance(results['missing'], HttpNotFoundError)
+        token_calls = [call for call in responses.calls if call.request.method == 'POST']
+        self.assertEqual(len(token_calls), 1)
+        self.assertEqual(self.request.user.token['access_token'], new_token['access_token'])
+        self.assertEqual(
+            self.request.session['_auth_user_auth_token']['access_token'], new_token['access_token'],
+        )
+        self.assertTrue(all(
+            call.request.headers['Authorization'] == f'Bearer {new_token["access_token"]}'
+            for call in responses.calls
+            if call.request.method == 'GET'
+        ))
+        self.assertIn('page=2', [call for call in responses.calls if '/test/3/' in call.request.url][0].request.url)
+
+    def test_no_paths(self):
+        self.assertDictEqual(api_client.get_concurrently(mock.MagicMock(), {}), {})
+
+    def test_requests_made_in_callers_context(self):
+        request_context = contextvars.ContextVar('request_context')
+        session = mock.MagicMock()
+        session.get.side_effect = lambda path, params: mock.MagicMock(json=lambda: request_context.get(None))
+        token = request_context.set('request-1')
+        try:
+            results = api_client.get_concurrently(session, {'credits': 'credits/', 'prisons': 'prisons/'})
+        finally:
+            request_context.reset(token)
+        self.assertDictEqual(results, {'credits': 'request-1', 'prisons': 'request-1'})
+
+
+class TokenRefreshTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.expiring_token = generate_tokens(expires_at=time.time() + 30)
+        self.new_token = generate_tokens(expires_in=3600)
+        self.request = mock.MagicMock(
+            user=mock.MagicMock(token=self.expiring_token),
+            session={},
+        )
+        self.token_key_prefix = 'api-token-refresh-%s' % hashlib.sha256(
+            self.expiring_token['refresh_token'].encode()
+        ).hexdigest()
+
+    def mock_test_endpoint(self, rsps):
+        rsps.add(
+            responses.GET,
+            urljoin(settings.API_URL, 'test'),
+            json={'success': True},
+        )
+
+    def assertUsedNewToken(self, rsps):  # noqa: N802
+        self.assertEqual(rsps.calls[-1].request.headers['Authorization'], f'Bearer {self.new_token["access_token"]}')
+        self.assertEqual(self.request.user.token['access_token'], self.new_token['access_token'])
+        self.assertEqual(
+            self.request.session['_auth_user_auth_token']['access_token'], self.new_token['access_token'],
+        )
+
+    def test_token_refreshed_before_expiry(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                api_client.get_request_token_url(),
+                json=self.new_token,
+            )
+            self.mock_test_endpoint(rsps)
+            api_client.get_api_session(self.request).get('test/')
+            self.assertUsedNewToken(rsps)
+        self.assertIsNone(cache.get(f'{self.token_key_prefix}-lock'))
+        # new token is handed off to other processes only in encrypted form
+        handed_off_token = cache.get(f'{self.token_key_prefix}-token')
+        self.assertNotIn(self.new_token['access_token'].encode(), handed_off_token)
+        self.assertNotIn(self.new_token['refresh_token'].encode(), handed_off_token)
+
+    def hand_off_token(self, refresh_token, token):
+        token_key_prefix = 'api-token-refresh-%s' % hashlib.sha256(refresh_token.encode()).hexdigest()
+        cipher = api_client.MoJOAuth2Session._token_cipher(refresh_token)
+        cache.set(f'{token_key_prefix}-token', cipher.encrypt(json.dumps(token).encode()))
+
+    def test_token_refreshed_by_another_process_reused(self):
+        self.hand_off_token(self.expiring_token['refresh_token'], dict(self.new_token, expires_at=time.time() + 3600))
+        with responses.RequestsMock() as rsps:
+            self.mock_test_endpoint(rsps)
+            api_client.get_api_session(self.request).get('test/')
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertUsedNewToken(rsps)
+
+    def test_token_handed_off_for_another_refresh_token_ignored(self):
+        cache.set(f'{self.token_key_prefix}-token', api_client.MoJOAuth2Session._token_cipher('other').encrypt(
+            json.dumps(self.new_token).encode()
+        ))
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                api_client.get_request_token_url(),
+                json=self.new_token,
+            )
+            self.mock_test_endpoint(rsps)
+            api_client.get_api_session(self.request).get('test/')
+            self.assertEqual(len(rsps.calls), 2)
+
+    def test_early_refresh_failure_ignored(self):
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(
+                responses.POST,
+                api_client.get_request_token_url(),
+                status=503,
+            )
+            self.mock_test_endpoint(rsps)
+            response = api_client.get_api_session(self.request).get('test/')
+            self.assertEqual(len(rsps.calls), 2)
+            self.assertEqual(
+                rsps.calls[-1].request.headers['Authorization'], f'Bearer {self.expiring_token["access_token"]}',
+            )
+        self.assertEqual(response.json(), {'success': True})
+        self.assertIsNone(cache.get(f'{self.token_key_prefix}-lock'))
+
+    def test_refresh_failure_raised_once_expired(self):
+        self.request.user.token = generate_tokens(expires_at=time.time() - 1)
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                api_client.get_request_token_url(),
+                status=503,
+            )
+            with self.assertRaises(HttpServerError):
+                api_client.get_api_session(self.request).get('test/')
+
+    def test_valid_token_used_while_another_process_refreshes_it(self):
+        cache.set(f'{self.token_key_prefix}-lock', 1)
+        with responses.RequestsMock() as rsps:
+            self.mock_test_endpoint(rsps)
+            api_client.get_api_session(self.request).get('test/')
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertEqual(
+                rsps.calls[0].request.headers['Authorization'], f'Bearer {self.expiring_token["access_token"]}',
+            )
+        self.assertNotIn('_auth_user_auth_token', self.request.session)
+
+    def test_waits_for_another_process_to_refresh_expired_token(self):
+        expired_token = generate_tokens(expires_at=time.time() - 1)
+        token_key_prefix = 'api-token-refresh-%s' % hashlib.sha256(
+            expired_token['refresh_token'].encode()
+        ).hexdigest()
+        self.request.user.token = expired_token
+        cache.set(f'{token_key_prefix}-lock', 1)
+
+        def refresh_in_another_process():
+            time.sleep(0.2)
+            self.hand_off_token(expired_token['refresh_token'], dict(self.new_token, expires_at=time.time() + 3600))
+            cache.delete(f'{token_key_prefix}-lock')
+
+        with responses.RequestsMock() as rsps, ThreadPoolExecutor(max_workers=1) as executor:
+            self.mock_test_endpoint(rsps)
+            executor.submit(refresh_in_another_process)
+            api_client.get_api_session(self.request).get('test/')
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertUsedNewToken(rsps)
+
+
+class AsyncApiSessionTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = mock.MagicMock(
+            user=mock.MagicMock(
+                token=generate_tokens()
+            ),
+            session={},
+        )
+        self.requests_made = []
+
+    def build_client(self, handler):
+        def record_request(request):
+            self.requests_made.append(request)
+            return handler(request)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(record_request))
+
+    def build_session(self, handler):
+        return api_client.get_async_api_session(self.request, client=self.build_client(handler))
+
+    def test_run_async_closes_pooled_client(self):
+        async def get_client():
+            return api_client.get_async_unauthenticated_session().client
+
+        client = api_client.run_async(get_client())
+        self.assertTrue(client.is_closed)
+        self.assertNotIn(client, api_client._async_clients.values())
+
+    async def test_request(self):
+        session = self.build_session(lambda request: httpx.Response(200, json={'success': True}))
+        response = await session.get('test/', params={'page': 1})
+
+        self.assertDictEqual(response.json(), {'success': True})
+        request = self.requests_made[0]
+        self.assertEqual(str(request.url), urljoin(settings.API_URL, 'test/') + '?page=1')
+        self.assertEqual(request.headers['Authorization'], f'Bearer {self.request.user.token["access_token"]}')
+        self.assertEqual(request.headers['Accept-Language'], settings.LANGUAGE_CODE)
+
+    async def test_error_responses_raise_exceptions(self):
+        session = self.build_session(lambda request: httpx.Response(404))
+        with self.assertRaises(HttpNotFoundError):
+            await session.get('test/')
+
+        session = self.build_session(lambda request: httpx.Response(401))
+        with self.assertRaises(Unauthorized):
+            await session.get('test/')
+
+    async def test_unauthenticated(self):
+        self.assertIsNone(api_client.get_async_unauthenticated_session().token)
+
+    async def test_expired_token_refreshed_once(self):
+        expired_token = generate_tokens(expires_at=time.time() - 60)
+        new_token = generate_tokens(expires_in=3600)
+        self.request.user.token = expired_token
+
+        def handler(request):
+            if request.url.path.rstrip('/').endswith('oauth2/token'):
+                body = parse_qs(request.content.decode())
+                self.assertEqual(body['grant_type'], ['refresh_token'])
+                self.assertEqual(body['refresh_token'], [expired_token['refresh_token']])
+                return httpx.Response(200, json=new_token)
+            return httpx.Response(200, json={'success': True})
+
+        session = self.build_session(handler)
+        await asyncio.gather(*(session.get(f'test/{number}/') for number in range(3)))
+
+        self.assertEqual(len(self.requests_made), 4)
+        for request in self.requests_made[1:]:
+            self.assertEqual(request.headers['Authorization'], f'Bearer {new_token["access_token"]}')
+        self.assertEqual(self.request.user.token['access_token'], new_token['access_token'])
+        self.assertGreater(self.request.user.token['expires_at'], time.time())
+        self.assertEqual(
+            self.request.session['_auth_user_auth_token']['access_token'], new_token['access_token'],
+        )
+
+
+class ApiClientTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = mock.MagicMock(
+            user=mock.MagicMock(
+                token=generate_tokens()
+            )
+        )
+
+    def test_endpoint_compiled_once(self):
+        endpoint = api_client.compile_endpoint('credits/{pk}/')
+        self.assertIs(api_client.compile_endpoint('credits/{pk}/'), endpoint)
+        self.assertSetEqual(endpoint.path_params, {'pk'})
+        self.assertEqual(endpoint.url({'pk': 'a/b'}), urljoin(settings.API_URL, 'credits', 'a%2Fb'))
+        self.assertEqual(api_client.compile_endpoint('prisons').url({}), urljoin(settings.API_URL, 'prisons'))
+
+    def test_endpoint_rejects_mismatched_path_params(self):
+        with self.assertRaisesRegex(TypeError, 'unexpected path params: status'):
+            api_client.compile_endpoint('credits/').url({'status': 'pending'})
+        with self.assertRaisesRegex(TypeError, 'missing path params: pk'):
+            api_client.compile_endpoint('credits/{pk}/').url({})
+
+        client = api_client.ApiClient(mock.MagicMock())
+        with self.assertRaises(TypeError):
+            client.get('credits/', status='pending')
+        with self.assertRaises(TypeError):
+            client.get('credits/{pk}/')
+        client.session.request.assert_not_called()
+
+    @responses.activate
+    def test_requests(self):
+        responses.add(
+            responses.GET,
+            urljoin(settings.API_URL, 'credits/1'),
+            json={'id': 1},
+        )
+        responses.add(
+            responses.POST,
+            urljoin(settings.API_URL, 'credits/actions/review'),
+            status=204,
+        )
+        responses.add(
+            responses.GET,
+            urljoin(settings.API_URL, 'credits/2'),
+            status=404,
+        )
+
+        client = api_client.get_api_client(self.request)
+        self.assertIs(client.session, api_client.get_api_session(self.request))
+        self.assertDictEqual(client.get('credits/{pk}/', pk=1, params={'a': 'b'}), {'id': 1})
+        self.assertIn('a=b', responses.calls[0].request.url)
+        self.assertEqual(
+            responses.calls[0].request.headers['Authorization'],
+            f'Bearer {self.request.user.token["access_token"]}',
+        )
+
+        self.assertIsNone(client.post('credits/actions/review/', data={'credit_ids': [1]}))
+        self.assertEqual(json.loads(responses.calls[1].request.body), {'credit_ids': [1]})
+        self.assertEqual(responses.calls[1].request.headers['Content-Type'], 'application/json')
+
+        with self.assertRaises(HttpNotFoundError):
+            client.get('credits/{pk}/', pk=2)
+
+    def test_benchmark(self):
+        durations = benchmark_api_client(calls=10, results=2)
+        self.assertGreater(durations['slumber'], 0)
+        self.assertGreater(durations['api_client'], 0)
+
+
+class ApiResponseCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = urljoin(settings.API_URL, 'prisons')
+
+    def make_request(self, pk=1):
+        return mock.MagicMock(user=mock.MagicMock(pk=pk, token=generate_tokens()))
+
+    @responses.activate
+    def test_fresh_response_reused_without_request(self):
+        responses.add(responses.GET, self.url, json={'results': ['BXI']}, headers={'Cache-Control': 'max-age=60'})
+        session = api_client.get_cached_api_session(self.make_request())
+        self.assertDictEqual(session.get('prisons/').json(), {'results': ['BXI']})
+        response = session.get('prisons/')
+        self.assertDictEqual(response.json(), {'results': ['BXI']})
+        self.assertTrue(response.from_cache)
+        self.assertEqual(len(responses.calls), 1)
+
+        session.get('prisons/', params={'region': 'London'})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_etag_revalidated(self):
+        responses.add(responses.GET, self.url, json={'results': ['BXI']}, headers={'ETag': '"v1"'})
+        responses.add(responses.GET, self.url, status=304, headers={'ETag': '"v1"'})
+        session = api_client.get_cached_api_session(self.make_request())
+        session.get('prisons/')
+        response = session.get('prisons/')
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(response.json(), {'results': ['BXI']})
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+
+    @responses.activate
+    def test_last_modified_revalidated(self):
+        last_modified = 'Wed, 01 Jan 2025 12:00:00 GMT'
+        responses.add(responses.GET, self.url, json={'results': []}, headers={'Last-Modified': last_modified})
+        responses.add(responses.GET, self.url, json={'results': ['BXI']}, headers={'Last-Modified': last_modified})
+        session = api_client.get_cached_api_session(self.make_request())
+        self.assertDictEqual(session.get('prisons/').json(), {'results': []})
+        self.assertDictEqual(session.get('prisons/').json(), {'results': ['BXI']})
+        self.assertEqual(responses.calls[1].request.headers['If-Modified-Since'], last_modified)
+
+    @responses.activate
+    def test_uncacheable_responses_not_stored(self):
+        responses.add(responses.GET, self.url, json={}, headers={'Cache-Control': 'no-store', 'ETag': '"v1"'})
+        session = api_client.get_cached_api_session(self.make_request())
+        session.get('prisons/')
+        session.get('prisons/')
+        self.assertEqual(len(responses.calls), 2)
+        self.assertNotIn('If-None-Match', responses.calls[1].request.headers)
+
+    @responses.activate
+    def test_varying_responses_not_stored(self):
+        responses.add(
+            responses.GET, self.url, json={}, headers={'Cache-Control': 'max-age=60', 'Vary': 'Accept, Cookie'},
+        )
+        session = api_client.get_cached_api_session(self.make_request())
+        session.get('prisons/')
+        session.get('prisons/')
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_responses_varying_by_language_stored(self):
+        responses.add(
+            responses.GET, self.url, json={},
+            headers={'Cache-Control': 'max-age=60', 'Vary': 'Accept-Language, Accept-Encoding'},
+        )
+        session = api_client.get_cached_api_session(self.make_request())
+        session.get('prisons/')
+        self.assertTrue(session.get('prisons/').from_cache)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_decoded_content_stored_without_encoding_headers(self):
+        content = json.dumps({'results': ['BXI']}).encode()
+        responses.add(
+            responses.GET, self.url, body=gzip.compress(content),
+            headers={'Cache-Control': 'max-age=60', 'Content-Encoding': 'gzip', 'Content-Type': 'application/json'},
+        )
+        session = api_client.get_cached_api_session(self.make_request())
+        self.assertDictEqual(session.get('prisons/').json(), {'results': ['BXI']})
+        response = session.get('prisons/')
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.content, content)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+
+    @responses.activate
+    def test_responses_partitioned_by_user(self):
+        responses.add(responses.GET, self.url, json={}, headers={'Cache-Control': 'max-age=60'})
+        api_client.get_cached_api_session(self.make_request(pk=1)).get('prisons/')
+        api_client.get_cached_api_session(self.make_request(pk=2)).get('prisons/')
+        self.assertEqual(len(responses.calls), 2)
+
+        # shared cache only stores public responses for authenticated users
+        api_client.get_cached_api_session(self.make_request(pk=1), shared=True).get('prisons/')
+        api_client.get_cached_api_session(self.make_request(pk=2), shared=True).get('prisons/')
+        self.assertEqual(len(responses.calls), 4)
+        responses.replace(responses.GET, self.url, json={}, headers={'Cache-Control': 'public, max-age=60'})
+        api_client.get_cached_api_session(self.make_request(pk=1), shared=True).get('prisons/')
+        api_client.get_cached_api_session(self.make_request(pk=2), shared=True).get('prisons/')
+        self.assertEqual(len(responses.calls), 5)
@@ -1,15 +1,30 @@
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
+import os
+import threading
+import time
+from unittest import mock
 
+from django.apps import apps
 from django.conf import settings
 from django.core import cache as django_cache
+from django.core.exceptions import ImproperlyConfigured
 from django.test import SimpleTestCase, override_settings
+import httpx
+from opencensus.trace import base_exporter, execution_context
+from opencensus.trace.samplers import AlwaysOnSampler
+from opencensus.trace.tracer import Tracer
 from requests.exceptions import ConnectionError, HTTPError
 import responses
 
 from mtp_common import nomis
 from mtp_common.auth import urljoin
 from mtp_common.test_utils import silence_logger
+from mtp_common.test_utils.nomis import PrisonApiStandIn, benchmark_connector
+from tests.benchmarks import benchmark_nomis
 
 
 def build_prison_api_v1_url(path):
@@ -170,6 +185,123 @@ class RequestRetryTestCase(SimpleTestCase):
             self.assertEqual(len(rsps.calls), 1)
 
 
+class BackoffTestCase(SimpleTestCase):
+    """
+    Tests related to waiting between retries in the request_retry function.
+    """
+
+    @mock.patch('mtp_common.nomis.time.sleep')
+    def test_exponential_backoff(self, mocked_sleep):
+        """
+        Test that retries wait for increasing times and that all attempts are timed.
+        """
+        url = 'https://example.com'
+        retry = nomis.Retry(3, backoff=nomis.ExponentialBackoff(base=1, cap=3, jitter=False))
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                url,
+                status=503,
+            )
+
+            response = nomis.request_retry('get', url, retries=retry)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(rsps.calls), 4)
+
+        self.assertEqual([call.args[0] for call in mocked_sleep.call_args_list], [1, 2, 3])
+        self.assertEqual(len(retry.attempt_durations), 4)
+
+    @mock.patch('mtp_common.nomis.time.sleep')
+    def test_decorrelated_jitter_backoff_is_bounded(self, mocked_sleep):
+        """
+        Test that the default backoff policy waits within its bounds.
+        """
+        url = 'https://example.com'
+        retry = nomis.Retry(5)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                url,
+                body=ConnectionError(),
+            )
+
+            with self.assertRaises(ConnectionError):
+                nomis.request_retry('get', url, retries=retry)
+
+        delays = [call.args[0] for call in mocked_sleep.call_args_list]
+        self.assertEqual(len(delays), 5)
+        self.assertTrue(all(retry.backoff.base <= delay <= retry.backoff.cap for delay in delays))
+
+    @mock.patch('mtp_common.nomis.time.sleep')
+    def test_retry_after_header_honoured(self, mocked_sleep):
+        """
+        Test that the wait requested in a Retry-After header is used instead of the backoff policy.
+        """
+        url = 'https://example.com'
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                url,
+                status=503,
+                headers={'Retry-After': '3'},
+            )
+            rsps.add(
+                responses.GET,
+                url,
+                status=200,
+            )
+
+            response = nomis.request_retry('get', url, retries=nomis.Retry(1, backoff=nomis.Backoff()))
+            self.assertEqual(response.status_code, 200)
+
+        mocked_sleep.assert_called_once_with(3)
+
+    @mock.patch('mtp_common.nomis.time.sleep')
+    def test_long_retry_after_header_stops_retrying(self, mocked_sleep):
+        """
+        Test that if a Retry-After header asks for a longer wait than allowed, the request is not retried.
+        """
+        url = 'https://example.com'
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                url,
+                status=503,
+                headers={'Retry-After': '120'},
+            )
+
+            response = nomis.request_retry('get', url, retries=1)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(rsps.calls), 1)
+
+        mocked_sleep.assert_not_called()
+
+    @mock.patch('mtp_common.nomis.time.sleep')
+    def test_deadline_stops_retrying(self, mocked_sleep):
+        """
+        Test that no retries are made if waiting would exceed the overall deadline.
+        """
+        url = 'https://example.com'
+        retry = nomis.Retry(5, backoff=nomis.ExponentialBackoff(base=1, jitter=False), deadline=0.5)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                url,
+                status=502,
+            )
+
+            response = nomis.request_retry('get', url, retries=retry)
+            self.assertEqual(response.status_code, 502)
+            self.assertEqual(len(rsps.calls), 1)
+
+        mocked_sleep.assert_not_called()
+
+
 class BaseTestCase(SimpleTestCase):
     """
     Base class for testing Prison API (i.e. NOMIS).
@@ -177,6 +309,8 @@ class BaseTestCase(SimpleTestCase):
 
     def setUp(self):
         django_cache.cache.clear()
+        nomis.connector.forget_token()
+        nomis.connector.circuit_breaker.reset()
 
     def _mock_successful_auth_request(self, rsps, token='my-token'):
         rsps.add(
@@ -339,6 +473,520 @@ class PrisonApiTestCase(BaseTestCase):
             'my-token',
         )
 
+    def test_401_response_keeps_token_replaced_by_another_process(self):
+        """
+        Test that if a request with a memoised token returns 401 but another process has already cached
+        a new token, the new token is kept and used to retry instead of fetching another one.
+        """
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'old-token')
+        self.assertEqual(nomis.connector.get_bearer_token(), 'old-token')
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'new-token')
+
+        path = '/some/path'
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url(path),
+                status=401,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url(path),
+                json={},
+                status=200,
+            )
+
+            with silence_logger('mtp'):
+                nomis.connector.get(path, retries=0)
+            self.assertEqual(rsps.calls[0].request.headers['Authorization'], 'Bearer old-token')
+            self.assertEqual(rsps.calls[1].request.headers['Authorization'], 'Bearer new-token')
+
+        self.assertEqual(
+            django_cache.cache.get(nomis.Connector.TOKEN_CACHE_KEY),
+            'new-token',
+        )
+
+
+class CircuitBreakerTestCase(BaseTestCase):
+    """
+    Tests related to the circuit breaker around Prison API calls.
+    """
+
+    def setUp(self):
+        super().setUp()
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        self.connector = nomis.Connector()
+        self.connector.circuit_breaker = nomis.CircuitBreaker('test', failure_rate=0.5, min_calls=2)
+        self.collector = nomis.CircuitBreakerMetricCollector(self.connector.circuit_breaker)
+
+    def get_state_metric(self):
+        state_metric = self.collector.collect()[0]
+        return state_metric.samples[0].value
+
+    def test_opens_after_failures(self):
+        """
+        Test that once enough calls fail, further calls fail immediately without calling the Prison API.
+        """
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                status=500,
+            )
+
+            for _ in range(2):
+                with self.assertRaises(HTTPError):
+                    self.connector.get('/some/path')
+            self.assertEqual(self.connector.circuit_breaker.state, nomis.CircuitBreaker.OPEN)
+            self.assertEqual(self.get_state_metric(), 2)
+
+            with self.assertRaises(nomis.CircuitOpenError):
+                self.connector.get('/some/path')
+            self.assertEqual(len(rsps.calls), 2)
+        self.assertEqual(self.connector.circuit_breaker.rejected_calls, 1)
+
+    def test_stays_closed_if_calls_succeed(self):
+        """
+        Test that the circuit stays closed if the failure rate is below the threshold.
+        """
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/failing/path'),
+                status=503,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                json={},
+                status=200,
+            )
+
+            for _ in range(3):
+                self.connector.get('/some/path')
+            with self.assertRaises(HTTPError):
+                self.connector.get('/failing/path')
+
+        self.assertEqual(self.connector.circuit_breaker.state, nomis.CircuitBreaker.CLOSED)
+        self.assertEqual(self.get_state_metric(), 0)
+
+    def test_successful_probe_closes_circuit(self):
+        """
+        Test that once the open timeout passes, a successful probe closes the circuit.
+        """
+        circuit_breaker = self.connector.circuit_breaker
+        django_cache.cache.set(circuit_breaker.open_key, time.time() - 1)
+        self.assertEqual(circuit_breaker.state, nomis.CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.get_state_metric(), 1)
+
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                json={},
+                status=200,
+            )
+
+            self.connector.get('/some/path')
+
+        self.assertEqual(circuit_breaker.state, nomis.CircuitBreaker.CLOSED)
+
+    def test_only_one_probe_allowed(self):
+        """
+        Test that while a probe is in progress, other calls are rejected.
+        """
+        circuit_breaker = self.connector.circuit_breaker
+        django_cache.cache.set(circuit_breaker.open_key, time.time() - 1)
+
+        self.assertTrue(circuit_breaker.before_call())
+        with self.assertRaises(nomis.CircuitOpenError):
+            circuit_breaker.before_call()
+
+    def test_failed_probe_opens_circuit(self):
+        """
+        Test that a failed probe opens the circuit again.
+        """
+        circuit_breaker = self.connector.circuit_breaker
+        django_cache.cache.set(circuit_breaker.open_key, time.time() - 1)
+
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                body=ConnectionError(),
+            )
+
+            with self.assertRaises(ConnectionError):
+                self.connector.get('/some/path')
+
+        self.assertEqual(circuit_breaker.state, nomis.CircuitBreaker.OPEN)
+
+    def test_successful_calls_counted_in_batches(self):
+        """
+        Test that successful calls in a closed circuit rarely use the cache
+        and that they are added to the shared counts along with the next failure.
+        """
+        circuit_breaker = nomis.CircuitBreaker('test', failure_rate=0.5, min_calls=2, window=3600)
+        cache = django_cache.cache
+        with mock.patch.object(cache, 'get', wraps=cache.get) as mocked_get, \
+                mock.patch.object(cache, 'incr', wraps=cache.incr) as mocked_incr:
+            for _ in range(10):
+                probe = circuit_breaker.before_call()
+                circuit_breaker.record(success=True, probe=probe)
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(mocked_incr.call_count, 1)
+
+        with silence_logger('mtp'):
+            circuit_breaker.record(success=False)
+        calls_key, failures_key = circuit_breaker.window_keys()
+        self.assertEqual(cache.get(calls_key), 11)
+        self.assertEqual(cache.get(failures_key), 1)
+        self.assertEqual(circuit_breaker.state, nomis.CircuitBreaker.CLOSED)
+
+    async def test_async_opens_after_failures(self):
+        """
+        Test that the circuit breaker opens after failures recorded by asyncio callers.
+        """
+        circuit_breaker = nomis.CircuitBreaker('test', failure_rate=0.5, min_calls=2)
+        with silence_logger('mtp'):
+            for _ in range(2):
+                probe = await circuit_breaker.abefore_call()
+                await circuit_breaker.arecord(success=False, probe=probe)
+        with self.assertRaises(nomis.CircuitOpenError):
+            await circuit_breaker.abefore_call()
+
+
+class RateLimiterTestCase(BaseTestCase):
+    """
+    Tests related to pacing Prison API calls on the client side.
+    """
+
+    def setUp(self):
+        super().setUp()
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        self.connector = nomis.Connector()
+        self.connector.rate_limiter = nomis.RateLimiter('test', rate=3, endpoint_rates={'/limited/path': 1})
+
+    def get_wait_count(self, endpoint):
+        registry = apps.get_app_config('metrics').metric_registry
+        return registry.get_sample_value(
+            'mtp_nomis_rate_limit_wait_count', {'endpoint': endpoint, 'pid': str(os.getpid())},
+        ) or 0
+
+    def test_unlimited_by_default(self):
+        rate_limiter = nomis.RateLimiter('unlimited')
+        self.assertEqual(rate_limiter.budgets('/some/path', 1), [])
+        with mock.patch('mtp_common.nomis.cache') as mocked_cache:
+            self.assertEqual(rate_limiter.acquire('/some/path'), 0)
+            self.assertEqual(asyncio.run(rate_limiter.aacquire('/some/path')), 0)
+            rate_limiter.record(429)
+        self.assertEqual(mocked_cache.method_calls, [])
+
+    def test_budgets(self):
+        rate_limiter = self.connector.rate_limiter
+        self.assertEqual(rate_limiter.budgets('/some/path', 1), [('all', 3, 1)])
+        self.assertEqual(rate_limiter.budgets('/limited/path', 1), [('all', 3, 1), ('/limited/path', 1, 1)])
+        self.assertEqual(rate_limiter.budgets('/limited/path', 0.5), [('all', 1, 1), ('/limited/path', 1, 2)])
+
+    def test_budgets_below_one_call_per_second(self):
+        rate_limiter = nomis.RateLimiter('slow', rate=0.25)
+        self.assertEqual(rate_limiter.budgets('/some/path', 1), [('all', 1, 4)])
+        self.assertEqual(rate_limiter.budgets('/some/path', 0.5), [('all', 1, 8)])
+
+    def test_slots_taken_in_all_budgets_together(self):
+        """
+        Test that a call waiting for an endpoint's budget does not use up the global budget meanwhile.
+        """
+        rate_limiter = nomis.RateLimiter('test', rate=2, endpoint_rates={'/limited/path': 1})
+        budgets = rate_limiter.budgets('/limited/path', 1)
+        # start at the beginning of a window so that all attempts fall into the same one
+        time.sleep(1 - time.time() % 1)
+        self.assertIsNone(rate_limiter._take_slots(budgets))
+        self.assertGreater(rate_limiter._take_slots(budgets), 0.5)
+        self.assertEqual(django_cache.cache.get(rate_limiter.window_key('all', 1, time.time())), 1)
+        self.assertIsNone(rate_limiter._take_slots(rate_limiter.budgets('/some/path', 1)))
+
+    def test_waits_when_over_budget(self):
+        """
+        Test that calls over an endpoint's budget wait for the next one-second window.
+        """
+        rate_limiter = self.connector.rate_limiter
+        # start at the beginning of a window so that both calls cannot fall into one by chance
+        time.sleep(1 - time.time() % 1)
+        self.assertLess(rate_limiter.acquire('/limited/path'), 0.1)
+        self.assertGreater(rate_limiter.acquire('/limited/path'), 0.5)
+
+    def test_gives_up_waiting(self):
+        """
+        Test that calls which would wait for longer than allowed raise an error without calling the api
+        or counting as a failure of it.
+        """
+        rate_limiter = nomis.RateLimiter('test', endpoint_rates={'/limited/path': 1}, max_wait=0.5)
+        # start at the beginning of a window so that all calls fall into the same one
+        time.sleep(1 - time.time() % 1)
+        self.assertLess(rate_limiter.acquire('/limited/path'), 0.1)
+        started_at = time.monotonic()
+        with self.assertRaises(nomis.RateLimitWaitError):
+            rate_limiter.acquire('/limited/path')
+        with self.assertRaises(nomis.RateLimitWaitError):
+            asyncio.run(rate_limiter.aacquire('/limited/path'))
+        self.assertLess(time.monotonic() - started_at, 0.5)
+
+        self.connector.rate_limiter = rate_limiter
+        with responses.RequestsMock(), silence_logger('mtp'):
+            with self.assertRaises(nomis.RateLimitWaitError):
+                self.connector.get('/limited/path', endpoint='/limited/path')
+        self.assertIsNone(django_cache.cache.get(self.connector.circuit_breaker.window_keys()[1]))
+
+    def test_waits_no_longer_than_retry_deadline(self):
+        rate_limiter = self.connector.rate_limiter
+        time.sleep(1 - time.time() % 1)
+        rate_limiter.acquire('/limited/path')
+        with responses.RequestsMock(), silence_logger('mtp'):
+            with self.assertRaises(nomis.RateLimitWaitError):
+                self.connector.get(
+                    '/limited/path', endpoint='/limited/path', retries=nomis.Retry(0, deadline=0.01),
+                )
+
+    def test_slows_down_when_throttled(self):
+        """
+        Test that throttled responses halve budgets for all subsequent calls and that every attempt is paced.
+        """
+        wait_count = self.get_wait_count('/some/path')
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                status=503,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                json={},
+                status=200,
+            )
+            self.connector.get('/some/path', retries=nomis.Retry(1, backoff=nomis.Backoff()))
+
+        self.assertEqual(django_cache.cache.get(self.connector.rate_limiter.slowdown_key), 0.5)
+        self.assertEqual(self.get_wait_count('/some/path'), wait_count + 2)
+
+        with silence_logger('mtp'):
+            self.connector.rate_limiter.record(429)
+        self.assertEqual(django_cache.cache.get(self.connector.rate_limiter.slowdown_key), 0.25)
+        self.connector.rate_limiter.record(200)
+        self.assertEqual(django_cache.cache.get(self.connector.rate_limiter.slowdown_key), 0.25)
+
+
+class CapturingExporter(base_exporter.Exporter):
+    """
+    Collects exported opencensus spans
+    """
+
+    def __init__(self):
+        self.span_datas = []
+
+    def emit(self, span_datas):
+        self.span_datas.extend(span_datas)
+
+    def export(self, span_datas):
+        self.emit(span_datas)
+
+
+class InstrumentationTestCase(BaseTestCase):
+    """
+    Tests related to metrics collected about Prison API calls.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = CapturingExporter()
+        self.addCleanup(execution_context.clean)
+
+    def build_tracer(self):
+        return Tracer(sampler=AlwaysOnSampler(), exporter=self.exporter)
+
+    def get_prison_api_spans(self):
+        return [span for span in self.exporter.span_datas if span.name.startswith('Prison API')]
+
+    def get_sample_value(self, name, labels):
+        registry = apps.get_app_config('metrics').metric_registry
+        return registry.get_sample_value(name, dict(labels, pid=str(os.getpid()))) or 0
+
+    def test_endpoint_templated(self):
+        self.assertEqual(
+            nomis.template_endpoint('/prison/BMI/offenders/A1471AE/accounts/spends/transactions'),
+            '/prison/BMI/offenders/{prisoner_number}/accounts/spends/transactions',
+        )
+        self.assertEqual(nomis.template_endpoint('/some/path/123'), '/some/path/{id}')
+
+    def test_request_metrics(self):
+        """
+        Test that request durations are recorded by endpoint path template, status and retries.
+        """
+        labels = {
+            'endpoint': nomis.ACCOUNT_BALANCES_PATH,
+            'method': 'GET',
+            'status': '200',
+            'retries': '1',
+        }
+        count = self.get_sample_value('mtp_nomis_request_duration_count', labels)
+        token_refreshes = self.get_sample_value('mtp_nomis_token_refreshes_total', {})
+
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'),
+                status=502,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'),
+                json={'cash': 500, 'savings': 0, 'spends': 25},
+                status=200,
+            )
+
+            nomis.get_account_balances('BMI', 'A1471AE', retries=nomis.Retry(1, backoff=nomis.Backoff()))
+
+        self.assertEqual(self.get_sample_value('mtp_nomis_request_duration_count', labels), count + 1)
+        self.assertEqual(self.get_sample_value('mtp_nomis_token_refreshes_total', {}), token_refreshes + 1)
+
+    def test_spans_in_worker_threads(self):
+        """
+        Test that spans of calls made concurrently on a thread pool are children of the caller's span.
+        """
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        prisoner_numbers = ['A1471AE', 'A1472AE', 'A1473AE']
+        with responses.RequestsMock() as rsps:
+            for prisoner_number in prisoner_numbers:
+                rsps.add(
+                    responses.GET,
+                    build_prison_api_v1_url(f'/prison/BMI/offenders/{prisoner_number}/accounts'),
+                    json={'cash': 500, 'savings': 0, 'spends': 25},
+                )
+
+            with self.build_tracer().span('request') as request_span:
+                nomis.get_account_balances_many([('BMI', prisoner_number) for prisoner_number in prisoner_numbers])
+
+        spans = self.get_prison_api_spans()
+        self.assertEqual(len(spans), 3)
+        self.assertTrue(all(span.parent_span_id == request_span.span_id for span in spans))
+
+    async def test_spans_of_concurrent_tasks(self):
+        """
+        Test that spans of calls awaited concurrently are children of the caller's span
+        and do not replace it as the current span.
+        """
+        await django_cache.cache.aset(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json={'cash': 500, 'savings': 0, 'spends': 25})
+        ))
+
+        with self.build_tracer().span('request') as request_span:
+            await asyncio.gather(
+                nomis.aget_account_balances('BMI', 'A1471AE', client=client),
+                nomis.aget_account_balances('BMI', 'A1472AE', client=client),
+            )
+            self.assertIs(execution_context.get_current_span(), request_span)
+
+        spans = self.get_prison_api_spans()
+        self.assertEqual(len(spans), 2)
+        self.assertTrue(all(span.parent_span_id == request_span.span_id for span in spans))
+
+
+class TokenTestCase(BaseTestCase):
+    """
+    Tests related to fetching and reusing HMPPS Auth tokens.
+    """
+
+    def test_token_memoised_in_process(self):
+        """
+        Test that once a token is loaded from the cache, it is not loaded again from the cache on subsequent calls.
+        """
+        connector = nomis.Connector()
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+
+        with mock.patch.object(django_cache.cache, 'get_many', wraps=django_cache.cache.get_many) as mocked_get_many:
+            self.assertEqual(connector.get_bearer_token(), 'some-token')
+            self.assertEqual(connector.get_bearer_token(), 'some-token')
+        self.assertEqual(mocked_get_many.call_count, 1)
+
+    def test_waits_for_token_being_fetched_by_another_process(self):
+        """
+        Test that if another process holds the lock, the token it fetches is used instead of fetching a new one.
+        """
+        connector = nomis.Connector()
+        django_cache.cache.set(nomis.Connector.TOKEN_LOCK_CACHE_KEY, 1)
+
+        def another_process():
+            django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'other-token')
+            django_cache.cache.delete(nomis.Connector.TOKEN_LOCK_CACHE_KEY)
+
+        timer = threading.Timer(0.2, another_process)
+        with responses.RequestsMock():
+            timer.start()
+            self.assertEqual(connector.get_bearer_token(), 'other-token')
+        timer.join()
+
+    def test_token_renewed_before_expiry(self):
+        """
+        Test that a token that is about to expire is still used while a new one is fetched in the background.
+        """
+        connector = nomis.Connector()
+        django_cache.cache.set_many({
+            nomis.Connector.TOKEN_CACHE_KEY: 'old-token',
+            nomis.Connector.TOKEN_EXPIRY_CACHE_KEY: time.time() + 60,
+        })
+
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps, token='new-token')
+            self.assertEqual(connector.get_bearer_token(), 'old-token')
+            connector._token_renewal_thread.join()
+
+        self.assertEqual(django_cache.cache.get(nomis.Connector.TOKEN_CACHE_KEY), 'new-token')
+        self.assertEqual(connector.get_bearer_token(), 'new-token')
+
+
+class ConnectionPoolTestCase(BaseTestCase):
+    """
+    Tests related to the pooled session owned by the connector.
+    """
+
+    @override_settings(HMPPS_API_POOL_MAXSIZE=4)
+    def test_session_reused_between_calls(self):
+        """
+        Test that the connector makes all calls through one pooled session configured from settings.
+        """
+        connector = nomis.Connector()
+        session = connector.session
+        self.assertIs(connector.session, session)
+        self.assertEqual(session.get_adapter(settings.HMPPS_PRISON_API_BASE_URL)._pool_maxsize, 4)
+
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/some/path'),
+                json={},
+                status=200,
+            )
+
+            with mock.patch.object(session, 'get', wraps=session.get) as mocked_get, \
+                    mock.patch.object(session, 'post', wraps=session.post) as mocked_post:
+                connector.get('/some/path')
+            self.assertEqual(mocked_get.call_count, 1)
+            self.assertEqual(mocked_post.call_count, 1)
+
+    def test_new_session_after_fork(self):
+        """
+        Test that a process forked from one that already had a pooled session does not reuse it.
+        """
+        connector = nomis.Connector()
+        session = connector.session
+        with mock.patch('mtp_common.nomis.os.getpid', return_value=-1):
+            self.assertIsNot(connector.session, session)
+            self.assertEqual(connector.pool_stats(), {})
+
 
 class GetAccountBalancesTestCase(BaseTestCase):
     """
@@ -367,6 +1015,136 @@ class GetAccountBalancesTestCase(BaseTestCase):
 
         self.assertEqual(balances, actual_balances)
 
+    def test_many(self):
+        """
+        Test that balances for many prisoners are loaded with one token and errors are returned per prisoner.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'),
+                json={'cash': 500, 'savings': 0, 'spends': 25},
+                status=200,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BXI/offenders/A1409AE/accounts'),
+                json={'cash': 0, 'savings': 100, 'spends': 0},
+                status=200,
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BXI/offenders/A1410AE/accounts'),
+                status=404,
+            )
+
+            balances = nomis.get_account_balances_many([
+                ('BMI', 'A1471AE'),
+                ('BXI', 'A1409AE'),
+                ('BXI', 'A1410AE'),
+            ], max_workers=2)
+            auth_calls = [call for call in rsps.calls if call.request.method == responses.POST]
+            self.assertEqual(len(auth_calls), 1)
+
+        self.assertEqual(balances[('BMI', 'A1471AE')], {'cash': 500, 'savings': 0, 'spends': 25})
+        self.assertEqual(balances[('BXI', 'A1409AE')], {'cash': 0, 'savings': 100, 'spends': 0})
+        self.assertIsInstance(balances[('BXI', 'A1410AE')], HTTPError)
+
+    def test_identical_concurrent_requests_coalesced(self):
+        """
+        Test that threads requesting the same balances at the same time share one Prison API call.
+        """
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        saved_calls = nomis.connector.coalescer.saved_calls
+        thread_count = 4
+        barrier = threading.Barrier(thread_count)
+
+        def slow_response(_):
+            time.sleep(0.3)
+            return 200, {}, json.dumps({'cash': 500, 'savings': 0, 'spends': 25})
+
+        def get_balances():
+            barrier.wait()
+            return nomis.get_account_balances('BMI', 'A1471AE')
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(
+                responses.GET,
+                build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'),
+                callback=slow_response,
+            )
+
+            with ThreadPoolExecutor(max_workers=thread_count) as executor:
+                futures = [executor.submit(get_balances) for _ in range(thread_count)]
+                results = [future.result() for future in futures]
+            self.assertEqual(len(rsps.calls), 1)
+
+        self.assertTrue(all(result == {'cash': 500, 'savings': 0, 'spends': 25} for result in results))
+        self.assertEqual(len({id(result) for result in results}), thread_count)
+        self.assertEqual(nomis.connector.coalescer.saved_calls, saved_calls + thread_count - 1)
+
+    def call_concurrently_and_slowly(self, rsps, status, thread_count, kwargs_for_thread):
+        """
+        Requests balances on several threads at the same time, each with keyword arguments from `kwargs_for_thread`
+        :return: list of results or exceptions raised
+        """
+        barrier = threading.Barrier(thread_count)
+
+        def slow_response(_):
+            time.sleep(0.3)
+            return status, {}, json.dumps({'cash': 500, 'savings': 0, 'spends': 25})
+
+        def get_balances(thread_number):
+            barrier.wait()
+            try:
+                return nomis.connector.get(
+                    '/prison/BMI/offenders/A1471AE/accounts',
+                    coalesce=True,
+                    **kwargs_for_thread(thread_number),
+                )
+            except HTTPError as e:
+                return e
+
+        rsps.add_callback(
+            responses.GET,
+            build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'),
+            callback=slow_response,
+        )
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            return list(executor.map(get_balances, range(thread_count)))
+
+    def test_requests_with_different_options_not_coalesced(self):
+        """
+        Test that threads requesting the same path with different retries or timeouts do not share calls.
+        """
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        with responses.RequestsMock() as rsps:
+            self.call_concurrently_and_slowly(
+                rsps, 200, 3,
+                kwargs_for_thread=lambda thread_number: [
+                    {'retries': 0}, {'retries': 2}, {'retries': 2, 'timeout': 5},
+                ][thread_number],
+            )
+            self.assertEqual(len(rsps.calls), 3)
+
+    def test_coalesced_errors_copied(self):
+        """
+        Test that threads sharing a failed call each raise their own copy of the exception.
+        """
+        django_cache.cache.set(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        thread_count = 3
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            errors = self.call_concurrently_and_slowly(
+                rsps, 400, thread_count,
+                kwargs_for_thread=lambda _: {},
+            )
+            self.assertEqual(len(rsps.calls), 1)
+
+        self.assertTrue(all(isinstance(error, HTTPError) for error in errors))
+        self.assertTrue(all(error.response.status_code == 400 for error in errors))
+        self.assertEqual(len({id(error) for error in errors}), thread_count)
+
 
 class GetTransactionHistoryTestCase(BaseTestCase):
     """
@@ -449,6 +1227,48 @@ class GetTransactionHistoryTestCase(BaseTestCase):
 
         self.assertEqual(transactions, self.TRANSACTIONS_RESPONSE)
 
+    def test_iterate_in_date_chunks(self):
+        """
+        Test that transactions are yielded in order from date ranges loaded separately.
+        """
+        url = build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts/spends/transactions')
+        chunks = [
+            ('2019-10-01', '2019-10-30', ['a', 'b']),
+            ('2019-10-31', '2019-11-29', []),
+            ('2019-11-30', '2019-12-04', ['c']),
+        ]
+
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            for from_date, to_date, transaction_ids in chunks:
+                rsps.add(
+                    responses.GET,
+                    f'{url}?from_date={from_date}&to_date={to_date}',
+                    match_querystring=True,
+                    json={'transactions': [
+                        dict(self.TRANSACTIONS_RESPONSE['transactions'][0], id=transaction_id)
+                        for transaction_id in transaction_ids
+                    ]},
+                    status=200,
+                )
+
+            transactions = nomis.iterate_transaction_history(
+                'BMI', 'A1471AE', 'spends',
+                datetime.date(2019, 10, 1), '2019-12-04',
+                chunk_days=30, max_workers=2,
+            )
+            self.assertEqual([transaction['id'] for transaction in transactions], ['a', 'b', 'c'])
+
+    def test_iterate_validates_arguments(self):
+        """
+        Test that invalid chunks or a missing start date are rejected before iterating.
+        """
+        for chunk_days in (-1, 0.5):
+            with self.assertRaises(ValueError):
+                nomis.iterate_transaction_history('BMI', 'A1471AE', 'spends', '2019-10-01', chunk_days=chunk_days)
+        with self.assertRaises(ValueError):
+            nomis.iterate_transaction_history('BMI', 'A1471AE', 'spends', None)
+
 
 class CreateTransactionTestCase(BaseTestCase):
     """
@@ -486,6 +1306,70 @@ class CreateTransactionTestCase(BaseTestCase):
                 },
             )
 
+    def test_many(self):
+        """
+        Test that many transactions can be posted at once and that duplicates are considered successful.
+        """
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.POST,
+                build_prison_api_v1_url('/prison/BWI/offenders/A1471AE/transactions'),
+                json={'id': '6179604-1'},
+                status=200,
+            )
+            rsps.add(
+                responses.POST,
+                build_prison_api_v1_url('/prison/BWI/offenders/A1472AE/transactions'),
+                json={'message': 'Duplicate post'},
+                status=409,
+            )
+            rsps.add(
+                responses.POST,
+                build_prison_api_v1_url('/prison/BWI/offenders/A1473AE/transactions'),
+                status=503,
+            )
+            rsps.add(
+                responses.POST,
+                build_prison_api_v1_url('/prison/BWI/offenders/A1473AE/transactions'),
+                json={'id': '6179604-3'},
+                status=200,
+            )
+            rsps.add(
+                responses.POST,
+                build_prison_api_v1_url('/prison/BWI/offenders/A1474AE/transactions'),
+                status=400,
+            )
+
+            report = nomis.create_transactions([
+                {
+                    'prison_id': 'BWI', 'prisoner_number': prisoner_number, 'amount': 1634,
+                    'record_id': record_id, 'description': 'Sent by Mrs. Halls', 'transaction_type': 'MTDS',
+                }
+                for prisoner_number, record_id in [
+                    ('A1471AE', 1), ('A1472AE', 2), ('A1473AE', 3), ('A1474AE', 4),
+                ]
+            ], retries=1)
+
+        self.assertEqual(sorted(report.succeeded), ['1', '2', '3'])
+        self.assertEqual(report.failed, ['4'])
+        self.assertEqual(report.outcomes['1'], {'status': 'created', 'response': {'id': '6179604-1'}})
+        self.assertEqual(report.outcomes['2'], {'status': 'duplicate'})
+        self.assertEqual(report.outcomes['3'], {'status': 'created', 'response': {'id': '6179604-3'}})
+        self.assertEqual(report.outcomes['4']['error'].response.status_code, 400)
+        self.assertGreater(report.throughput, 0)
+
+    def test_create_transactions_rejects_repeated_record_ids(self):
+        """
+        Test that no transactions are posted if record ids are repeated as only one outcome could be reported.
+        """
+        transaction = {
+            'prison_id': 'BWI', 'prisoner_number': 'A1471AE', 'amount': 1634,
+            'record_id': 1, 'description': 'Sent by Mrs. Halls', 'transaction_type': 'MTDS',
+        }
+        with responses.RequestsMock(), self.assertRaises(ValueError):
+            nomis.create_transactions([transaction, {**transaction, 'record_id': '1'}])
+
 
 class GetPhotographDataTestCase(BaseTestCase):
     """
@@ -529,6 +1413,122 @@ class GetPhotographDataTestCase(BaseTestCase):
         self.assertEqual(photo_data, None)
 
 
+class PhotographCacheTestCase(BaseTestCase):
+    """
+    Tests related to caching decoded photographs.
+    """
+    image = b'\xff\xd8\xff' + b'0' * 1000
+
+    def setUp(self):
+        super().setUp()
+        nomis.photograph_cache.clear()
+
+    def _mock_photograph_request(self, rsps, prisoner_number='A1471AE', etag=None, status=200):
+        rsps.add(
+            responses.GET,
+            build_prison_api_v1_url(f'/offenders/{prisoner_number}/image'),
+            json={'image': base64.b64encode(self.image).decode()} if status == 200 else None,
+            headers={'ETag': etag} if etag else None,
+            status=status,
+        )
+
+    def test_photograph_decoded_and_cached(self):
+        """
+        Test that photographs are decoded and only loaded once.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            self._mock_photograph_request(rsps)
+
+            self.assertEqual(nomis.get_photograph_bytes('A1471AE'), self.image)
+            self.assertEqual(nomis.get_photograph_bytes('A1471AE'), self.image)
+            self.assertEqual(len(rsps.calls), 2)
+        self.assertEqual(nomis.photograph_cache.size, len(self.image))
+
+    def test_photograph_revalidated_using_etag(self):
+        """
+        Test that old photographs are revalidated using the ETag provided by Prison API.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            self._mock_photograph_request(rsps, etag='"123"')
+            nomis.get_photograph_bytes('A1471AE')
+
+            nomis.photograph_cache._entries['A1471AE']['loaded_at'] -= 2 * nomis.photograph_cache.refresh_after
+            rsps.replace(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1471AE/image'),
+                status=304,
+            )
+            self.assertEqual(nomis.get_photograph_bytes('A1471AE'), self.image)
+            self.assertEqual(rsps.calls[-1].request.headers['If-None-Match'], '"123"')
+
+            # the ETag is kept even though the 304 response did not repeat it
+            nomis.photograph_cache._entries['A1471AE']['loaded_at'] -= 2 * nomis.photograph_cache.refresh_after
+            self.assertEqual(nomis.get_photograph_bytes('A1471AE'), self.image)
+            self.assertEqual(rsps.calls[-1].request.headers['If-None-Match'], '"123"')
+
+    def test_least_recently_used_photograph_evicted(self):
+        """
+        Test that the cache does not grow beyond its maximum size.
+        """
+        photograph_cache = nomis.PhotographCache(max_bytes=len(self.image) * 2)
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            for prisoner_number in ('A1471AE', 'A1472AE', 'A1473AE'):
+                self._mock_photograph_request(rsps, prisoner_number=prisoner_number)
+
+            photograph_cache.get('A1471AE')
+            photograph_cache.get('A1472AE')
+            photograph_cache.get('A1471AE')
+            photograph_cache.get('A1473AE')
+
+        self.assertEqual(list(photograph_cache._entries), ['A1471AE', 'A1473AE'])
+        self.assertEqual(photograph_cache.size, len(self.image) * 2)
+
+    def test_photograph_response(self):
+        """
+        Test that photographs can be streamed in HTTP responses.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            self._mock_photograph_request(rsps)
+
+            response = nomis.photograph_response('A1471AE', chunk_size=100, cache_control='private, max-age=60')
+
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=60')
+        self.assertEqual(b''.join(response.streaming_content), self.image)
+
+    def test_missing_photograph_response(self):
+        """
+        Test that a 404 HTTP response is returned if there is no photograph.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1471AE/image'),
+                json={},
+            )
+
+            response = nomis.photograph_response('A1471AE')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_prisoner_photograph_response(self):
+        """
+        Test that a 404 HTTP response is returned if Prison API does not know the prisoner.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            self._mock_photograph_request(rsps, status=404)
+
+            response = nomis.photograph_response('A1471AE')
+
+        self.assertEqual(response.status_code, 404)
+
+
 class GetLocationTestCase(BaseTestCase):
     """
     Tests related to the get_location function.
@@ -662,3 +1662,205 @@ class GetLocationTestCase(BaseTestCase):
             actual_location_dict = nomis.get_location('A1401AE')
 
         self.assertEqual(actual_location_dict, None)
+
+    def test_cached_location(self):
+        """
+        Test that locations are only loaded once when using the cache until invalidated.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1401AE/location'),
+                json={'establishment': {'code': 'BXI', 'desc': 'BRIXTON (HMP)'}},
+            )
+
+            for _ in range(2):
+                location = nomis.get_location('A1401AE', use_cache=True)
+                self.assertEqual(location, {'nomis_id': 'BXI', 'name': 'BRIXTON (HMP)'})
+            self.assertEqual(len(rsps.calls), 2)
+
+            nomis.invalidate_location('A1401AE')
+            nomis.get_location('A1401AE', use_cache=True)
+            self.assertEqual(len(rsps.calls), 3)
+
+    def test_not_found_location_cached(self):
+        """
+        Test that 404 responses are remembered when using the cache.
+        """
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1401AE/location'),
+                status=404,
+            )
+
+            for _ in range(2):
+                with self.assertRaises(HTTPError) as e:
+                    nomis.get_location('A1401AE', use_cache=True)
+                self.assertEqual(e.exception.response.status_code, 404)
+            self.assertEqual(len(rsps.calls), 2)
+
+    def test_prefetch_locations(self):
+        """
+        Test that locations for many prisoners can be loaded into the cache at once.
+        """
+        nomis.invalidate_location('A1401AE')
+        django_cache.cache.set(
+            nomis.location_cache_key('A1402AE'),
+            {'location': {'nomis_id': 'LEI', 'name': 'LEEDS (HMP)'}},
+        )
+        with responses.RequestsMock() as rsps:
+            self._mock_successful_auth_request(rsps)
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1401AE/location'),
+                json={'establishment': {'code': 'BXI', 'desc': 'BRIXTON (HMP)'}},
+            )
+            rsps.add(
+                responses.GET,
+                build_prison_api_v1_url('/offenders/A1403AE/location'),
+                status=404,
+            )
+
+            locations = nomis.prefetch_locations(['A1401AE', 'A1402AE', 'A1403AE'])
+
+            self.assertEqual(locations['A1401AE'], {'nomis_id': 'BXI', 'name': 'BRIXTON (HMP)'})
+            self.assertEqual(locations['A1402AE'], {'nomis_id': 'LEI', 'name': 'LEEDS (HMP)'})
+            self.assertIsInstance(locations['A1403AE'], HTTPError)
+            self.assertEqual(nomis.get_location('A1401AE', use_cache=True), locations['A1401AE'])
+            self.assertEqual(len(rsps.calls), 3)
+
+
+class AsyncConnectorTestCase(BaseTestCase):
+    """
+    Tests related to the asyncio connector.
+    """
+
+    def setUp(self):
+        super().setUp()
+        nomis.async_connector.forget_token()
+
+    def build_client(self, *responses_to_return):
+        self.requests_made = []
+        responses_to_return = list(responses_to_return)
+
+        def handler(request):
+            self.requests_made.append(request)
+            return responses_to_return.pop(0)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def test_get(self):
+        """
+        Test that the async connector makes authenticated calls using the cached token.
+        """
+        await django_cache.cache.aset(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        client = self.build_client(httpx.Response(200, json={'cash': 500, 'savings': 0, 'spends': 25}))
+
+        balances = await nomis.aget_account_balances('BMI', 'A1471AE', client=client)
+
+        self.assertEqual(balances, {'cash': 500, 'savings': 0, 'spends': 25})
+        self.assertEqual(len(self.requests_made), 1)
+        request = self.requests_made[0]
+        self.assertEqual(str(request.url), build_prison_api_v1_url('/prison/BMI/offenders/A1471AE/accounts'))
+        self.assertEqual(request.headers['Authorization'], 'Bearer some-token')
+
+    async def test_retries_after_401_response(self):
+        """
+        Test that the async connector invalidates the cached token and retries with a new one after a 401.
+        """
+        await django_cache.cache.aset(nomis.Connector.TOKEN_CACHE_KEY, 'invalid-token')
+        client = self.build_client(
+            httpx.Response(401),
+            httpx.Response(200, json={'establishment': {'code': 'BXI', 'desc': 'BRIXTON (HMP)'}}),
+        )
+
+        with responses.RequestsMock() as rsps, silence_logger('mtp'):
+            self._mock_successful_auth_request(rsps, token='my-token')
+            location = await nomis.aget_location('A1401AE', client=client)
+
+        self.assertEqual(location, {'nomis_id': 'BXI', 'name': 'BRIXTON (HMP)'})
+        self.assertEqual(len(self.requests_made), 2)
+        self.assertEqual(self.requests_made[1].headers['Authorization'], 'Bearer my-token')
+        self.assertEqual(await django_cache.cache.aget(nomis.Connector.TOKEN_CACHE_KEY), 'my-token')
+
+    async def test_retries_on_server_error(self):
+        """
+        Test that the async connector retries on erroneous status codes and raises if retries run out.
+        """
+        await django_cache.cache.aset(nomis.Connector.TOKEN_CACHE_KEY, 'some-token')
+        client = self.build_client(httpx.Response(502), httpx.Response(503))
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            await nomis.aget_photograph_data('A1471AE', retries=1, client=client)
+        self.assertEqual(len(self.requests_made), 2)
+
+    def test_not_substitutable_for_connector(self):
+        """
+        Test that the async connector shares token handling with the synchronous one without subclassing it
+        since its methods are coroutines.
+        """
+        self.assertIsInstance(nomis.async_connector, nomis.BaseConnector)
+        self.assertNotIsInstance(nomis.async_connector, nomis.Connector)
+
+    def test_run_closes_pooled_client(self):
+        """
+        Test that running a coroutine with the async connector closes the pooled client of its event loop.
+        """
+        async def get_client():
+            return nomis.async_connector.client
+
+        client = nomis.async_connector.run(get_client())
+        self.assertTrue(client.is_closed)
+
+    def test_httpx_required(self):
+        """
+        Test that the async connector reports that httpx is missing rather than failing to catch its exceptions.
+        """
+        with mock.patch.object(nomis, 'httpx', None):
+            with self.assertRaises(ImproperlyConfigured):
+                asyncio.run(nomis.async_connector.get('/some/path'))
+            with self.assertRaises(ImproperlyConfigured):
+                asyncio.run(nomis.aget_location('A1409AE', use_cache=True))
+
+
+class PrisonApiStandInTestCase(BaseTestCase):
+    def test_benchmark(self):
+        """
+        Test that the connector can be benchmarked against the stand-in, fetching one token.
+        """
+        with PrisonApiStandIn() as stand_in:
+            results = benchmark_connector(stand_in, calls=20, concurrency=4)
+
+        self.assertEqual(results['calls'], 20)
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['token_refreshes'], 1)
+        self.assertEqual(stand_in.api_requests, 20)
+        self.assertGreater(results['throughput'], 0)
+        self.assertLessEqual(results['p50'], results['p95'])
+        self.assertLessEqual(results['p95'], results['p99'])
+
+    def test_expired_tokens(self):
+        """
+        Test that the connector fetches a new token when the stand-in rejects the cached one.
+        """
+        with PrisonApiStandIn() as stand_in, stand_in.settings():
+            self.assertEqual(nomis.get_location('A1401AE')['nomis_id'], 'BXI')
+            stand_in.expire_tokens()
+            with silence_logger('mtp'):
+                self.assertEqual(nomis.get_account_balances('BXI', 'A1401AE')['cash'], 1000)
+            transaction = nomis.create_transaction('BXI', 'A1401AE', 1000, 'ref-1', 'Sent money', 'MTDS')
+            self.assertIn('id', transaction)
+
+        self.assertEqual(stand_in.token_requests, 2)
+        self.assertEqual(stand_in.api_requests, 4)
+
+    def test_benchmark_fails_threshold(self):
+        """
+        Test that the benchmark reports latency exceeding the threshold.
+        """
+        _, failures = benchmark_nomis(calls=4, concurrency=2, latency=0.01, max_p95=0.001)
+        self.assertEqual(len(failures), 1)
+        self.assertIn('95th percentile latency', failures[0])
@@ -1,9 +1,12 @@
+import json
+import time
 from unittest import mock
 
 from django.conf import settings
 from django.core.cache import cache
 import responses
 
+from mtp_common.api import NOTIFICATIONS_CACHE_KEY, NOTIFICATIONS_REFRESH_LOCK_KEY, all_notifications_for_request
 from mtp_common.auth import urljoin, MojAnonymousUser
 from mtp_common.auth.test_utils import generate_tokens
 from mtp_common.test_utils import silence_logger
@@ -11,6 +14,10 @@ from tests.utils import SimpleTestCase
 
 
 class NotificationTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
     def unauthenticated_request(self):
         return mock.MagicMock(
             user=MojAnonymousUser()
@@ -86,19 +93,19 @@ class NotificationTestCase(SimpleTestCase):
         with responses.RequestsMock() as rsps:
             rsps.add(
                 rsps.GET,
-                urljoin(settings.API_URL, 'notifications') + '?target__startswith=target1',
-                match_querystring=True,
-                json={'count': 0, 'results': []},
-            )
-            rsps.add(
-                rsps.GET,
-                urljoin(settings.API_URL, 'notifications') + '?target__startswith=target2',
-                match_querystring=True,
-                json={'count': 1, 'results': [{
-                    'target': 'target2', 'level': 'warning',
-                    'headline': 'Test', 'message': 'Body',
-                    'start': '2017-11-29T12:00:00Z', 'end': None,
-                }]},
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 2, 'results': [
+                    {
+                        'target': 'target2_login', 'level': 'warning',
+                        'headline': 'Test', 'message': 'Body',
+                        'start': '2017-11-29T12:00:00Z', 'end': None,
+                    },
+                    {
+                        'target': 'other', 'level': 'info',
+                        'headline': 'Other', 'message': 'Body',
+                        'start': '2017-11-29T12:00:00Z', 'end': None,
+                    },
+                ]},
             )
             response = self.load_mocked_template(
                 """
@@ -107,8 +114,29 @@ class NotificationTestCase(SimpleTestCase):
                 """,
                 {'request': self.authenticated_request()},
             )
+            self.assertEqual(len(rsps.calls), 1)
         response_content = response.content.decode(response.charset).strip()
         self.assertIn('Test', response_content)
+        self.assertNotIn('Other', response_content)
+
+    def test_notifications_memoised_on_request(self):
+        cache.clear()
+        request = self.authenticated_request()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 0, 'results': []},
+            )
+            self.load_mocked_template(
+                """
+                {% load mtp_common %}
+                {% notification_banners request 'target1' 'target2' %}
+                {% notification_banners request 'target3' %}
+                """,
+                {'request': request},
+            )
+            self.assertEqual(len(rsps.calls), 1)
 
     def test_notifications_with_cache(self):
         cache.clear()
@@ -176,3 +204,160 @@ class NotificationTestCase(SimpleTestCase):
             )
         response_content = response.content.decode(response.charset).strip()
         self.assertIn('Test', response_content)
+
+    def render_notifications(self):
+        response = self.load_mocked_template(
+            """
+            {% load mtp_common %}
+            {% notification_banners request 'target' %}
+            """,
+            {'request': self.authenticated_request()},
+        )
+        return response.content.decode(response.charset).strip()
+
+    def wait_for_refresh(self, audience='public'):
+        for _ in range(100):
+            if cache.get(NOTIFICATIONS_REFRESH_LOCK_KEY % audience) is None:
+                return
+            time.sleep(0.01)
+        self.fail('Notifications were not refreshed')
+
+    def cache_stale_notifications(self, audience='public'):
+        cache.set(NOTIFICATIONS_CACHE_KEY % audience, {
+            'notifications': [{
+                'target': 'target', 'level': 'warning',
+                'headline': 'Stale', 'message': 'Body',
+                'start': '2017-11-29T12:00:00Z', 'end': None,
+            }],
+            'fresh_until': time.time() - 1,
+        })
+
+    def test_empty_notifications_cached(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 0, 'results': []},
+            )
+            self.assertEqual(self.render_notifications(), '')
+            self.assertEqual(self.render_notifications(), '')
+            self.assertEqual(len(rsps.calls), 1)
+
+    def test_stale_notifications_served_while_refreshing(self):
+        self.cache_stale_notifications()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 1, 'results': [{
+                    'target': 'target', 'level': 'warning',
+                    'headline': 'Fresh', 'message': 'Body',
+                    'start': '2017-11-29T12:00:00Z', 'end': None,
+                }]},
+            )
+            self.assertIn('Stale', self.render_notifications())
+            self.wait_for_refresh()
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertIn('Fresh', self.render_notifications())
+
+    def test_stale_notifications_refreshed_without_request_session(self):
+        self.cache_stale_notifications(audience='authenticated')
+        request = self.authenticated_request()
+        request.user.token = generate_tokens(expires_at=time.time() + 30)
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 0, 'results': []},
+            )
+            self.assertEqual(all_notifications_for_request(request)[0]['headline'], 'Stale')
+            self.wait_for_refresh(audience='authenticated')
+            # the background thread uses the user's token without refreshing it
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertEqual(
+                rsps.calls[0].request.headers['Authorization'], f'Bearer {request.user.token["access_token"]}',
+            )
+        # but does not share the request's session or save tokens into it
+        self.assertNotIsInstance(request._mtp_api_session, tuple)
+        request.session.__setitem__.assert_not_called()
+        self.assertEqual(cache.get(NOTIFICATIONS_CACHE_KEY % 'authenticated')['notifications'], [])
+
+    def test_stale_public_notifications_refreshed_anonymously(self):
+        self.cache_stale_notifications()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 0, 'results': []},
+            )
+            all_notifications_for_request(self.unauthenticated_request())
+            self.wait_for_refresh()
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertNotIn('Authorization', rsps.calls[0].request.headers)
+
+    def test_stale_notifications_refreshed_once(self):
+        self.cache_stale_notifications()
+        cache.set(NOTIFICATIONS_REFRESH_LOCK_KEY % 'public', True)
+        with responses.RequestsMock() as rsps:
+            self.assertIn('Stale', self.render_notifications())
+            self.assertIn('Stale', self.render_notifications())
+            self.assertEqual(len(rsps.calls), 0)
+
+    def test_stale_notifications_served_during_api_outage(self):
+        self.cache_stale_notifications()
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                body='error', status=500,
+            )
+            self.assertIn('Stale', self.render_notifications())
+            self.wait_for_refresh()
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertEqual(cache.get(NOTIFICATIONS_CACHE_KEY % 'public')['notifications'][0]['headline'], 'Stale')
+
+    def test_notifications_cached_separately_for_authenticated_users(self):
+        self.cache_stale_notifications(audience='authenticated')
+        cache.set(NOTIFICATIONS_REFRESH_LOCK_KEY % 'authenticated', True)
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET,
+                urljoin(settings.API_URL, 'notifications'),
+                json={'count': 1, 'results': [{
+                    'target': 'target', 'level': 'info',
+                    'headline': 'Public', 'message': 'Body',
+                    'start': '2017-11-29T12:00:00Z', 'end': None,
+                }]},
+            )
+            anonymous_notifications = all_notifications_for_request(self.unauthenticated_request())
+            authenticated_notifications = all_notifications_for_request(self.authenticated_request())
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertNotIn('Authorization', rsps.calls[0].request.headers)
+        self.assertEqual(anonymous_notifications[0]['headline'], 'Public')
+        self.assertEqual(authenticated_notifications[0]['headline'], 'Stale')
+
+    def test_all_pages_of_notifications_loaded(self):
+        notifications = [
+            {
+                'target': None, 'level': 'info',
+                'headline': 'Untargeted', 'message': 'Body',
+                'start': '2017-11-29T12:00:00Z', 'end': None,
+            },
+            {
+                'target': 'target', 'level': 'warning',
+                'headline': 'Test', 'message': 'Body',
+                'start': '2017-11-29T12:00:00Z', 'end': None,
+            },
+        ]
+
+        def callback(request):
+            # the api caps the page size to 1
+            offset = int(request.params['offset'])
+            return 200, {}, json.dumps({'count': len(notifications), 'results': notifications[offset:offset + 1]})
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(rsps.GET, urljoin(settings.API_URL, 'notifications'), callback=callback)
+            response_content = self.render_notifications()
+            self.assertEqual(len(rsps.calls), 2)
+        self.assertIn('Test', response_content)
+        self.assertNotIn('Untargeted', response_content)